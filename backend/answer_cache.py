@@ -0,0 +1,139 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import document_events
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "on")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# messages of recent conversation an answer is keyed on, as follow-ups depend on them
+ANSWER_CACHE_CONTEXT_MESSAGES = int(os.getenv("ANSWER_CACHE_CONTEXT_MESSAGES", "4"))
+
+
+def context_digest(histories, messages=ANSWER_CACHE_CONTEXT_MESSAGES):
+    """A digest of the last `messages` chat turns (oldest first), or None when there are none"""
+    recent = list(histories)[-messages:] if messages > 0 else []
+    if not recent:
+        return None
+    digest = hashlib.sha256()
+    for m in recent:
+        digest.update(f"{m['role']}\0{m['message']}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("embedding", "answer", "document_ids", "files", "context", "created_at")
+
+    def __init__(self, embedding, answer, document_ids, files, context):
+        self.embedding = embedding
+        self.answer = answer
+        self.document_ids = document_ids
+        self.files = files
+        self.context = context
+        self.created_at = time.time()
+
+
+class AnswerCache:
+    """
+    Semantic cache of bot answers keyed on the question embedding.
+    A cached answer is reused when a new question is at least `threshold`
+    cosine-similar to the cached one, retrieval returned the same documents and
+    the recent conversation (see context_digest) is the same, so a follow-up
+    like "and the second one?" is not answered from another conversation.
+    Entries expire after `ttl` seconds, are evicted least-recently-used past
+    `max_entries`, and are dropped when a document (or file) they cite changes.
+    """
+
+    def __init__(self, threshold=0.95, ttl=86400, max_entries=2000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalise(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def lookup(self, query_embedding, references, histories=()):
+        """Return a cached answer for this question, set of references and recent history, or None"""
+        query = self._normalise(query_embedding)
+        document_ids = frozenset(doc["id"] for doc in references)
+        context = context_digest(histories)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key, entry in list(self.entries.items()):
+                if now - entry.created_at > self.ttl:
+                    del self.entries[key]
+                    continue
+                if entry.document_ids != document_ids or entry.context != context:
+                    continue
+                score = float(entry.embedding @ query)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return self.entries[best_key].answer
+
+    def store(self, query_embedding, references, answer, histories=()):
+        entry = _Entry(
+            self._normalise(query_embedding),
+            answer,
+            frozenset(doc["id"] for doc in references),
+            frozenset(doc.get("file_storage_path") for doc in references if doc.get("file_storage_path")),
+            context_digest(histories),
+        )
+        with self._lock:
+            self.entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, document_ids=(), files=()):
+        document_ids, files = set(document_ids), set(files)
+        with self._lock:
+            stale = [key for key, entry in self.entries.items()
+                     if entry.document_ids & document_ids or entry.files & files]
+            for key in stale:
+                del self.entries[key]
+        return len(stale)
+
+    def on_document_event(self, kind, payload):
+        files = [row.get("file_storage_path") for row in payload if row.get("file_storage_path")] if kind == "upsert" else []
+        self.invalidate(document_events.document_ids(kind, payload), files)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl=ANSWER_CACHE_TTL_SECONDS,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+)
+
+
+def enabled():
+    return ANSWER_CACHE == "on"
+
+
+if enabled():
+    document_events.subscribe(cache.on_document_event)
@@ -0,0 +1,235 @@
+"""
+Chat latency under concurrent chats, against the offline stand-ins (see benchmarks.fakes).
+
+Seeds a synthetic corpus, then for each concurrency level runs that many chats
+at once, each asking --questions questions one after another. The whole path
+runs: history, query embedding, retrieval (match_documents RPC, or the local
+index with VECTOR_INDEX=local), prompt, completion and the history write.
+
+  --via direct    calls chat_with_bot / stream_chat_with_bot (--stream)
+  --via telegram  sends simulated webhook updates through the worker loop
+                  (serve_updates) to the bot handlers, which reply through the
+                  fake Bot API. Measures time until the reply is first visible
+                  and until it is complete.
+
+    cd backend
+    python -m benchmarks.bench_chat --chats 1 8 32
+    python -m benchmarks.bench_chat --via telegram --chats 16 --first-token-latency 1.0 --json
+    python -m benchmarks.bench_chat --env VECTOR_INDEX=local RETRIEVAL_MODE=hybrid
+"""
+import time
+import queue
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+from benchmarks import fakes
+from benchmarks.common import emit, progress_output, latency_ms, stage_seconds, print_stages
+from benchmarks.bench_chunker import synthetic_text
+
+
+def seed_corpus(fake_supabase, documents, dim, seed=0):
+    """documents rows with embeddings straight into the fake (no API calls); returns their texts"""
+    import embedding_codec
+    from utils import EMBEDDING_DIMENSIONS
+    rng = random.Random(seed)
+    rows = []
+    for i in range(documents):
+        content = synthetic_text(rng.randint(150, 300), seed=seed + i)
+        rows.append({
+            "content": content,
+            **embedding_codec.encode(embedding_codec.reduce(fakes.embed(content, dim), EMBEDDING_DIMENSIONS)),
+            "file_name": f"doc{i // 20}.pdf",
+            "file_path": f"bench/doc{i // 20}.pdf",
+            "file_type": "pdf",
+            "file_storage_path": f"bench/doc{i // 20}.pdf",
+            "chunk_index": i % 20,
+            "metadata": {"page": i % 20 + 1},
+        })
+    fake_supabase.insert_rows("documents", rows)
+    return [row["content"] for row in rows]
+
+
+def question_from(texts, rng):
+    words = rng.choice(texts).split()
+    start = rng.randrange(max(1, len(words) - 8))
+    return " ".join(words[start:start + rng.randint(4, 8)]).rstrip(".?!") + "?"
+
+
+async def run_direct(chat_agent, chats, questions, texts, stream, first_chat_id):
+    """Returns (per-answer seconds, per-answer seconds to first token or None)"""
+    latencies, first_tokens = [], []
+
+    async def one_chat(chat_id):
+        rng = random.Random(chat_id)
+        user = SimpleNamespace(id=chat_id, first_name="Bench", last_name=str(chat_id), username=f"user{chat_id}")
+        for _ in range(questions):
+            question = question_from(texts, rng)
+            result = {}
+            start = time.perf_counter()
+            if stream:
+                first = None
+                async for _ in chat_agent.stream_chat_with_bot(chat_id, user, question, result):
+                    if first is None:
+                        first = time.perf_counter() - start
+                first_tokens.append(first)
+            else:
+                await chat_agent.chat_with_bot(chat_id, user, question, result)
+            latencies.append(time.perf_counter() - start)
+            chat_agent.record_turn(chat_id, user, question, result)
+
+    await asyncio.gather(*(one_chat(first_chat_id + n) for n in range(chats)))
+    return latencies, [t for t in first_tokens if t is not None]
+
+
+async def run_telegram(telegram_bot, fake_telegram, chats, questions, texts, first_chat_id, update_id):
+    """Feed webhook updates to a worker loop. Returns (seconds to first visible reply, seconds to complete reply)"""
+    app = telegram_bot.build_application(with_updater=False)
+    updates = queue.Queue()
+    sent_at = {}  # (chat_id, message_id) -> enqueue time
+    serving = asyncio.create_task(telegram_bot.serve_updates(app, updates))
+    log_start = len(fake_telegram.sent)
+    for n in range(questions):
+        for c in range(chats):
+            chat_id = first_chat_id + c
+            message_id = n + 1
+            question = question_from(texts, random.Random(chat_id * 1000 + n))
+            sent_at[(chat_id, message_id)] = time.monotonic()
+            updates.put(fakes.update(update_id + n * chats + c, chat_id, message_id, question))
+    updates.put(None)
+    await serving
+
+    # A chat's updates are handled in order and each answer fits one message, so the
+    # n-th sendMessage of a chat starts the reply to its n-th update and the edits
+    # up to the next sendMessage complete it
+    log = fake_telegram.sent[log_start:]
+    visible, complete = [], []
+    for chat_id in range(first_chat_id, first_chat_id + chats):
+        events = [(t, method) for t, method, chat, _ in log if chat == chat_id]
+        starts = [t for t, method in events if method == "sendMessage"]
+        for n, t in enumerate(starts):
+            enqueued = sent_at.get((chat_id, n + 1))
+            if enqueued is None:
+                continue
+            end = starts[n + 1] if n + 1 < len(starts) else float("inf")
+            visible.append(t - enqueued)
+            complete.append(max(e for e, _ in events if t <= e < end) - enqueued)
+    return visible, complete
+
+
+def load_indexes(timeout=600):
+    """Load the in-process indexes a bot process would use with these settings, before measuring"""
+    import vector_index
+    import bm25
+    import retrieval
+    from utils import get_supabase
+    waits = []
+    if vector_index.enabled():
+        vector_index.start_sync(get_supabase())
+        waits.append(vector_index.ready)
+    if retrieval.RETRIEVAL_MODE != "vector":
+        bm25.start_sync(get_supabase())
+        waits.append(bm25.ready)
+    for ready in waits:
+        if not ready.wait(timeout):
+            raise RuntimeError("Local index did not load in time")
+
+
+async def run_levels(args, texts, fake):
+    import chat_agent
+    import telegram_bot
+    import metrics
+
+    load_indexes()
+    if args.via == "telegram":
+        # a bot process holds chat messages until the coach's settings have arrived
+        import settings
+        from utils import fetch_admin_metadata
+        settings.set_settings(settings.from_metadata(fetch_admin_metadata()))
+    results = []
+    first_chat_id = 1
+    for chats in args.chats:
+        before = metrics.registry.snapshot()
+        start = time.perf_counter()
+        if args.via == "telegram":
+            first, latencies = await run_telegram(telegram_bot, fake.telegram, chats, args.questions, texts,
+                                                  first_chat_id, first_chat_id * 1000)
+        else:
+            latencies, first = await run_direct(chat_agent, chats, args.questions, texts, args.stream, first_chat_id)
+        seconds = time.perf_counter() - start
+        # handler errors are only logged by the bot, so a level with failed replies would look fast
+        expected = chats * args.questions
+        if len(latencies) != expected:
+            raise RuntimeError(f"{chats} concurrent chats: {len(latencies)} of {expected} questions answered")
+        results.append({
+            "chats": chats,
+            "answers": len(latencies),
+            "seconds": round(seconds, 3),
+            "answers_per_second": round(len(latencies) / seconds, 2),
+            "latency_ms": latency_ms(latencies),
+            "first_visible_ms": latency_ms(first),
+            "stages": stage_seconds(before, metrics.registry.snapshot()),
+        })
+        # fresh chats per level, so every level starts with cold history buffers
+        first_chat_id += chats
+    chat_agent.memory.flush()
+    return results
+
+
+def print_text(result):
+    print(f"Chat via {result['settings']['via']} ({result['settings']})")
+    for r in result["levels"]:
+        print(f"\n{r['chats']} concurrent chats: {r['answers']} answers in {r['seconds']}s ({r['answers_per_second']}/s)")
+        print(f"  latency:        {r['latency_ms']}")
+        if r["first_visible_ms"]:
+            print(f"  first visible:  {r['first_visible_ms']}")
+        print_stages(r["stages"], indent="    ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--via", choices=("direct", "telegram"), default="direct")
+    parser.add_argument("--chats", type=int, nargs="+", default=[1, 8, 32], help="concurrency levels")
+    parser.add_argument("--questions", type=int, default=3, help="questions per chat")
+    parser.add_argument("--stream", action="store_true", help="direct: use stream_chat_with_bot")
+    parser.add_argument("--documents", type=int, default=2000, help="size of the seeded corpus")
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--embedding-latency", type=float, default=0.1)
+    parser.add_argument("--first-token-latency", type=float, default=0.5)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--completion-tokens", type=int, default=80)
+    parser.add_argument("--supabase-latency", type=float, default=0.005)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE", help="backend settings for this run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    if args.via == "telegram":
+        env.setdefault("STREAM_REPLIES", "on" if args.stream else "off")
+        # replies are not throttled by the real per-message edit limit of Telegram
+        env.setdefault("STREAM_EDIT_INTERVAL", "0.2")
+    fake = fakes.start(env, supabase_latency=args.supabase_latency, telegram_latency=args.telegram_latency,
+                       dim=args.dim, embedding_latency=args.embedding_latency,
+                       first_token_latency=args.first_token_latency, token_interval=args.token_interval,
+                       completion_tokens=args.completion_tokens)
+    with progress_output(args.json):
+        texts = seed_corpus(fake.supabase, args.documents, args.dim)
+        levels = asyncio.run(run_levels(args, texts, fake))
+    fake.stop()
+
+    emit({
+        "benchmark": "chat",
+        "settings": {
+            "via": args.via, "stream": args.stream, "questions": args.questions, "documents": args.documents,
+            "dim": args.dim, "embedding_latency": args.embedding_latency,
+            "first_token_latency": args.first_token_latency, "token_interval": args.token_interval,
+            "completion_tokens": args.completion_tokens, "supabase_latency": args.supabase_latency,
+            "telegram_latency": args.telegram_latency, "env": env,
+        },
+        "levels": levels,
+    }, args.json, print_text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Chunker throughput and token-size benchmark.
+
+Compares the token/sentence-aware chunker with the legacy 300/50 word-window chunker.
+
+    cd backend
+    python -m benchmarks.bench_chunker                 # synthetic 200k-word corpus
+    python -m benchmarks.bench_chunker transcript.txt  # your own text files
+"""
+import sys
+import time
+import random
+import argparse
+import statistics
+from chunker import iter_token_chunks, chunk_words, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from tokenizer import count_tokens
+
+VOCABULARY = [
+    "coach", "client", "session", "goal", "habit", "program", "week", "exercise", "focus",
+    "energy", "mindset", "plan", "progress", "review", "the", "a", "and", "to", "of", "with",
+    "your", "we", "will", "build", "strength", "routine", "daily", "check", "in", "results",
+]
+
+
+def synthetic_text(words, seed=0):
+    rng = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < words:
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            n = rng.randint(4, 30)
+            sentence = " ".join(rng.choice(VOCABULARY) for _ in range(n))
+            sentences.append(sentence.capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+            total += n
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def distribution(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "min": values[0],
+        "p10": values[len(values) // 10],
+        "p50": values[len(values) // 2],
+        "p90": values[len(values) * 9 // 10],
+        "max": values[-1],
+        "mean": round(statistics.mean(values), 1),
+        "stdev": round(statistics.pstdev(values), 1),
+    }
+
+
+def bench(name, chunk_fn, text, repeat):
+    best = float("inf")
+    chunks = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = chunk_fn(text)
+        best = min(best, time.perf_counter() - start)
+    tokens = [count_tokens(c) for c in chunks]
+    sentence_ends = sum(1 for c in chunks if c.rstrip().endswith((".", "!", "?")))
+    return {
+        "name": name,
+        "chunks": len(chunks),
+        "seconds": round(best, 4),
+        "chunks_per_second": round(len(chunks) / best) if best else None,
+        "mb_per_second": round(len(text.encode("utf-8")) / best / 1e6, 2) if best else None,
+        "ends_on_sentence": round(sentence_ends / len(chunks), 3) if chunks else None,
+        "tokens": distribution(tokens),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="text files to chunk (default: synthetic corpus)")
+    parser.add_argument("--words", type=int, default=200_000, help="size of the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+
+    if args.files:
+        text = "\n\n".join(open(path, encoding="utf-8").read() for path in args.files)
+    else:
+        text = synthetic_text(args.words)
+    print(f"Corpus: {len(text.split())} words, {len(text.encode('utf-8')) / 1e6:.2f} MB")
+
+    token_chunker = lambda t: [c.text for c in iter_token_chunks([t], args.chunk_tokens, args.overlap_tokens)]
+    results = [
+        bench("legacy 300/50 words", chunk_words, text, args.repeat),
+        bench(f"token {args.chunk_tokens}/{args.overlap_tokens}", token_chunker, text, args.repeat),
+    ]
+    for r in results:
+        print(f"\n{r['name']}")
+        print(f"  chunks:            {r['chunks']}")
+        print(f"  time:              {r['seconds']}s ({r['chunks_per_second']} chunks/s, {r['mb_per_second']} MB/s)")
+        print(f"  ends on sentence:  {r['ends_on_sentence']}")
+        print(f"  tokens per chunk:  {r['tokens']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Import-time benchmark for the backend modules.
+
+Imports each module in a fresh interpreter (like a new worker would) and
+reports the wall time, plus the slowest imports from `python -X importtime`.
+Importing must not touch the network, so this works without Supabase/OpenAI.
+
+    cd backend
+    python -m benchmarks.bench_import                     # main, ingestion, telegram_bot, chat_agent
+    python -m benchmarks.bench_import ingestion --top 20  # one module, 20 slowest imports
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_MODULES = ["main", "ingestion", "telegram_bot", "chat_agent"]
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module, repeat):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr}")
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def slowest_imports(module, top):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=BACKEND_DIR, capture_output=True, text=True)
+    rows = []
+    # lines look like "import time:      1234 |      5678 |   package.module"
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per module (0 = none)")
+    args = parser.parse_args()
+
+    print(f"{'module':<16}{'median':>10}{'min':>10}{'max':>10}")
+    for module in args.modules:
+        timings = time_import(module, args.repeat)
+        print(f"{module:<16}{statistics.median(timings) * 1000:>8.0f}ms{min(timings) * 1000:>8.0f}ms{max(timings) * 1000:>8.0f}ms")
+
+    if args.top:
+        for module in args.modules:
+            print(f"\nslowest imports under {module} (self / cumulative):")
+            for self_us, cumulative_us, name in slowest_imports(module, args.top):
+                print(f"  {self_us / 1000:>8.1f}ms {cumulative_us / 1000:>8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
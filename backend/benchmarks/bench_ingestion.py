@@ -0,0 +1,169 @@
+"""
+Ingestion throughput against the offline stand-ins (see benchmarks.fakes).
+
+Runs process_file on each file as the ingestion worker would: download from
+storage, extract (OCR for scanned pages), chunk, embed and insert. Then runs it
+again to time re-ingesting the unchanged file, and once more with the file
+stored under a new name, as a dashboard re-upload. Without arguments it generates a
+text PDF, a DOCX and a scanned (image-only) PDF. The scanned file needs the
+tesseract binary.
+
+    cd backend
+    python -m benchmarks.bench_ingestion
+    python -m benchmarks.bench_ingestion handbook.pdf notes.docx --embedding-latency 0.3 --json
+"""
+import os
+import time
+import argparse
+import tempfile
+from benchmarks import fakes
+from benchmarks.common import emit, progress_output, stage_seconds, print_stages
+from benchmarks.bench_chunker import synthetic_text
+
+BUCKET = "coaching-files"
+USER_ID = "00000000-0000-4000-8000-0000000000aa"
+
+
+def make_text_pdf(path, pages, seed=0):
+    import fitz
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), synthetic_text(450, seed=seed + i), fontsize=9)
+    doc.save(path)
+
+
+def make_docx(path, words, seed=0):
+    import docx
+    document = docx.Document()
+    for paragraph in synthetic_text(words, seed=seed).split("\n\n"):
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def make_scanned_pdf(path, pages, seed=0):
+    """Pages that are only an image of text, as a scanner produces"""
+    import io
+    import textwrap
+    import fitz
+    from PIL import Image, ImageDraw
+    doc = fitz.open()
+    for i in range(pages):
+        image = Image.new("L", (1275, 1650), 255)  # Letter at 150 DPI
+        draw = ImageDraw.Draw(image)
+        lines = textwrap.wrap(synthetic_text(300, seed=seed + i), 90)
+        for n, line in enumerate(lines[:70]):
+            draw.text((75, 75 + n * 21), line, fill=0)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    doc.save(path)
+
+
+def sample_files(directory, pages, scanned_pages):
+    samples = [
+        (os.path.join(directory, "sample.pdf"), lambda p: make_text_pdf(p, pages)),
+        (os.path.join(directory, "sample.docx"), lambda p: make_docx(p, pages * 450, seed=1)),
+        (os.path.join(directory, "scanned.pdf"), lambda p: make_scanned_pdf(p, scanned_pages, seed=2)),
+    ]
+    files = []
+    for path, make in samples:
+        make(path)
+        files.append(path)
+    return files
+
+
+def ingest(ingestion, metrics, storage_path, file_name, file_type):
+    fields = {}
+    before = metrics.registry.snapshot()
+    start = time.perf_counter()
+    ingestion.process_file(storage_path, file_name, storage_path, file_type, USER_ID,
+                           progress=lambda **progress: fields.update(progress))
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": round(seconds, 3),
+        "chunks": {k: fields.get(k, 0) for k in ("inserted", "reused", "updated", "deleted")},
+        "stages": stage_seconds(before, metrics.registry.snapshot()),
+    }
+
+
+def bench_file(ingestion, metrics, fake_supabase, path):
+    file_type = path.rsplit(".", 1)[-1].lower()
+    file_name = os.path.basename(path)
+    # the dashboard stores every upload under a new random name
+    storage_path, reupload_path = (f"{USER_ID}/{n}-{file_name}" for n in (1, 2))
+    with open(path, "rb") as f:
+        data = f.read()
+    fake_supabase.put_file(BUCKET, storage_path, data)
+    fake_supabase.put_file(BUCKET, reupload_path, data)
+    result = {"file": file_name, "type": file_type, "bytes": len(data)}
+    try:
+        first = ingest(ingestion, metrics, storage_path, file_name, file_type)
+        again = ingest(ingestion, metrics, storage_path, file_name, file_type)
+        reupload = ingest(ingestion, metrics, reupload_path, file_name, file_type)
+    except Exception as e:
+        return {**result, "error": f"{type(e).__name__}: {e}"}
+    chunks = first["chunks"]["inserted"] + first["chunks"]["reused"]
+    if chunks == 0:
+        return {**result, "error": "no chunks stored (extraction failed?)", "first": first}
+    return {
+        **result,
+        "first": first,
+        "reingest": again,
+        "reupload": reupload,
+        "chunks_per_second": round(chunks / first["seconds"], 1),
+        "mb_per_second": round(len(data) / first["seconds"] / 1e6, 3),
+    }
+
+
+def print_text(result):
+    print(f"Ingestion ({result['settings']})")
+    for r in result["files"]:
+        print(f"\n{r['file']} ({r['bytes'] / 1e6:.2f} MB)")
+        if "error" in r:
+            print(f"  error: {r['error']}")
+            continue
+        print(f"  first run:   {r['first']['seconds']}s, {r['chunks_per_second']} chunks/s, {r['mb_per_second']} MB/s, {r['first']['chunks']}")
+        print_stages(r["first"]["stages"], indent="    ")
+        print(f"  re-ingest:   {r['reingest']['seconds']}s, {r['reingest']['chunks']}")
+        print(f"  re-upload:   {r['reupload']['seconds']}s, {r['reupload']['chunks']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="pdf/docx/txt files (default: generated samples)")
+    parser.add_argument("--pages", type=int, default=40, help="pages of the generated text PDF and DOCX")
+    parser.add_argument("--scanned-pages", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=3072, help="embedding dimensions returned by the fake")
+    parser.add_argument("--embedding-latency", type=float, default=0.2, help="seconds per embeddings request")
+    parser.add_argument("--supabase-latency", type=float, default=0.005, help="seconds per Supabase request")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    fake = fakes.start(dim=args.dim, embedding_latency=args.embedding_latency, supabase_latency=args.supabase_latency)
+    with progress_output(args.json):
+        # backend modules read their settings at import, so they come after the fakes
+        import ingestion
+        import metrics
+
+        with tempfile.TemporaryDirectory() as directory:
+            files = args.files or sample_files(directory, args.pages, args.scanned_pages)
+            results = [bench_file(ingestion, metrics, fake.supabase, path) for path in files]
+    fake.stop()
+
+    emit({
+        "benchmark": "ingestion",
+        "settings": {
+            "dim": args.dim,
+            "embedding_latency": args.embedding_latency,
+            "supabase_latency": args.supabase_latency,
+            "batch_size": ingestion.INGEST_BATCH_SIZE,
+            "max_in_flight": ingestion.INGEST_MAX_IN_FLIGHT,
+        },
+        "files": results,
+    }, args.json, print_text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Retrieval latency and quality at growing corpus sizes (1k to 1M chunks), in process.
+
+Builds a synthetic corpus of clustered unit vectors, each with a text drawn
+from its cluster's vocabulary. Then it times building the local vector index
+(VECTOR_INDEX_DTYPE / IVF settings) and the BM25 index, and queries each mode.
+Every query is a perturbed copy of one document's vector plus a few of its
+words. Reported per mode:
+
+  latency_ms       per query
+  hit_rate         how often that document is in the top k
+  recall_vs_exact  vector only: overlap with exact float32 search (what int8 or IVF costs)
+
+For eval on real questions and documents use benchmarks.eval_retrieval instead.
+
+    cd backend
+    python -m benchmarks.bench_retrieval                                   # 1k, 10k, 100k
+    python -m benchmarks.bench_retrieval --sizes 1000000 --dtype int8 --nlist 1024 --modes vector --json
+"""
+import time
+import argparse
+import numpy as np
+from vector_index import VectorIndex
+from bm25 import BM25Index
+from retrieval import combine, RETRIEVAL_CANDIDATES
+from benchmarks.common import emit, latency_ms
+
+BLOCK = 10_000
+MODES = ("vector", "bm25", "hybrid")
+
+
+class Corpus:
+    """Deterministic synthetic corpus, generated block by block so 1M rows never need to be held as float32 twice"""
+
+    def __init__(self, size, dim, seed=0, words_per_doc=60):
+        self.size = size
+        self.dim = dim
+        self.seed = seed
+        self.words_per_doc = words_per_doc
+        rng = np.random.default_rng(seed)
+        self.topics = max(8, size // 500)
+        self.centroids = rng.standard_normal((self.topics, dim)).astype(np.float32)
+        # each topic draws most of its words from its own 40-word vocabulary
+        self.topic_words = rng.integers(0, 50_000, size=(self.topics, 40))
+
+    def block(self, b):
+        """(ids, topic per row, unit vectors) of rows b*BLOCK .. (b+1)*BLOCK"""
+        rng = np.random.default_rng((self.seed, 0, b))
+        start, stop = b * BLOCK, min(self.size, (b + 1) * BLOCK)
+        topics = rng.integers(0, self.topics, size=stop - start)
+        vectors = self.centroids[topics] + rng.standard_normal((stop - start, self.dim)).astype(np.float32) * 0.8
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.arange(start, stop) + 1, topics, vectors
+
+    def text(self, doc_id, topic):
+        rng = np.random.default_rng((self.seed, 1, doc_id))
+        own = rng.choice(self.topic_words[topic], size=self.words_per_doc * 2 // 3)
+        common = rng.integers(0, 50_000, size=self.words_per_doc // 3)
+        return " ".join(f"w{w}" for w in np.concatenate([own, common]))
+
+    def blocks(self):
+        return range((self.size + BLOCK - 1) // BLOCK)
+
+
+def build(corpus, modes, dtype, nlist, nprobe):
+    vectors = VectorIndex(dtype=dtype, nlist=nlist, nprobe=nprobe) if {"vector", "hybrid"} & set(modes) else None
+    keywords = BM25Index() if {"bm25", "hybrid"} & set(modes) else None
+    seconds = {name: 0.0 for name, index in (("vector", vectors), ("bm25", keywords)) if index is not None}
+    for b in corpus.blocks():
+        ids, topics, block_vectors = corpus.block(b)
+        rows = [{"id": int(i), "content": corpus.text(int(i), t), "file_type": "pdf", "chunk_index": 0}
+                for i, t in zip(ids, topics)]
+        if vectors is not None:
+            start = time.perf_counter()
+            vectors.upsert([{**row, "embedding": v} for row, v in zip(rows, block_vectors)])
+            seconds["vector"] += time.perf_counter() - start
+        if keywords is not None:
+            start = time.perf_counter()
+            keywords.upsert(rows)
+            seconds["bm25"] += time.perf_counter() - start
+    return vectors, keywords, seconds
+
+
+def make_queries(corpus, count, seed=1):
+    """(target id, query vector, query text) for random documents"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    targets = np.sort(rng.choice(corpus.size, size=min(count, corpus.size), replace=False))
+    by_block = {}
+    for target in targets:
+        by_block.setdefault(target // BLOCK, []).append(target)
+    for b, members in by_block.items():
+        ids, topics, block_vectors = corpus.block(b)
+        for target in members:
+            row = target - b * BLOCK
+            vector = block_vectors[row] + rng.standard_normal(corpus.dim).astype(np.float32) * 0.01
+            words = corpus.text(int(ids[row]), topics[row]).split()
+            text = " ".join(rng.choice(words, size=5, replace=False))
+            queries.append((int(ids[row]), vector / np.linalg.norm(vector), text))
+    rng.shuffle(queries)
+    return queries
+
+
+def exact_top_k(corpus, queries, k):
+    """Exact float32 top-k ids per query, streaming the corpus block by block"""
+    matrix = np.stack([q[1] for q in queries])
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for b in corpus.blocks():
+        ids, _, block_vectors = corpus.block(b)
+        scores = np.concatenate([best_scores, matrix @ block_vectors.T], axis=1)
+        all_ids = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return [set(row.tolist()) for row in best_ids]
+
+
+def run_mode(mode, vectors, keywords, queries, k, exact):
+    latencies, hits, overlaps = [], 0, []
+    for (target, vector, text), truth in zip(queries, exact):
+        start = time.perf_counter()
+        if mode == "vector":
+            results = vectors.search(vector, k)
+        elif mode == "bm25":
+            results = keywords.search(text, k)
+        else:
+            candidates = k * RETRIEVAL_CANDIDATES
+            results = combine(text, vectors.search(vector, candidates), keywords.search(text, candidates), k,
+                              mode="hybrid", use_rerank=False)
+        latencies.append(time.perf_counter() - start)
+        ids = [r["id"] for r in results]
+        hits += target in ids
+        if mode == "vector":
+            overlaps.append(len(truth & set(ids)) / k)
+    result = {"mode": mode, "latency_ms": latency_ms(latencies), "hit_rate": round(hits / len(queries), 4)}
+    if overlaps:
+        result["recall_vs_exact"] = round(float(np.mean(overlaps)), 4)
+    return result
+
+
+def bench_size(size, args):
+    corpus = Corpus(size, args.dim)
+    start = time.perf_counter()
+    vectors, keywords, build_seconds = build(corpus, args.modes, args.dtype, args.nlist, args.nprobe)
+    total = time.perf_counter() - start
+    queries = make_queries(corpus, args.queries)
+    exact = exact_top_k(corpus, queries, args.k) if "vector" in args.modes else [set()] * len(queries)
+    return {
+        "size": size,
+        "build_seconds": {name: round(value, 3) for name, value in build_seconds.items()} | {"total": round(total, 3)},
+        "vector_index_mb": round((vectors.matrix.nbytes + vectors.scales.nbytes) / 1e6, 1) if vectors else None,
+        "modes": [run_mode(mode, vectors, keywords, queries, args.k, exact) for mode in args.modes],
+    }
+
+
+def print_size(r):
+    print(f"\n{r['size']} chunks: built in {r['build_seconds']}, vector index {r['vector_index_mb']} MB")
+    for m in r["modes"]:
+        recall = f", recall vs exact {m['recall_vs_exact']}" if "recall_vs_exact" in m else ""
+        print(f"  {m['mode']:<8} p50 {m['latency_ms']['p50']}ms  p95 {m['latency_ms']['p95']}ms  hit rate {m['hit_rate']}{recall}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--dtype", choices=("float32", "float16", "int8"), default="float32")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF clusters (0 = brute force)")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    settings = {k: getattr(args, k) for k in ("dim", "dtype", "nlist", "nprobe", "modes", "queries", "k")}
+    if not args.json:
+        print(f"Retrieval ({settings})")
+    results = []
+    for size in args.sizes:
+        results.append(bench_size(size, args))
+        if not args.json:
+            # sizes print as they finish: the large ones take a while
+            print_size(results[-1])
+    if args.json:
+        emit({"benchmark": "retrieval", "settings": settings, "sizes": results}, True, None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Shared helpers for the scenario benchmarks: result metadata, percentiles and per-stage timings"""
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import subprocess
+import contextlib
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def environment():
+    """What a result was measured on, so runs on different machines or commits are not compared blindly"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def latency_ms(seconds):
+    """Latency percentiles in milliseconds"""
+    values = sorted(seconds)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return {
+        "n": len(values),
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "max": round(values[-1] * 1000, 2),
+        "mean": round(statistics.mean(values) * 1000, 2),
+    }
+
+
+def stage_seconds(before, after):
+    """Per-stage count and total seconds recorded by metrics spans between two registry snapshots"""
+    import metrics
+    old = before.get(metrics.STAGE_SECONDS, {}).get("series", {})
+    new = after.get(metrics.STAGE_SECONDS, {}).get("series", {})
+    stages = {}
+    for key, (_, total, count) in new.items():
+        _, previous_total, previous_count = old.get(key, (None, 0.0, 0))
+        if count == previous_count:
+            continue
+        labels = dict(key)
+        name = labels.pop("stage")
+        if labels:
+            name += "[" + ",".join(f"{k}={v}" for k, v in labels.items()) + "]"
+        stages[name] = {"count": count - previous_count, "seconds": round(total - previous_total, 4)}
+    return dict(sorted(stages.items(), key=lambda item: -item[1]["seconds"]))
+
+
+def progress_output(as_json):
+    """With --json, stdout is only the result: send the backend's progress prints to stderr"""
+    return contextlib.redirect_stdout(sys.stderr) if as_json else contextlib.nullcontext()
+
+
+def emit(result, as_json, print_text):
+    """Print the result as JSON (with the environment), or as text for a person"""
+    if as_json:
+        json.dump({"environment": environment(), **result}, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_text(result)
+
+
+def print_stages(stages, indent="  "):
+    for name, stage in stages.items():
+        print(f"{indent}{name:<32}{stage['seconds']:>10.3f}s  x{stage['count']}")
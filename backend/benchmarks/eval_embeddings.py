@@ -0,0 +1,150 @@
+"""
+Recall of reduced-dimension and quantized embedding profiles against full precision.
+
+A profile is an EMBEDDING_DIMENSIONS and EMBEDDING_ENCODING pair. Each one is
+applied to the stored corpus vectors (shortened and re-normalised like the
+API's `dimensions`, then packed and unpacked), indexed with the matching
+VECTOR_INDEX_DTYPE and searched with the same queries. The reference is exact
+search over the full vectors in float32. Reported per profile:
+
+  recall@k   overlap of the profile's top k with the reference top k
+  bytes      stored bytes per vector, and per row in a JSON request body
+  p50/p95    local search latency
+
+Queries are questions (JSON lines as for benchmarks.eval_retrieval), or else
+a sample of the documents' own vectors, the document itself not counted.
+The corpus must be stored at full size (run before changing EMBEDDING_DIMENSIONS).
+
+    cd backend
+    python -m benchmarks.eval_embeddings --save-documents docs.jsonl
+    python -m benchmarks.eval_embeddings --documents docs.jsonl --questions questions.jsonl
+    python -m benchmarks.eval_embeddings --documents docs.jsonl --dimensions 3072 1024 256 --encodings float16 int8
+"""
+import json
+import time
+import argparse
+import numpy as np
+import embedding_codec
+from vector_index import VectorIndex
+from benchmarks.eval_retrieval import read_jsonl, embed_questions
+
+INDEX_DTYPES = {"json": "float32", "float16": "float16", "int8": "int8"}
+
+
+def load_vectors(path=None):
+    """(ids, float32 matrix) of the stored embeddings, from a JSON-lines dump or from Supabase"""
+    if path:
+        rows = read_jsonl(path)
+    else:
+        from utils import get_supabase
+        from vector_index import fetch_rows
+        # the pgvector column, not the packed one: that may already be quantized
+        rows = list(fetch_rows(get_supabase(), page_size=1000, columns=("id", "embedding")))
+    rows = [row for row in rows if row.get("embedding") is not None or row.get("embedding_packed") is not None]
+    return [row["id"] for row in rows], np.stack([embedding_codec.decode_row(row) for row in rows])
+
+
+def make_queries(ids, matrix, questions_path, sample, seed=0):
+    """(query vectors, id to leave out of each query's results or None)"""
+    if questions_path:
+        questions = read_jsonl(questions_path)
+        embed_questions(questions)
+        vectors = np.asarray([q["embedding"] for q in questions], dtype=np.float32)
+        if vectors.shape[1] != matrix.shape[1]:
+            raise ValueError(f"Questions are embedded with {vectors.shape[1]} dimensions, documents with {matrix.shape[1]}")
+        return vectors, [None] * len(vectors)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(ids), size=min(sample, len(ids)), replace=False)
+    return matrix[picks], [ids[i] for i in picks]
+
+
+def top_ids(index, query, k, exclude):
+    ids = [doc["id"] for doc in index.search(query, k + 1)]
+    return [doc_id for doc_id in ids if doc_id != exclude][:k]
+
+
+def stored_vector(vector, dimensions, encoding):
+    """The vector as read back after writing it with this profile"""
+    vector = embedding_codec.reduce(vector, dimensions)
+    return vector if encoding == "json" else embedding_codec.unpack(embedding_codec.pack(vector, encoding))
+
+
+def build_index(ids, vectors, dtype):
+    index = VectorIndex(dtype=dtype)
+    for start in range(0, len(ids), 10_000):
+        index.upsert([{"id": doc_id, "embedding": vector}
+                      for doc_id, vector in zip(ids[start:start + 10_000], vectors[start:start + 10_000])])
+    return index
+
+
+def evaluate(ids, matrix, queries, excludes, profiles, ks):
+    depth = max(ks)
+    reference = build_index(ids, matrix, "float32")
+    truth = [top_ids(reference, q, depth, ex) for q, ex in zip(queries, excludes)]
+    baseline_payload = embedding_codec.payload_bytes(matrix[0], "json")
+
+    results = []
+    for dimensions, encoding in profiles:
+        stored = np.stack([stored_vector(v, dimensions, encoding) for v in matrix])
+        index = build_index(ids, stored, INDEX_DTYPES[encoding])
+        recalls = {k: [] for k in ks}
+        latencies = []
+        for query, exclude, expected in zip(queries, excludes, truth):
+            query = embedding_codec.reduce(query, dimensions)
+            start = time.perf_counter()
+            found = top_ids(index, query, depth, exclude)
+            latencies.append(time.perf_counter() - start)
+            for k in ks:
+                recalls[k].append(len(set(found[:k]) & set(expected[:k])) / max(1, len(expected[:k])))
+        payload = embedding_codec.payload_bytes(stored[0], encoding)
+        latencies.sort()
+        results.append({
+            "dimensions": dimensions,
+            "encoding": encoding,
+            "vector_bytes": dimensions * 4 if encoding == "json" else len(embedding_codec.pack(stored[0], encoding)),
+            "payload_bytes": payload,
+            "payload_ratio": round(baseline_payload / payload, 1),
+            "recall": {k: round(float(np.mean(values)), 4) for k, values in recalls.items()},
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", help="JSON-lines documents dump (default: read from Supabase)")
+    parser.add_argument("--save-documents", help="write the id and embedding of each document to this JSON-lines file")
+    parser.add_argument("--questions", help="JSON lines with a question (and optional embedding) per line")
+    parser.add_argument("--sample", type=int, default=500, help="documents used as queries without --questions")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[3072, 1536, 1024, 512, 256])
+    parser.add_argument("--encodings", nargs="+", choices=embedding_codec.ENCODINGS, default=list(embedding_codec.ENCODINGS))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    ids, matrix = load_vectors(args.documents)
+    if args.save_documents:
+        with open(args.save_documents, "w", encoding="utf-8") as f:
+            for doc_id, vector in zip(ids, matrix):
+                f.write(json.dumps({"id": doc_id, "embedding": vector.tolist()}) + "\n")
+    full = matrix.shape[1]
+    dimensions = [d for d in args.dimensions if d <= full] or [full]
+    profiles = [(d, e) for d in dimensions for e in args.encodings]
+    queries, excludes = make_queries(ids, matrix, args.questions, args.sample)
+    print(f"{len(ids)} documents with {full} dimensions, {len(queries)} queries")
+
+    results = evaluate(ids, matrix, queries, excludes, profiles, sorted(args.k))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    ks = sorted(args.k)
+    print(f"{'dims':>6} {'encoding':<9}{'bytes':>8}{'payload':>9}{'smaller':>9}"
+          + "".join(f"{'R@' + str(k):>8}" for k in ks) + f"{'p50':>10}{'p95':>10}")
+    for r in results:
+        print(f"{r['dimensions']:>6} {r['encoding']:<9}{r['vector_bytes']:>8}{r['payload_bytes']:>9}{r['payload_ratio']:>8}x"
+              + "".join(f"{r['recall'][k]:>8.3f}" for k in ks) + f"{r['p50_ms']:>8.2f}ms{r['p95_ms']:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Offline retrieval evaluation: recall@k, MRR and latency per retrieval mode.
+
+Questions are JSON lines with the ids of the documents rows that answer them
+(and optionally a precomputed "embedding", otherwise it is embedded once and
+kept in the embedding cache):
+
+    {"question": "How many sets in the 5x5 program?", "relevant": [812, 813]}
+
+Documents come from Supabase, or from a JSON-lines dump (id, content,
+embedding, ...) so runs can be repeated without network access:
+
+    cd backend
+    python -m benchmarks.eval_retrieval questions.jsonl --save-documents docs.jsonl
+    python -m benchmarks.eval_retrieval questions.jsonl --documents docs.jsonl --k 1 3 5 10
+"""
+import json
+import time
+import argparse
+import statistics
+from vector_index import VectorIndex
+from embedding_codec import decode_row
+from bm25 import BM25Index
+from retrieval import combine, RETRIEVAL_CANDIDATES
+
+MODES = {
+    "vector": ("vector", False),
+    "bm25": ("bm25", False),
+    "hybrid": ("hybrid", False),
+    "hybrid+rerank": ("hybrid", True),
+}
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_documents(path=None):
+    if path:
+        return read_jsonl(path)
+    from utils import get_supabase
+    from vector_index import fetch_rows, with_unpacked
+    return with_unpacked(get_supabase(), list(fetch_rows(get_supabase())))
+
+
+def embed_questions(questions):
+    missing = [q for q in questions if q.get("embedding") is None]
+    if missing:
+        from utils import embed_text
+        for q, embedding in zip(missing, embed_text([q["question"] for q in missing])):
+            q["embedding"] = embedding
+
+
+def run_mode(mode, questions, vectors, keywords, ks):
+    name, use_rerank = MODES[mode]
+    depth = max(ks)
+    candidates = depth * RETRIEVAL_CANDIDATES
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks, latencies = [], []
+    for q in questions:
+        start = time.perf_counter()
+        vector_docs = vectors.search(q["embedding"], candidates if name == "hybrid" else depth) if name != "bm25" else None
+        keyword_docs = keywords.search(q["question"], candidates) if name != "vector" else None
+        results = combine(q["question"], vector_docs, keyword_docs, depth, mode=name, use_rerank=use_rerank)
+        latencies.append(time.perf_counter() - start)
+
+        relevant = set(q["relevant"])
+        ids = [doc["id"] for doc in results]
+        for k in ks:
+            recalls[k].append(len(relevant & set(ids[:k])) / max(1, len(relevant)))
+        rank = next((i for i, doc_id in enumerate(ids, start=1) if doc_id in relevant), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "recall": {k: statistics.mean(values) for k, values in recalls.items()},
+        "mrr": statistics.mean(reciprocal_ranks),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="JSON lines: question, relevant ids, optional embedding")
+    parser.add_argument("--documents", help="JSON-lines documents dump (default: read from Supabase)")
+    parser.add_argument("--save-documents", help="write the documents used to this JSON-lines file")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    documents = load_documents(args.documents)
+    if args.save_documents:
+        with open(args.save_documents, "w", encoding="utf-8") as f:
+            for row in documents:
+                vector = decode_row(row)
+                if vector is not None:
+                    row = {**{k: v for k, v in row.items() if k != "embedding_packed"}, "embedding": vector.tolist()}
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    questions = read_jsonl(args.questions)
+    embed_questions(questions)
+
+    start = time.perf_counter()
+    vectors = VectorIndex()
+    vectors.upsert(documents)
+    keywords = BM25Index()
+    keywords.upsert(documents)
+    print(f"Indexed {len(documents)} documents in {time.perf_counter() - start:.1f}s, {len(questions)} questions")
+
+    results = [run_mode(mode, questions, vectors, keywords, sorted(args.k)) for mode in args.modes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    header = f"{'mode':<16}" + "".join(f"{'R@' + str(k):>8}" for k in sorted(args.k)) + f"{'MRR':>8}{'p50':>10}{'p95':>10}"
+    print(header)
+    for r in results:
+        print(f"{r['mode']:<16}" + "".join(f"{r['recall'][k]:>8.3f}" for k in sorted(args.k))
+              + f"{r['mrr']:>8.3f}{r['p50_ms']:>8.2f}ms{r['p95_ms']:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
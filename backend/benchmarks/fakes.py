@@ -0,0 +1,551 @@
+"""
+In-process stand-ins for the services the backend talks to, for offline benchmarks.
+
+Each fake is a small HTTP server on 127.0.0.1 (a random port), so the real
+client libraries (supabase-py, openai, python-telegram-bot) are exercised
+end to end, serialisation and connection pooling included:
+
+  FakeSupabase  PostgREST tables (select/insert/upsert/update/delete with the
+                filters the backend uses), the match_documents RPC, signed
+                storage downloads and the auth admin user endpoints
+  FakeOpenAI    /v1/embeddings with deterministic vectors (texts sharing words
+                get similar vectors) and /v1/chat/completions, streamed or
+                not, with configurable latency
+  FakeTelegram  the Bot API methods the bot calls, recording every call
+
+start() launches all three and points the backend's environment at them. It
+must run before any backend module is imported, since they read their
+configuration at import time.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+WORD = re.compile(r"\w+")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return None
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            # python-telegram-bot posts forms, with JSON-encoded values for nested fields
+            return dict(parse_qsl(raw.decode()))
+        return json.loads(raw)
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        try:
+            status, body, headers = self.server.fake.handle(
+                self.command, unquote(url.path), parse_qsl(url.query, keep_blank_values=True), self.headers, self._body(), self
+            )
+        except Exception as e:
+            status, body, headers = 500, {"message": f"{type(e).__name__}: {e}"}, {}
+        if status is None:  # the handler streamed the response itself
+            return
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", headers.pop("Content-Type", "application/json"))
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+
+class FakeServer:
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, name):
+        with self._calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def handle(self, method, path, query, headers, body, handler):
+        raise NotImplementedError
+
+
+# --- deterministic embeddings ---
+
+def embed(text, dim):
+    """
+    A unit vector for text: hashed bag of words plus a little text-specific
+    noise, so texts sharing words are close and retrieval results are meaningful.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    vector += np.random.default_rng(seed).standard_normal(dim).astype(np.float32) * 0.05
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+# --- Supabase ---
+
+def _coerce(value, sample):
+    if isinstance(sample, bool):
+        return value == "true"
+    if isinstance(sample, int):
+        return int(value)
+    if isinstance(sample, float):
+        return float(value)
+    return value
+
+
+def _split_list(value):
+    # "(1,2,3)" or "{1,2,3}"
+    inner = value[1:-1]
+    return [part.strip().strip('"') for part in inner.split(",")] if inner else []
+
+
+def _filter(column, expression):
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, value = expression.partition(".")
+
+    def match(row):
+        current = row.get(column)
+        if op == "is":
+            result = current is None if value == "null" else current == (value == "true")
+        elif current is None:
+            result = False
+        elif op == "in":
+            result = current in [_coerce(v, current) for v in _split_list(value)]
+        elif op in ("cs", "ov"):
+            wanted = set(_split_list(value))
+            have = {str(v) for v in current}
+            result = wanted <= have if op == "cs" else bool(wanted & have)
+        else:
+            other = _coerce(value, current)
+            result = {
+                "eq": current == other, "neq": current != other,
+                "gt": current > other, "gte": current >= other,
+                "lt": current < other, "lte": current <= other,
+            }[op]
+        return not result if negate else result
+    return match
+
+
+class FakeSupabase(FakeServer):
+    """
+    Tables are lists of dicts with an auto-increment "id". Vector columns
+    ("embedding") are returned as PostgREST does, as '[...]' strings.
+    """
+
+    VECTOR_COLUMNS = ("embedding",)
+    RETURN_COLUMNS = ("id", "content", "file_name", "file_path", "file_type", "file_storage_path", "chunk_index", "metadata")
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.tables = {}
+        self.next_id = {}
+        self.files = {}
+        self.users = {}
+        self.lock = threading.RLock()
+        self._matrix = None  # (row count, ids, meta rows, normalised vectors) for match_documents
+
+    # helpers for benchmark setup
+
+    def add_user(self, user_id, user_metadata=None):
+        self.users[user_id] = {
+            "id": user_id, "aud": "authenticated", "role": "authenticated",
+            "app_metadata": {}, "user_metadata": dict(user_metadata or {}),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def put_file(self, bucket, path, data):
+        self.files[(bucket, path)] = data
+
+    def insert_rows(self, table, rows):
+        with self.lock:
+            return [self._insert(table, row) for row in rows]
+
+    def _insert(self, table, row):
+        rows = self.tables.setdefault(table, [])
+        row = dict(row)
+        if row.get("id") is None:
+            row["id"] = self.next_id.get(table, 0) + 1
+        self.next_id[table] = max(self.next_id.get(table, 0), row["id"])
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        self._unpack_embedding(row)
+        rows.append(row)
+        self._matrix = None
+        return row
+
+    @staticmethod
+    def _unpack_embedding(row):
+        """What the documents_unpack_embedding trigger does (migrations/004)"""
+        if row.get("embedding_packed") is not None:
+            from embedding_codec import decode
+            row["embedding"] = decode(row["embedding_packed"]).tolist()
+
+    def _out(self, row, columns):
+        out = {}
+        for column in columns or row.keys():
+            value = row.get(column)
+            if column in self.VECTOR_COLUMNS and value is not None:
+                value = "[" + ",".join(f"{v:.6f}" for v in value) + "]"
+            out[column] = value
+        return out
+
+    def handle(self, method, path, query, headers, body, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        if path.startswith("/rest/v1/rpc/"):
+            return self.rpc(path.rsplit("/", 1)[1], body or {})
+        if path.startswith("/rest/v1/"):
+            return self.rest(method, path[len("/rest/v1/"):], query, headers, body)
+        if path.startswith("/storage/v1/object/sign/"):
+            return self.storage(method, path[len("/storage/v1/object/sign/"):])
+        if path.startswith("/auth/v1/admin/users/"):
+            return self.auth(method, path.rsplit("/", 1)[1], body)
+        return 404, {"message": f"not found: {path}"}, {}
+
+    def rest(self, method, table, query, headers, body):
+        self.count(f"{method} {table}")
+        columns, order, limit, offset, on_conflict, filters = None, [], None, 0, None, []
+        for key, value in query:
+            if key == "select":
+                columns = None if value.strip() == "*" else [c.strip() for c in value.split(",")]
+            elif key == "order":
+                for part in value.split(","):
+                    column, _, direction = part.partition(".")
+                    order.append((column, direction.startswith("desc")))
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key == "on_conflict":
+                on_conflict = value
+            elif key == "columns":
+                continue
+            else:
+                filters.append(_filter(key, value))
+        prefer = headers.get("Prefer", "")
+        response_headers = {}
+
+        with self.lock:
+            rows = self.tables.setdefault(table, [])
+            if method in ("GET", "HEAD"):
+                matched = [r for r in rows if all(f(r) for f in filters)]
+                for column, desc in reversed(order):
+                    matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+                total = len(matched)
+                matched = matched[offset:offset + limit if limit is not None else None]
+                if "count=" in prefer:
+                    response_headers["Content-Range"] = f"{offset}-{offset + max(len(matched) - 1, 0)}/{total}"
+                return 200, [self._out(r, columns) for r in matched], response_headers
+
+            if method == "POST":
+                payload = body if isinstance(body, list) else [body]
+                saved = []
+                if "resolution=" in prefer:
+                    key = on_conflict or "id"
+                    by_key = {r.get(key): r for r in rows}
+                    for item in payload:
+                        existing = by_key.get(item.get(key))
+                        if existing is None:
+                            saved.append(self._insert(table, item))
+                        elif "merge-duplicates" in prefer:
+                            existing.update(item)
+                            self._unpack_embedding(existing)
+                            saved.append(existing)
+                    self._matrix = None
+                else:
+                    saved = [self._insert(table, item) for item in payload]
+                return 201, [self._out(r, None) for r in saved] if "return=representation" in prefer else b"", {}
+
+            if method == "PATCH":
+                matched = [r for r in rows if all(f(r) for f in filters)]
+                for r in matched:
+                    r.update(body)
+                    self._unpack_embedding(r)
+                self._matrix = None
+                return 200, [self._out(r, None) for r in matched], {}
+
+            if method == "DELETE":
+                keep, removed = [], []
+                for r in rows:
+                    (removed if all(f(r) for f in filters) else keep).append(r)
+                self.tables[table] = keep
+                self._matrix = None
+                return 200, [self._out(r, None) for r in removed], {}
+        return 405, {"message": method}, {}
+
+    def rpc(self, name, params):
+        self.count(f"rpc {name}")
+        if name != "match_documents":
+            return 404, {"message": f"unknown function {name}"}, {}
+        with self.lock:
+            if self._matrix is None:
+                rows = [r for r in self.tables.get("documents", []) if r.get("embedding") is not None]
+                vectors = np.asarray([r["embedding"] for r in rows], dtype=np.float32).reshape(len(rows), -1)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                self._matrix = (rows, vectors)
+            rows, vectors = self._matrix
+        if not rows:
+            return 200, [], {}
+        query = np.asarray(params["query"], dtype=np.float32)
+        scores = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        k = min(int(params.get("top_k", 5)), len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        results = []
+        for i in best:
+            row = self._out(rows[i], self.RETURN_COLUMNS)
+            row["link"] = row["file_path"] if row.get("file_type") == "link" else None
+            row["similarity"] = float(scores[i])
+            results.append(row)
+        return 200, results, {}
+
+    def storage(self, method, rest):
+        bucket, _, path = rest.partition("/")
+        if method == "POST":
+            self.count("storage sign")
+            if (bucket, path) not in self.files:
+                return 404, {"message": "Object not found"}, {}
+            return 200, {"signedURL": f"/object/sign/{bucket}/{path}?token={uuid.uuid4().hex}"}, {}
+        self.count("storage download")
+        data = self.files.get((bucket, path))
+        if data is None:
+            return 404, {"message": "Object not found"}, {}
+        return 200, data, {"Content-Type": "application/octet-stream"}
+
+    def auth(self, method, user_id, body):
+        self.count(f"auth {method}")
+        user = self.users.get(user_id)
+        if user is None:
+            return 404, {"message": "User not found"}, {}
+        if method == "PUT" and body:
+            user["user_metadata"].update(body.get("user_metadata") or {})
+        return 200, user, {}
+
+
+# --- OpenAI ---
+
+class FakeOpenAI(FakeServer):
+    """
+    Embeddings: `embedding_latency` seconds per request plus
+    `embedding_latency_per_input` per input. Chat: `first_token_latency` before
+    the first token, then `token_interval` between tokens of a
+    `completion_tokens`-word answer.
+    """
+
+    def __init__(self, dim=3072, embedding_latency=0.05, embedding_latency_per_input=0.0005,
+                 first_token_latency=0.5, token_interval=0.01, completion_tokens=80):
+        super().__init__()
+        self.dim = dim
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.completion_tokens = completion_tokens
+
+    def handle(self, method, path, query, headers, body, handler):
+        if path.endswith("/embeddings"):
+            return self.embeddings(body)
+        if path.endswith("/chat/completions"):
+            return self.chat(body, handler)
+        return 404, {"error": {"message": f"not found: {path}"}}, {}
+
+    def embeddings(self, body):
+        self.count("embeddings")
+        texts = [body["input"]] if isinstance(body["input"], str) else body["input"]
+        dim = body.get("dimensions") or self.dim
+        time.sleep(self.embedding_latency + self.embedding_latency_per_input * len(texts))
+        data = []
+        for i, text in enumerate(texts):
+            # like text-embedding-3, a shorter vector is the start of the full one, re-normalised
+            vector = embed(text, self.dim)[:dim]
+            vector /= max(float(np.linalg.norm(vector)), 1e-12)
+            # the openai client asks for base64 unless told otherwise
+            value = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": value})
+        tokens = sum(len(WORD.findall(t)) for t in texts)
+        return 200, {"object": "list", "data": data, "model": body["model"],
+                     "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}, {}
+
+    def _answer(self, messages):
+        question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        words = (WORD.findall(question) or ["answer"]) + ["and", "so", "on", "for", "the", "client"]
+        return [words[i % len(words)] + " " for i in range(self.completion_tokens)]
+
+    def chat(self, body, handler):
+        self.count("chat")
+        tokens = self._answer(body["messages"])
+        prompt_tokens = sum(len(WORD.findall(str(m.get("content") or ""))) for m in body["messages"])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body["model"]}
+        time.sleep(self.first_token_latency)
+        if not body.get("stream"):
+            time.sleep(self.token_interval * len(tokens))
+            return 200, {**base, "object": "chat.completion", "usage": usage, "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(tokens)},
+            }]}, {}
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def send(data):
+            payload = f"data: {data}\n\n".encode()
+            handler.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            handler.wfile.flush()
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_interval)
+            send(json.dumps({**chunk, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}))
+        send(json.dumps({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({**chunk, "choices": [], "usage": usage}))
+        send("[DONE]")
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+        return None, None, None
+
+
+# --- Telegram ---
+
+def _form_value(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class FakeTelegram(FakeServer):
+    """
+    Bot API stand-in. Sent and edited messages are recorded in `sent` as
+    (monotonic time, method, chat_id, reply_to_message_id), so a benchmark can
+    tell when the reply to each update became visible and when it was complete.
+    """
+
+    def __init__(self, latency=0.02):
+        super().__init__()
+        self.latency = latency
+        self.sent = []
+        self.next_message_id = 1_000_000
+        self.lock = threading.Lock()
+
+    def handle(self, method, path, query, headers, body, handler):
+        name = path.rsplit("/", 1)[1]
+        self.count(name)
+        if self.latency:
+            time.sleep(self.latency)
+        params = {k: _form_value(v) for k, v in (body or {}).items()}
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                      "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif name in ("sendMessage", "editMessageText", "sendDocument"):
+            with self.lock:
+                if name == "editMessageText":
+                    message_id = params.get("message_id")
+                else:
+                    self.next_message_id += 1
+                    message_id = self.next_message_id
+                reply = params.get("reply_parameters") or {}
+                self.sent.append((time.monotonic(), name, params.get("chat_id"),
+                                  reply.get("message_id") or params.get("reply_to_message_id")))
+            result = {"message_id": message_id, "date": int(time.time()),
+                      "chat": {"id": params.get("chat_id"), "type": "private"}, "text": params.get("text", "")}
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}, {}
+
+
+def update(update_id, chat_id, message_id, text):
+    """A Telegram webhook update for a private text message"""
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}", "username": f"user{chat_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": message_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"}, "from": user,
+    }}
+
+
+# --- wiring ---
+
+ADMIN_ID = "00000000-0000-4000-8000-000000000001"
+TOKEN = "123456:BENCHMARK"
+# supabase-py checks the key looks like a JWT
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+
+class Fakes:
+    def __init__(self, supabase, openai, telegram):
+        self.supabase = supabase
+        self.openai = openai
+        self.telegram = telegram
+
+    def stop(self):
+        for fake in (self.supabase, self.openai, self.telegram):
+            fake.stop()
+
+
+def start(env=None, supabase_latency=0.0, telegram_latency=0.02, **openai_options):
+    """
+    Start the fakes and point the backend at them. `env` overrides other
+    backend settings (VECTOR_INDEX, RETRIEVAL_MODE, ...). The local embedding
+    cache is off unless `env` sets EMBEDDING_CACHE_PATH.
+    """
+    fakes = Fakes(FakeSupabase(supabase_latency).start(), FakeOpenAI(**openai_options).start(),
+                  FakeTelegram(telegram_latency).start())
+    fakes.supabase.add_user(ADMIN_ID, {"is_bot": True, "telegram_username": "coach"})
+    os.environ.update({
+        "SUPABASE_URL": fakes.supabase.url,
+        "SUPABASE_KEY": SUPABASE_KEY,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{fakes.openai.url}/v1",
+        "TELEGRAM_TOKEN": TOKEN,
+        "TELEGRAM_API_BASE_URL": f"{fakes.telegram.url}/bot",
+        "ADMIN_ID": ADMIN_ID,
+        "MODE": "benchmark",
+        "EMBEDDING_CACHE_PATH": "",
+        "JOBS_DB_PATH": "",
+        **(env or {}),
+    })
+    return fakes
@@ -0,0 +1,110 @@
+"""
+Run the offline benchmark scenarios and collect their results in one JSON file.
+
+Each scenario runs in its own interpreter (the backend reads its settings at
+import), against the stand-ins in benchmarks.fakes, so no network access or
+credentials are needed. With --compare, prints how each number changed
+against an earlier results file. tiktoken's cl100k_base encoding must be in
+its local cache (run once with network access, or point TIKTOKEN_CACHE_DIR
+at a copy): without it the chat scenarios fail.
+
+    cd backend
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --quick --output after.json --compare before.json
+    python -m benchmarks.suite --only chat retrieval
+"""
+import sys
+import json
+import argparse
+import subprocess
+from benchmarks.common import BACKEND_DIR, environment
+
+SCENARIOS = {
+    "ingestion": ["benchmarks.bench_ingestion"],
+    "chat": ["benchmarks.bench_chat"],
+    "chat_streaming": ["benchmarks.bench_chat", "--stream"],
+    "chat_telegram": ["benchmarks.bench_chat", "--via", "telegram", "--stream"],
+    "retrieval": ["benchmarks.bench_retrieval"],
+}
+FULL = {
+    "chat": ["--chats", "1", "8", "32"],
+    "chat_streaming": ["--chats", "1", "8", "32"],
+    "chat_telegram": ["--chats", "1", "16"],
+}
+# smaller inputs for a run of a few minutes
+QUICK = {
+    "ingestion": ["--pages", "10", "--scanned-pages", "1"],
+    "chat": ["--chats", "1", "8", "--questions", "2", "--documents", "500"],
+    "chat_streaming": ["--chats", "1", "8", "--questions", "2", "--documents", "500"],
+    "chat_telegram": ["--chats", "1", "8", "--questions", "2", "--documents", "500"],
+    "retrieval": ["--sizes", "1000", "10000", "--queries", "100"],
+}
+
+
+def run(name, quick):
+    command = [sys.executable, "-m", *SCENARIOS[name], *(QUICK if quick else FULL).get(name, []), "--json"]
+    print(f"▶ {name}: {' '.join(command[2:])}", file=sys.stderr)
+    out = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if out.returncode != 0:
+        print(out.stderr[-2000:], file=sys.stderr)
+        return {"error": f"exit code {out.returncode}"}
+    result = json.loads(out.stdout)
+    result.pop("environment", None)
+    return result
+
+
+def numbers(value, path=""):
+    """Flatten numeric leaves to {"a.b.0.c": number}; list items are keyed by their size/chats/mode/file when they have one"""
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {path: value}
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key != "settings":
+                flat.update(numbers(item, f"{path}.{key}" if path else key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = next((str(item[k]) for k in ("file", "mode", "size", "chats") if isinstance(item, dict) and k in item), str(i))
+            flat.update(numbers(item, f"{path}[{label}]"))
+    return flat
+
+
+def compare(current, baseline):
+    old, new = numbers(baseline["scenarios"]), numbers(current["scenarios"])
+    print(f"{'metric':<80}{'before':>12}{'after':>12}{'change':>10}")
+    for key in sorted(new.keys() & old.keys()):
+        if old[key] == new[key]:
+            continue
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else ""
+        print(f"{key:<80}{old[key]:>12.4g}{new[key]:>12.4g}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--quick", action="store_true", help="smaller inputs")
+    parser.add_argument("--output", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    results = {
+        "environment": environment(),
+        "quick": args.quick,
+        "scenarios": {name: run(name, args.quick) for name in args.only},
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import re
+import math
+import time
+import heapq
+import threading
+from collections import Counter
+import document_events
+from vector_index import META_COLUMNS, fetch_rows
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BM25_REFRESH_SECONDS = int(os.getenv("BM25_REFRESH_SECONDS", "300"))
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.,:/-]\w+)*")
+JOINERS = re.compile(r"[.,:/-]")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my of on or our so that the their them
+then there these they this to was we were what when where which who will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word tokens. Numbers and joined forms ("5x5", "3:30", "10-minute") are kept whole"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+            # also index the parts of a joined token so "10-minute" matches "minute"
+            if not token.isalnum():
+                tokens.extend(part for part in JOINERS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index over documents.content with Okapi BM25 scoring.
+    Rows can be added, replaced and removed one at a time, so it follows the
+    same change feed as the vector index.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}   # term -> {doc_id: term frequency}
+        self.lengths = {}    # doc_id -> number of tokens
+        self.terms = {}      # doc_id -> its distinct terms, to remove it again
+        self.meta = {}
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def upsert(self, rows):
+        """Add or replace rows: dicts with "id", "content" and the other META_COLUMNS fields"""
+        for row in rows:
+            if row.get("content") is None:
+                continue
+            counts = Counter(tokenize(row["content"]))
+            with self.lock:
+                self._remove(row["id"])
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[row["id"]] = tf
+                length = sum(counts.values())
+                self.lengths[row["id"]] = length
+                self.terms[row["id"]] = tuple(counts)
+                self.total_length += length
+                meta = {c: row.get(c) for c in META_COLUMNS}
+                meta["link"] = row.get("file_path") if row.get("file_type") == "link" else None
+                self.meta[row["id"]] = meta
+
+    def _remove(self, doc_id):
+        terms = self.terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+        del self.meta[doc_id]
+
+    def remove(self, ids):
+        with self.lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+
+    @property
+    def ids(self):
+        return list(self.lengths)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.lengths
+
+    def search(self, query, k=5):
+        """Return the k best-scoring rows as dicts with a "bm25" score, best first"""
+        terms = set(tokenize(query))
+        with self.lock:
+            n = len(self.lengths)
+            if n == 0 or not terms:
+                return []
+            average_length = self.total_length / n
+            scores = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [{**self.meta[doc_id], "bm25": score} for doc_id, score in best]
+
+
+index = BM25Index(k1=BM25_K1, b=BM25_B)
+ready = threading.Event()
+
+
+def load(supabase):
+    start = time.time()
+    batch = []
+    for row in fetch_rows(supabase, columns=META_COLUMNS):
+        batch.append(row)
+        if len(batch) == 1000:
+            index.upsert(batch)
+            batch = []
+    index.upsert(batch)
+    ready.set()
+    print(f"✅ BM25 index loaded {len(index)} documents in {time.time() - start:.1f}s")
+
+
+def refresh(supabase):
+    """Reconcile with the documents table: drop deleted rows and load rows we never saw"""
+    remote_ids = [row["id"] for row in fetch_rows(supabase, page_size=5000, columns=("id",))]
+    remote = set(remote_ids)
+    stale = [doc_id for doc_id in index.ids if doc_id not in remote]
+    index.remove(stale)
+    missing = [doc_id for doc_id in remote_ids if doc_id not in index]
+    for start in range(0, len(missing), 200):
+        ids = missing[start:start + 200]
+        index.upsert(supabase.table("documents").select(", ".join(META_COLUMNS)).in_("id", ids).execute().data)
+    if stale or missing:
+        print(f"✅ BM25 index refreshed: -{len(stale)} +{len(missing)}")
+
+
+def apply_event(kind, payload):
+    if kind == "upsert":
+        index.upsert(payload)
+    elif kind == "delete":
+        index.remove(payload)
+
+
+def start_sync(supabase):
+    """Load the index in the background, then keep it current from document events and periodic refreshes"""
+    def loader():
+        try:
+            load(supabase)
+        except Exception as e:
+            print(f"❌ BM25 index load failed, using vector search only: {e}")
+            return
+        while True:
+            time.sleep(max(1, BM25_REFRESH_SECONDS))
+            try:
+                refresh(supabase)
+            except Exception as e:
+                print(f"❌ BM25 index refresh failed: {e}")
+
+    document_events.subscribe(apply_event)
+    threading.Thread(target=loader, name="bm25-loader", daemon=True).start()
+
+
+def search(query, k=5):
+    """Top-k keyword matches, or None while the index is still loading"""
+    if not ready.is_set():
+        return None
+    return index.search(query, k)
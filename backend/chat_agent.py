@@ -1,21 +1,127 @@
-from utils import embed_text, supabase, client
+import time
+import atexit
+import asyncio
+from utils import embed_text, aembed_text, get_supabase, get_async_supabase, get_async_openai
+import vector_index
+import bm25
+import retrieval
+import answer_cache
+import metrics
+from singleflight import SingleFlight, AsyncSingleFlight
+from youtube import watch_link
+from prompt_builder import (
+    PROMPT_TOKEN_BUDGET, PROMPT_REFERENCES_MAX_TOKENS, message_tokens, merge_adjacent, drop_near_duplicates,
+    fit_references, fit_history
+)
+from chat_memory import (
+    ChatMemory, CHAT_MEMORY_TURNS, CHAT_MEMORY_MAX_CHATS, CHAT_MEMORY_FLUSH_SECONDS, CHAT_MEMORY_FLUSH_BATCH
+)
+
+
+def search_local(query_embedding, k: int = 5):
+    """Top-k from the in-process index, or None to fall back to match_documents"""
+    try:
+        with metrics.span("chat.vector_local"):
+            return vector_index.search(query_embedding, k)
+    except Exception as e:
+        print(f"❌ Local vector search failed, falling back to match_documents: {e}")
+        return None
+
+
+def search_keywords(query, k: int = 5):
+    """Top-k BM25 matches, or None when keyword search is off or not loaded yet"""
+    if query is None or retrieval.RETRIEVAL_MODE == "vector":
+        return None
+    try:
+        with metrics.span("chat.bm25"):
+            return bm25.search(query, k)
+    except Exception as e:
+        print(f"❌ Keyword search failed, using vector search only: {e}")
+        return None
+
+
+def _candidates(k, keyword_docs):
+    # fusion needs a deeper candidate list than the final k
+    if keyword_docs is None:
+        return k
+    return None if retrieval.RETRIEVAL_MODE == "bm25" else k * retrieval.RETRIEVAL_CANDIDATES
+
+
+def retrieve(query_embedding, k: int = 5, query=None):
+    keyword_docs = search_keywords(query, k * retrieval.RETRIEVAL_CANDIDATES)
+    n = _candidates(k, keyword_docs)
+    vector_docs = None
+    if n is not None:
+        vector_docs = search_local(query_embedding, n)
+        if vector_docs is None:
+            with metrics.span("chat.match_documents"):
+                res = get_supabase().rpc("match_documents", {"query": query_embedding, "top_k": n}).execute()
+            vector_docs = res.data
+    return retrieval.combine(query, vector_docs, keyword_docs, k)
+
+
+# the same question asked in several chats at once is embedded and searched once
+_search_flight = SingleFlight("retrieval")
+_retrieve_flight = AsyncSingleFlight("retrieval")
 
 
 def search_top_k(query: str, k: int = 5):
-    query_embedding = embed_text([query])
-    res = supabase.rpc("match_documents", {"query": query_embedding[0], "top_k": k}).execute()
-    return res.data
+    def search():
+        query_embedding = embed_text([query])
+        return retrieve(query_embedding[0], k, query)
+    return list(_search_flight.do((query, k), search))
+
+
+async def aretrieve(query_embedding, k: int = 5, query=None):
+    # both local searches scan the whole corpus: keep them off the event loop
+    keyword_docs = await asyncio.to_thread(search_keywords, query, k * retrieval.RETRIEVAL_CANDIDATES)
+    n = _candidates(k, keyword_docs)
+    vector_docs = None
+    if n is not None:
+        vector_docs = await asyncio.to_thread(search_local, query_embedding, n)
+        if vector_docs is None:
+            with metrics.span("chat.match_documents"):
+                db = await get_async_supabase()
+                res = await db.rpc("match_documents", {"query": query_embedding, "top_k": n}).execute()
+            vector_docs = res.data
+    return retrieval.combine(query, vector_docs, keyword_docs, k)
+
+
+async def _embed_and_retrieve(question, k):
+    with metrics.span("chat.embed"):
+        query_embedding = (await aembed_text([question]))[0]
+    with metrics.span("chat.retrieve"):
+        return query_embedding, await aretrieve(query_embedding, k, question)
+
+
+async def embed_and_retrieve(question, k: int = 5):
+    query_embedding, docs = await _retrieve_flight.do((question, k), lambda: _embed_and_retrieve(question, k))
+    # each caller gets its own list of the shared documents
+    return query_embedding, list(docs)
+
+
+CHAT_MODEL = "gpt-5"
+SYSTEM_PROMPT = "You are a helpful assistant. You have to chat in spoken language. Please answer concisely."
+FALLBACK_PROMPT = "When asked a question that is not related to the content, you have to answer based on your knowledge or say that \"I don’t have an answer for that yet. Let me connect you with the coach.\""
+
+
+def build_prompt_with_usage(query, retrieved_docs, histories, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Build the chat messages within a token budget. Returns (conversation, usage)
+    where usage reports the tokens spent on each section.
+    """
+    # Merge neighbouring chunks of the same file and drop near-identical ones
+    references = drop_near_duplicates(merge_adjacent(retrieved_docs))
 
-def build_prompt(query, retrieved_docs, histories):
     # Build content summary
     content_blocks = []
-    for i, doc in enumerate(retrieved_docs, start=1):
+    for doc in references:
         block = f"{doc['content']}"
         if doc.get("file_type") == "link" and doc.get("link"):
-            block += f"\n   Watch here: {doc['link']}"
+            # jump to where the referenced part of the video starts
+            block += f"\n   Watch here: {watch_link(doc['link'], (doc.get('metadata') or {}).get('start'))}"
         content_blocks.append(block)
 
-    context = "\n\n".join(content_blocks)
     history = [
         {
             "role": "assistant" if m["role"] == "bot" else "user",
@@ -23,42 +129,106 @@ def build_prompt(query, retrieved_docs, histories):
         }
         for m in histories
     ]
-    conversation = [{"role": "system", "content": "You are a helpful assistant. You have to chat in spoken language. Please answer concisely."},
+    question = {"role": "user", "content": query}
+    instructions = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "system", "content": FALLBACK_PROMPT}]
+
+    # Instructions and the question are always sent; references then history share the rest
+    instruction_tokens = sum(message_tokens(m) for m in instructions) + message_tokens({"content": "References1:\n"})
+    question_tokens = message_tokens(question)
+    available = max(0, budget - instruction_tokens - question_tokens)
+    content_blocks, reference_tokens = fit_references(content_blocks, min(PROMPT_REFERENCES_MAX_TOKENS, available))
+    history, history_tokens = fit_history(history, available - reference_tokens)
+
+    context = "\n\n".join(content_blocks)
+    conversation = [instructions[0],
                     {"role": "system", "content": f"References1:\n{context}\n\n"},
-                    {"role": "system", "content": "When asked a question that is not related to the content, you have to answer based on your knowledge or say that \"I don’t have an answer for that yet. Let me connect you with the coach.\""}] + history + [{"role": "user", "content": query}]
+                    instructions[1]] + history + [question]
+    usage = {
+        "instructions": instruction_tokens,
+        "references": reference_tokens,
+        "history": history_tokens,
+        "question": question_tokens,
+        "total": instruction_tokens + reference_tokens + history_tokens + question_tokens,
+        "budget": budget,
+        "references_retrieved": len(retrieved_docs),
+        "references_used": len(content_blocks),
+        "history_available": len(histories),
+        "history_used": len(history),
+    }
+    return conversation, usage
+
+
+def build_prompt(query, retrieved_docs, histories):
+    return build_prompt_with_usage(query, retrieved_docs, histories)[0]
+
+
+def build_prompt_with_metrics(query, retrieved_docs, histories):
+    """build_prompt, recording prompt tokens per section and how many references and turns made it in"""
+    with metrics.span("chat.build_prompt"):
+        conversation, usage = build_prompt_with_usage(query, retrieved_docs, histories)
+    for section in ("instructions", "references", "history", "question", "total"):
+        metrics.observe("coaching_prompt_tokens", usage[section], buckets=metrics.COUNT_BUCKETS, section=section)
+    metrics.observe("coaching_prompt_references", usage["references_used"], buckets=metrics.COUNT_BUCKETS)
+    metrics.observe("coaching_prompt_history_messages", usage["history_used"], buckets=metrics.COUNT_BUCKETS)
     return conversation
 
 
-def chat_with_bot(chat_id, user, question):
-    
+def record_usage(usage, model=CHAT_MODEL):
+    """Count the tokens a completion reports it used"""
+    if usage is None:
+        return
+    metrics.inc("coaching_openai_tokens_total", usage.prompt_tokens, model=model, kind="prompt")
+    metrics.inc("coaching_openai_tokens_total", usage.completion_tokens, model=model, kind="completion")
+
+
+memory = ChatMemory(
+    get_async_supabase,
+    get_supabase,
+    turns=CHAT_MEMORY_TURNS,
+    max_chats=CHAT_MEMORY_MAX_CHATS,
+    flush_seconds=CHAT_MEMORY_FLUSH_SECONDS,
+    flush_batch=CHAT_MEMORY_FLUSH_BATCH,
+)
+atexit.register(memory.close)
 
-    references = search_top_k(question)
 
-    histories = supabase.table("chat_history")\
-                .select("id, chat_id, role, message")\
-                .eq("chat_id", chat_id)\
-                .order("created_at")\
-                .limit(20)\
-                .execute()
-    
-    conversation = build_prompt(question, references, histories.data)
-    response = client.chat.completions.create(
-        model="gpt-5",
-        messages=conversation
+async def load_history(chat_id):
+    with metrics.span("chat.history_select"):
+        return await memory.recent(chat_id)
+
+
+def save_history_in_background(data):
+    memory.append(data[0]["chat_id"], data)
+
+
+async def prepare_chat(chat_id, question):
+    """Retrieve references and history, and check the answer cache. Returns (query_embedding, references, histories, cached_answer)"""
+    # Embedding + retrieval and the history select are independent, so run them together
+    (query_embedding, references), histories = await asyncio.gather(
+        embed_and_retrieve(question),
+        load_history(chat_id),
     )
-    
-    result_msg = response.choices[0].message.content
 
+    cached_answer = None
+    if answer_cache.enabled():
+        cached_answer = answer_cache.cache.lookup(query_embedding, references, histories)
+        metrics.inc("coaching_answer_cache_total", result="miss" if cached_answer is None else "hit")
+    return query_embedding, references, histories, cached_answer
+
+
+def history_rows(chat_id, user, question, answer, references, question_message_id=None, reply_message_ids=()):
+    """chat_history rows for one turn. Telegram message ids let /flag find an answer by the message it was sent as"""
     document_ids = [doc['id'] for doc in references]
     fullname = f"{user.first_name or ''} {user.last_name or ''}".strip()
-    data = [{
+    return [{
                 "username": user.username,
                 "fullname": fullname,
                 "user_id": user.id,
                 "chat_id": chat_id,
                 "role": "user",
                 "message": question,
-                "document_ids":[]
+                "document_ids":[],
+                "telegram_message_ids": [question_message_id] if question_message_id is not None else []
             },
             {
                 "username": None,
@@ -66,10 +236,79 @@ def chat_with_bot(chat_id, user, question):
                 "user_id": None,
                 "chat_id": chat_id,
                 "role": "bot",
-                "message": result_msg,
-                "document_ids":document_ids
+                "message": answer,
+                "document_ids":document_ids,
+                "telegram_message_ids": list(reply_message_ids)
             }]
-    
-    response = supabase.table("chat_history").insert(data).execute()
 
-    return result_msg
\ No newline at end of file
+
+def record_turn(chat_id, user, question, result, question_message_id=None, reply_message_ids=()):
+    """Save a finished turn (the `result` filled in by chat_with_bot / stream_chat_with_bot) once its reply is sent"""
+    if result.get("answer") is None:
+        return
+    save_history_in_background(history_rows(
+        chat_id, user, question, result["answer"], result["references"],
+        question_message_id=question_message_id,
+        reply_message_ids=reply_message_ids,
+    ))
+
+
+async def chat_with_bot(chat_id, user, question, result=None):
+    """
+    Answer a question. The answer and its references are also put in `result`;
+    pass that to record_turn after sending the reply to save the turn.
+    """
+    result = {} if result is None else result
+    query_embedding, references, histories, result_msg = await prepare_chat(chat_id, question)
+
+    if result_msg is None:
+        conversation = build_prompt_with_metrics(question, references, histories)
+        with metrics.span("chat.completion"):
+            response = await get_async_openai().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=conversation
+            )
+        record_usage(response.usage)
+
+        result_msg = response.choices[0].message.content
+        if answer_cache.enabled():
+            answer_cache.cache.store(query_embedding, references, result_msg, histories)
+
+    result.update(answer=result_msg, references=references)
+    return result_msg
+
+
+async def stream_chat_with_bot(chat_id, user, question, result=None):
+    """Like chat_with_bot, but yields the answer in pieces as the model produces them"""
+    result = {} if result is None else result
+    query_embedding, references, histories, cached_answer = await prepare_chat(chat_id, question)
+
+    if cached_answer is not None:
+        yield cached_answer
+        result.update(answer=cached_answer, references=references)
+        return
+
+    conversation = build_prompt_with_metrics(question, references, histories)
+    start = time.perf_counter()
+    stream = await get_async_openai().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=conversation,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    async for event in stream:
+        delta = event.choices[0].delta.content if event.choices else None
+        if delta:
+            if not parts:
+                metrics.observe(metrics.STAGE_SECONDS, time.perf_counter() - start, stage="chat.first_token")
+            parts.append(delta)
+            yield delta
+        if event.usage is not None:
+            record_usage(event.usage)
+    metrics.observe(metrics.STAGE_SECONDS, time.perf_counter() - start, stage="chat.completion")
+
+    result_msg = "".join(parts)
+    if answer_cache.enabled():
+        answer_cache.cache.store(query_embedding, references, result_msg, histories)
+    result.update(answer=result_msg, references=references)
@@ -0,0 +1,169 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+import metrics
+
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "20"))
+CHAT_MEMORY_MAX_CHATS = int(os.getenv("CHAT_MEMORY_MAX_CHATS", "10000"))
+CHAT_MEMORY_FLUSH_SECONDS = float(os.getenv("CHAT_MEMORY_FLUSH_SECONDS", "1.0"))
+CHAT_MEMORY_FLUSH_BATCH = int(os.getenv("CHAT_MEMORY_FLUSH_BATCH", "200"))
+
+
+class ChatMemory:
+    """
+    Recent chat_history turns per chat, kept in memory.
+    A chat's buffer is warmed from the database on first contact (latest
+    `turns` rows); new rows are appended locally and written to chat_history
+    in batches by a background write-behind thread. Call close() on shutdown
+    to flush what is still pending.
+    """
+
+    def __init__(self, get_async_supabase, get_supabase, turns=20, max_chats=10000,
+                 flush_seconds=1.0, flush_batch=200):
+        self.get_async_supabase = get_async_supabase
+        self.get_supabase = get_supabase
+        self.turns = turns
+        self.max_chats = max_chats
+        self.flush_seconds = flush_seconds
+        self.flush_batch = flush_batch
+        self.buffers = OrderedDict()
+        self.pending = {}  # chat_id -> rows queued but not yet written
+        self._warming = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # notified whenever a batch has been written (or given up on)
+        self._written = threading.Condition(self._lock)
+        self._writer = None
+        self._stop = threading.Event()
+
+    async def recent(self, chat_id):
+        """The latest turns of a chat, oldest first"""
+        with self._lock:
+            buffer = self.buffers.get(chat_id)
+            if buffer is not None:
+                self.buffers.move_to_end(chat_id)
+                return list(buffer)
+        # coalesce concurrent warm-ups of the same chat
+        warming = self._warming.get(chat_id)
+        if warming is None:
+            warming = asyncio.ensure_future(self._warm(chat_id))
+            self._warming[chat_id] = warming
+            warming.add_done_callback(lambda _: self._warming.pop(chat_id, None))
+        return await asyncio.shield(warming)
+
+    async def _warm(self, chat_id):
+        db = await self.get_async_supabase()
+        histories = await db.table("chat_history")\
+                    .select("id, chat_id, role, message")\
+                    .eq("chat_id", chat_id)\
+                    .order("created_at", desc=True)\
+                    .limit(self.turns)\
+                    .execute()
+        rows = list(reversed(histories.data))
+        with self._lock:
+            buffer = self.buffers.get(chat_id)
+            if buffer is None:
+                buffer = deque(rows, maxlen=self.turns)
+                self.buffers[chat_id] = buffer
+                self._evict()
+            return list(buffer)
+
+    def _evict(self):
+        while len(self.buffers) > self.max_chats:
+            for chat_id in self.buffers:
+                # never drop a chat whose newest rows are not in the database yet
+                if not self.pending.get(chat_id):
+                    del self.buffers[chat_id]
+                    break
+            else:
+                return
+
+    def append(self, chat_id, rows):
+        """Record new chat_history rows: visible to recent() immediately, persisted in the background"""
+        now = datetime.now(timezone.utc)
+        for offset, row in enumerate(rows):
+            # keep question/answer order even when rows share a batch insert
+            row.setdefault("created_at", now.replace(microsecond=min(now.microsecond + offset, 999999)).isoformat())
+        with self._lock:
+            buffer = self.buffers.get(chat_id)
+            if buffer is None:
+                buffer = deque(maxlen=self.turns)
+                self.buffers[chat_id] = buffer
+                self._evict()
+            buffer.extend(rows)
+            self.buffers.move_to_end(chat_id)
+            self.pending[chat_id] = self.pending.get(chat_id, 0) + len(rows)
+        for row in rows:
+            self._queue.put(row)
+        self._start_writer()
+
+    # --- write-behind ---
+
+    def _start_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="chat-history-writer", daemon=True)
+                    self._writer.start()
+
+    def _take_batch(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.flush_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch, attempts=5):
+        for attempt in range(attempts):
+            try:
+                with metrics.span("chat.history_insert"):
+                    self.get_supabase().table("chat_history").insert(batch).execute()
+                metrics.inc("coaching_chat_history_rows_total", len(batch))
+                break
+            except Exception as e:
+                print(f"❌ Saving chat history failed (attempt {attempt + 1}): {e}")
+                time.sleep(min(30, 2 ** attempt))
+        else:
+            print(f"❌ Dropped {len(batch)} chat history rows")
+        with self._lock:
+            for row in batch:
+                count = self.pending.get(row["chat_id"], 0) - 1
+                if count > 0:
+                    self.pending[row["chat_id"]] = count
+                else:
+                    self.pending.pop(row["chat_id"], None)
+            self._written.notify_all()
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(self.flush_seconds)
+            if batch:
+                self._write(batch)
+
+    def flush(self, timeout=30):
+        """
+        Synchronously write everything still queued, then wait (up to `timeout`)
+        for the batch the writer thread may be inserting right now.
+        """
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                break
+            self._write(batch)
+        with self._written:
+            return self._written.wait_for(lambda: not self.pending, timeout)
+
+    def close(self, timeout=30):
+        """Stop the writer (letting it finish its current batch) and flush the rest"""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join(timeout)
+        self.flush()
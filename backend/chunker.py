@@ -0,0 +1,145 @@
+import os
+import re
+import zlib
+from tokenizer import get_encoding
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+# Some sentences are "anchors" that may start a chunk, about one per this many tokens (0 = off).
+# Anchors depend only on the sentence text, so after an edit the chunk boundaries
+# fall back into step and re-ingestion only re-embeds the chunks around the edit.
+CHUNK_ANCHOR_TOKENS = int(os.getenv("CHUNK_ANCHOR_TOKENS", str(CHUNK_TOKENS // 2)))
+
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?。！？])[\"'”’)\]]*\s+")
+
+
+class Chunk:
+    __slots__ = ("text", "tokens", "metadata")
+
+    def __init__(self, text, tokens, metadata):
+        self.text = text
+        self.tokens = tokens
+        self.metadata = metadata
+
+    def __repr__(self):
+        return f"Chunk(tokens={self.tokens}, metadata={self.metadata}, text={self.text[:40]!r})"
+
+
+class _Unit:
+    """A sentence (or a piece of an over-long sentence) with its source metadata"""
+    __slots__ = ("text", "tokens", "meta", "paragraph_start")
+
+    def __init__(self, text, tokens, meta, paragraph_start):
+        self.text = text
+        self.tokens = tokens
+        self.meta = meta
+        self.paragraph_start = paragraph_start
+
+
+def _units(segments, max_tokens):
+    encoding = get_encoding()
+    for segment in segments:
+        text, meta = (segment, {}) if isinstance(segment, str) else segment
+        # only a blank line starts a paragraph: captions, which often wrap onto a second
+        # line, run on from the previous one
+        paragraph_start = PARAGRAPH_SPLIT.search(text) is not None
+        for paragraph in PARAGRAPH_SPLIT.split(text):
+            for sentence in SENTENCE_SPLIT.split(paragraph):
+                sentence = " ".join(sentence.split())
+                if not sentence:
+                    continue
+                tokens = encoding.encode_ordinary(sentence)
+                if len(tokens) <= max_tokens:
+                    yield _Unit(sentence, len(tokens), meta, paragraph_start)
+                else:
+                    # a single sentence longer than a chunk: hard split on token boundaries
+                    for start in range(0, len(tokens), max_tokens):
+                        piece = tokens[start:start + max_tokens]
+                        yield _Unit(encoding.decode(piece), len(piece), meta, paragraph_start)
+                        paragraph_start = False
+                paragraph_start = False
+            paragraph_start = True
+
+
+def _chunk_metadata(units):
+    first, last = units[0].meta, units[-1].meta
+    metadata = {}
+    if "page" in first:
+        metadata["page"] = first["page"]
+        metadata["page_end"] = last.get("page", first["page"])
+    if "start" in first:
+        metadata["start"] = first["start"]
+        metadata["end"] = last.get("end", last.get("start", first["start"]))
+    return metadata
+
+
+def _make_chunk(units):
+    parts = []
+    for i, unit in enumerate(units):
+        if i and unit.paragraph_start:
+            parts.append("\n\n")
+        elif i:
+            parts.append(" ")
+        parts.append(unit.text)
+    return Chunk("".join(parts), sum(u.tokens for u in units), _chunk_metadata(units))
+
+
+def _is_anchor(unit, anchor_tokens):
+    # longer sentences are proportionally more likely to be anchors
+    return anchor_tokens > 0 and zlib.crc32(unit.text.encode("utf-8")) % anchor_tokens < unit.tokens
+
+
+def iter_token_chunks(segments, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                      anchor_tokens=CHUNK_ANCHOR_TOKENS):
+    """
+    Stream chunks of at most chunk_tokens tokens from an iterable of text segments.
+    A segment is either a string or a (text, metadata) pair, e.g. (page_text, {"page": 3})
+    or (caption, {"start": 12.5, "end": 15.0}); each chunk carries the page range or
+    time range it covers.
+    Chunks break on sentence boundaries (preferring paragraph boundaries once a chunk
+    is three quarters full, or at an anchor sentence once it is half full) and start
+    with up to overlap_tokens of the previous chunk's trailing sentences.
+    """
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    current = []
+    current_tokens = 0
+    fresh = False  # does current hold anything not yet emitted?
+
+    for unit in _units(segments, chunk_tokens):
+        full = current_tokens + unit.tokens > chunk_tokens
+        paragraph_break = unit.paragraph_start and current_tokens >= chunk_tokens * 3 // 4
+        anchor_break = current_tokens >= chunk_tokens // 2 and _is_anchor(unit, anchor_tokens)
+        if current and fresh and (full or paragraph_break or anchor_break):
+            yield _make_chunk(current)
+            # carry trailing sentences over as overlap
+            carried = []
+            carried_tokens = 0
+            for prev in reversed(current):
+                if carried_tokens + prev.tokens > overlap_tokens:
+                    break
+                carried.insert(0, prev)
+                carried_tokens += prev.tokens
+            current, current_tokens = carried, carried_tokens
+            fresh = False
+        while current and current_tokens + unit.tokens > chunk_tokens:
+            current_tokens -= current.pop(0).tokens
+        current.append(unit)
+        current_tokens += unit.tokens
+        fresh = True
+
+    if current and fresh:
+        yield _make_chunk(current)
+
+
+def chunk_words(text, chunk_size=300, overlap=50):
+    """Legacy fixed-window chunker: 300-word windows overlapping by 50 words"""
+    words = text.split()
+    chunks = []
+    start = 0
+    while start < len(words):
+        end = start + chunk_size
+        chunk = " ".join(words[start:end])
+        chunks.append(chunk)
+        start += chunk_size - overlap
+    return chunks
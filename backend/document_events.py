@@ -0,0 +1,48 @@
+import threading
+
+# Change feed for documents rows. Ingestion (Flask process) publishes
+# ("upsert", rows) and ("delete", ids) events; the bot process listens and
+# fans them out to the local caches (vector index, answer cache).
+
+_publish = None
+_subscribers = []
+
+
+def subscribe(callback):
+    """callback(kind, payload) is called for every event seen by this process"""
+    _subscribers.append(callback)
+
+
+def set_publisher(publish):
+    """Route events to another process (e.g. multiprocessing.Queue.put) instead of handling them here"""
+    global _publish
+    _publish = publish
+
+
+def publish(kind, payload):
+    if _publish is not None:
+        _publish((kind, payload))
+    else:
+        dispatch((kind, payload))
+
+
+def dispatch(event):
+    kind, payload = event
+    for callback in _subscribers:
+        try:
+            callback(kind, payload)
+        except Exception as e:
+            print(f"❌ Document event handler failed: {e}")
+
+
+def start_listener(events):
+    """Dispatch events arriving on a multiprocessing queue in a background thread"""
+    def listener():
+        while True:
+            dispatch(events.get())
+
+    threading.Thread(target=listener, name="document-events", daemon=True).start()
+
+
+def document_ids(kind, payload):
+    return [row["id"] for row in payload] if kind == "upsert" else list(payload)
@@ -0,0 +1,60 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils import embed_text
+from tokenizer import count_tokens, truncate_tokens
+import metrics
+
+# OpenAI limits: 8191 tokens per input, 2048 inputs and 300k tokens per request
+EMBED_MAX_INPUT_TOKENS = int(os.getenv("EMBED_MAX_INPUT_TOKENS", "8191"))
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "250000"))
+EMBED_MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", "2048"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+
+def make_batches(texts, max_tokens=EMBED_MAX_BATCH_TOKENS, max_items=EMBED_MAX_BATCH_ITEMS):
+    """
+    Pack texts into batches that stay below the token and item limits.
+    Returns a list of (indices, texts) pairs in original order.
+    """
+    batches = []
+    indices, batch, batch_tokens = [], [], 0
+    total_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if tokens > EMBED_MAX_INPUT_TOKENS:
+            print(f"⚠️ Chunk {i} has {tokens} tokens, truncating to {EMBED_MAX_INPUT_TOKENS}")
+            text = truncate_tokens(text, EMBED_MAX_INPUT_TOKENS)
+            tokens = EMBED_MAX_INPUT_TOKENS
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            batches.append((indices, batch))
+            indices, batch, batch_tokens = [], [], 0
+        indices.append(i)
+        batch.append(text)
+        batch_tokens += tokens
+        total_tokens += tokens
+    if batch:
+        batches.append((indices, batch))
+    metrics.inc("coaching_embedding_input_tokens_total", total_tokens)
+    metrics.inc("coaching_embedding_inputs_total", len(texts))
+    return batches
+
+
+def embed_batch(texts):
+    """Embed one batch. Rate limits and transient errors are retried by the HTTP transport (see resilience.py)"""
+    with metrics.span("embed.batch"):
+        return embed_text(texts)
+
+
+def embed_chunks(chunks, concurrency=EMBED_CONCURRENCY):
+    """Embed any number of chunks in token-bounded batches sent concurrently. Output order matches input order."""
+    batches = make_batches(chunks)
+    embeddings = [None] * len(chunks)
+    if not batches:
+        return embeddings
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as pool:
+        results = pool.map(embed_batch, [texts for _, texts in batches])
+        for (indices, _), batch_embeddings in zip(batches, results):
+            for i, embedding in zip(indices, batch_embeddings):
+                embeddings[i] = embedding
+    return embeddings
@@ -0,0 +1,86 @@
+import os
+import json
+import numpy as np
+
+# How documents embeddings are written and read back over PostgREST:
+#   json     float lists in the pgvector "embedding" column (~20 bytes a dimension)
+#   float16  packed into "embedding_packed" (2 bytes a dimension)
+#   int8     packed into "embedding_packed" with a per-row scale (1 byte a dimension)
+# A trigger (migrations/004) fills "embedding" from "embedding_packed", so match_documents is unchanged.
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "json")
+
+ENCODINGS = ("json", "float16", "int8")
+# first byte of a packed embedding; the rest is little-endian
+FLOAT16, INT8 = 1, 2
+
+if EMBEDDING_ENCODING not in ENCODINGS:
+    raise ValueError(f"Unsupported EMBEDDING_ENCODING: {EMBEDDING_ENCODING}")
+
+
+def column(encoding=EMBEDDING_ENCODING):
+    """The documents column embeddings are written to and read from"""
+    return "embedding" if encoding == "json" else "embedding_packed"
+
+
+def reduce(vector, dimensions):
+    """
+    Shorten a text-embedding-3 vector to its first `dimensions` values and
+    re-normalise, which is what the API returns for the same `dimensions`.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if not dimensions or dimensions == len(vector):
+        return vector
+    if dimensions > len(vector):
+        raise ValueError(f"Cannot grow a {len(vector)}-dimension embedding to {dimensions}")
+    vector = vector[:dimensions]
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def pack(vector, encoding):
+    vector = np.asarray(vector, dtype=np.float32)
+    if encoding == "float16":
+        return bytes([FLOAT16]) + vector.astype("<f2").tobytes()
+    if encoding == "int8":
+        scale = max(float(np.abs(vector).max(initial=0.0)), 1e-12) / 127.0
+        values = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+        return bytes([INT8]) + np.float32(scale).astype("<f4").tobytes() + values.tobytes()
+    raise ValueError(f"Unsupported packed encoding: {encoding}")
+
+
+def unpack(data):
+    if data[0] == FLOAT16:
+        return np.frombuffer(data, dtype="<f2", offset=1).astype(np.float32)
+    if data[0] == INT8:
+        scale = np.frombuffer(data, dtype="<f4", count=1, offset=1)[0]
+        return np.frombuffer(data, dtype=np.int8, offset=5).astype(np.float32) * scale
+    raise ValueError(f"Unknown packed embedding format: {data[0]}")
+
+
+def encode(vector, encoding=EMBEDDING_ENCODING):
+    """The documents column values for an embedding: {"embedding": [...]} or {"embedding_packed": "\\x..."}"""
+    if encoding == "json":
+        return {"embedding": vector if isinstance(vector, list) else np.asarray(vector, dtype=np.float32).tolist()}
+    # PostgREST reads and writes bytea as hex text
+    return {"embedding_packed": "\\x" + pack(vector, encoding).hex()}
+
+
+def decode(value):
+    """A float32 vector from a list, a pgvector '[...]' string or a packed '\\x...' bytea string"""
+    if isinstance(value, str):
+        if value.startswith("\\x"):
+            return unpack(bytes.fromhex(value[2:]))
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def decode_row(row):
+    """The embedding of a documents row (packed column first), or None when it has none"""
+    for name in ("embedding_packed", "embedding"):
+        if row.get(name) is not None:
+            return decode(row[name])
+    return None
+
+
+def payload_bytes(vector, encoding):
+    """Size of the embedding as sent in a JSON request body"""
+    return len(json.dumps(encode(vector, encoding)))
@@ -0,0 +1,87 @@
+import re
+import asyncio
+from utils import get_async_supabase
+
+ANSWER_COLUMNS = "id, chat_id, role, message, document_ids, created_at"
+# Transcript lines start with "#<chat_history id>" so a reply to one can be flagged
+ROW_TAG = re.compile(r"^#(\d+) ", re.MULTILINE)
+
+
+def parse_row_ids(args):
+    """chat_history ids from /flag arguments ("123" or "#123")"""
+    ids = [int(arg.lstrip("#")) for arg in args if arg.lstrip("#").isdigit()]
+    return list(dict.fromkeys(ids))
+
+
+def tagged_row_ids(text):
+    """chat_history ids of the transcript lines in a message"""
+    return [int(m) for m in ROW_TAG.findall(text or "")]
+
+
+async def answers_by_message(chat_id, message_ids):
+    """Bot answers sent in chat_id as any of the given Telegram message ids"""
+    db = await get_async_supabase()
+    rows = await db.table("chat_history")\
+                .select(ANSWER_COLUMNS)\
+                .eq("chat_id", chat_id)\
+                .eq("role", "bot")\
+                .overlaps("telegram_message_ids", list(message_ids))\
+                .execute()
+    return rows.data
+
+
+async def answers_by_id(row_ids):
+    db = await get_async_supabase()
+    rows = await db.table("chat_history")\
+                .select(ANSWER_COLUMNS)\
+                .in_("id", list(row_ids))\
+                .eq("role", "bot")\
+                .execute()
+    return rows.data
+
+
+async def answers_by_text(text):
+    """Fallback for transcripts sent before rows were tagged: the latest answer with exactly this text"""
+    db = await get_async_supabase()
+    rows = await db.table("chat_history")\
+                .select(ANSWER_COLUMNS)\
+                .eq("role", "bot")\
+                .eq("message", text)\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+    return rows.data
+
+
+async def question_for(answer):
+    """The user message right before an answer in the same chat"""
+    db = await get_async_supabase()
+    rows = await db.table("chat_history")\
+                .select("message")\
+                .eq("chat_id", answer["chat_id"])\
+                .eq("role", "user")\
+                .lt("created_at", answer["created_at"])\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+    return rows.data[0]["message"] if rows.data else None
+
+
+async def flag_answers(answers):
+    """Insert flagged_answers rows for the given chat_history answers; already flagged ones are skipped"""
+    if not answers:
+        return 0
+    questions = await asyncio.gather(*(question_for(answer) for answer in answers))
+    rows = [{
+                "chat_history_id": answer["id"],
+                "question": question,
+                "answer": answer["message"],
+                "document_ids": answer["document_ids"],
+            } for answer, question in zip(answers, questions) if question is not None]
+    if not rows:
+        return 0
+    db = await get_async_supabase()
+    await db.table("flagged_answers")\
+            .upsert(rows, on_conflict="chat_history_id", ignore_duplicates=True)\
+            .execute()
+    return len(rows)
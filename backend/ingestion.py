@@ -1,186 +1,350 @@
 import os
-import io
+import json
+import time
+import hashlib
 import tempfile
-import fitz
-import docx2txt
-import threading
-from utils import embed_text, supabase, ytt_api, ADMIN_ID
-from flask import Flask, request, jsonify
-import re
-import edoc
-from PIL import Image
-import pytesseract
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from utils import embed_text, get_supabase, get_supabase_http, fetch_admin_metadata, EMBEDDING_DIMENSIONS
+from embedder import embed_chunks
+from chunker import iter_token_chunks
+import vector_index
+import embedding_codec
+import document_events
+import settings
+import metrics
+from jobs import JobManager, JobQueueFull
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-
-def is_youtube_url(url):
-    # Regex to match common YouTube URL patterns
-    youtube_regex = (
-        r'(https?://)?(www\.)?'
-        r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
-        r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-    )
-    youtube_regex_match = re.match(youtube_regex, url)
-    return youtube_regex_match is not None
-
-
-def extract_video_id(url):
-    # Regex to extract YouTube video ID (11 characters)
-    regex = r'(?:v=|\/embed\/|\/\d+\/|\/shorts\/|\/watch\?v=|youtu\.be\/|\/embed\/|\/v\/|\/)([a-zA-Z0-9_-]{11})'
-    
-    # Find all matches
-    match = re.search(regex, url)
-    
-    if match:
-        video_id = match.group(1)
-        # Ensure it's exactly 11 characters
-        if len(video_id) == 11:
-            return video_id
-    return None
+from ocr import ocr_pages, open_pdf
+from youtube import is_youtube_url, extract_video_id, fetch_transcript
+import youtube
 
 
 def ocr_pdf_from_bytes_pymupdf(pdf_bytes):
     """
-    Run OCR on a PDF given as bytes using PyMuPDF to render pages as images.
+    Run OCR on every page of a PDF given as bytes using PyMuPDF to render pages as images.
     No Poppler required.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    text = ""
-    for i, page in enumerate(doc, start=1):
-        # Render page to an image (RGB)
-        pix = page.get_pixmap(dpi=300)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        
-        # Run OCR
-        page_text = pytesseract.image_to_string(img, lang="eng")
-        text += f"\n--- OCR Page {i} ---\n{page_text}"
-    return text
+    doc = open_pdf(pdf_bytes)
+    parts = []
+    for i, page_text in ocr_pages(pdf_bytes, range(doc.page_count)):
+        parts.append(f"\n--- OCR Page {i + 1} ---\n{page_text}")
+    return "".join(parts)
 
 
-def extract_pdf_text_from_bytes(pdf_bytes, min_chars_threshold=20):
+def iter_pdf_pages(source, min_chars_threshold=20):
     """
-    Extract text from PDF bytes. If not enough text, run OCR using PyMuPDF.
+    Yield the text of each page of a PDF (file path or bytes) in order.
+    Pages without a usable text layer (fewer than min_chars_threshold characters)
+    are OCR'd in parallel while the text pages stream through.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    extracted_text = ""
+    doc = open_pdf(source)
+    # the text layer is read once: it decides which pages need OCR and is the text of the others
+    texts = [page.get_text() for page in doc]
+    scanned = [i for i, text in enumerate(texts) if len(text.strip()) < min_chars_threshold]
 
-    for page in doc:
-        page_text = page.get_text()
-        extracted_text += page_text
-    
-    if len(extracted_text) > min_chars_threshold:
+    if not scanned:
         print("✅ PDF is text-based. Extracting directly.")
-        return extracted_text
     else:
-        print("⚠️ PDF is image-based. Running OCR fallback.")
-        return ocr_pdf_from_bytes_pymupdf(pdf_bytes)
-    
+        print(f"⚠️ {len(scanned)}/{doc.page_count} PDF pages have no text layer. Running OCR on them.")
+    ocr_results = ocr_pages(source, scanned)
+    scanned = set(scanned)
+    for i, text in enumerate(texts):
+        if i in scanned:
+            _, page_text = next(ocr_results)
+            yield page_text
+        else:
+            yield text
 
-def extract_text(file_path: str, file_type: str) -> str:
-    """Extract plain text from PDF, DOCX, TXT"""
-    text = ""
+
+def extract_pdf_text_from_bytes(pdf_bytes, min_chars_threshold=20):
+    """
+    Extract text from PDF bytes. Pages without a text layer are OCR'd.
+    """
+    return "".join(iter_pdf_pages(pdf_bytes, min_chars_threshold))
+
+
+def iter_text(file_path: str, file_type: str):
+    """
+    Yield (text, metadata) segments from PDF, DOCX, TXT:
+    one per page for PDF (with its page number), line blocks for TXT.
+    """
     if file_type == "pdf":
-        with open(file_path, "rb") as f:
-            pdf_bytes = f.read()
-        text = extract_pdf_text_from_bytes(pdf_bytes)
+        for i, page_text in enumerate(iter_pdf_pages(file_path)):
+            yield page_text, {"page": i + 1}
 
     elif file_type== "docx":
-        text = docx2txt.process(file_path)
-    
+        import docx2txt
+        yield docx2txt.process(file_path), {}
+
     elif file_type == "txt":
         with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    
+            while True:
+                block = f.readlines(1024 * 1024)
+                if not block:
+                    break
+                yield "".join(block), {}
+
     elif file_type == "doc":
-        text = edoc.extraxt_txt(file_path)
-    
+        import edoc
+        yield edoc.extraxt_txt(file_path), {}
+
     else:
         raise ValueError("Unsupported file type")
-    
-    return text
 
 
-def chunk_text(text: str, chunk_size=300, overlap=50):
-    """Split text into chunks with overlap"""
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
+def extract_text(file_path: str, file_type: str) -> str:
+    """Extract plain text from PDF, DOCX, TXT"""
+    return "".join(text for text, _ in iter_text(file_path, file_type))
 
 
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-def process_file(file_storage_path, file_name, file_path, file_type, user_id):
+
+def download_to_file(file_storage_path, dest):
+    """Stream a file from Supabase storage to dest without holding it in memory"""
+    bucket = get_supabase().storage.from_("coaching-files")
+    signed = bucket.create_signed_url(file_storage_path, 600)
+    url = signed.get("signedURL") or signed.get("signedUrl")
+    with get_supabase_http().stream("GET", url, timeout=60) as response:
+        response.raise_for_status()
+        for block in response.iter_bytes(1024 * 1024):
+            dest.write(block)
+
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "128"))
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "4"))
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embed_and_insert(chunks, row_fields, progress):
+    """
+    Embed (chunk_index, chunk) pairs in batches and insert each batch as soon as
+    it is embedded. At most INGEST_MAX_IN_FLIGHT batches are held in memory at a time.
+    """
+    inserted = 0
+    batches = 0
+    in_flight = deque()
+
+    def flush_one():
+        nonlocal inserted, batches
+        batch, future = in_flight.popleft()
+        embeddings = future.result()
+        data = []
+        for (chunk_index, chunk), embedding in zip(batch, embeddings):
+            data.append({
+                **row_fields,
+                "content": chunk.text,
+                "content_hash": content_hash(chunk.text),
+                "chunk_index": chunk_index,
+                "metadata": chunk.metadata,
+                **embedding_codec.encode(embedding),
+            })
+        with metrics.span("ingest.insert"):
+            response = get_supabase().table("documents").insert(data).execute()
+        document_events.publish("upsert", [{**row, "id": saved["id"]} for row, saved in zip(data, response.data)])
+        inserted += len(data)
+        batches += 1
+        progress(stage="embed", batches_done=batches, chunks_done=inserted)
+
+    with ThreadPoolExecutor(max_workers=INGEST_MAX_IN_FLIGHT) as pool:
+        for batch in iter_batches(chunks, INGEST_BATCH_SIZE):
+            if len(in_flight) >= INGEST_MAX_IN_FLIGHT:
+                flush_one()
+            texts = [chunk.text for _, chunk in batch]
+            in_flight.append((batch, pool.submit(embed_chunks, texts, 1)))
+        while in_flight:
+            flush_one()
+    return inserted
+
+
+def document_identity(row_fields):
+    """
+    Filters finding the stored rows of a document across re-uploads. The dashboard
+    stores every upload under a new random storage path, so a file is identified
+    by its owner and name; a link by its (canonical) URL.
+    """
+    if row_fields["file_type"] == "link" or not row_fields.get("file_name"):
+        return {"file_storage_path": row_fields["file_storage_path"]}
+    return {"user_id": row_fields["user_id"], "file_name": row_fields["file_name"]}
+
+
+def fetch_existing_chunks(identity, page_size=1000):
+    """documents rows already stored for a document: id, chunk_index, content_hash, metadata and location"""
+    rows = []
+    after = None
+    while True:
+        query = get_supabase().table("documents")\
+                    .select("id, chunk_index, content_hash, metadata, file_storage_path, file_path")
+        for column, value in identity.items():
+            query = query.eq(column, value)
+        query = query.order("id").limit(page_size)
+        if after is not None:
+            query = query.gt("id", after)
+        page = query.execute().data
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        after = page[-1]["id"]
+
+    # rows stored before content_hash existed: hash them once from their content
+    unhashed = [row for row in rows if not row.get("content_hash")]
+    for batch in iter_batches(unhashed, 200):
+        contents = get_supabase().table("documents")\
+                    .select("id, content")\
+                    .in_("id", [row["id"] for row in batch])\
+                    .execute().data
+        by_id = {row["id"]: row["content"] for row in contents}
+        for row in batch:
+            if by_id.get(row["id"]) is not None:
+                row["content_hash"] = content_hash(by_id[row["id"]])
+                row["backfill_hash"] = True
+    return rows
+
+
+def delete_documents(ids):
+    for batch in iter_batches(ids, 500):
+        get_supabase().table("documents").delete().in_("id", batch).execute()
+        document_events.publish("delete", batch)
+
+
+def sync_chunks(chunks, row_fields, progress):
+    """
+    Make the documents rows of a document (found by document_identity) match its
+    new chunks. Rows whose content hash matches a new chunk are kept (their
+    embedding is reused; chunk_index, metadata, hash and storage path are updated
+    in bulk when they changed), only new or changed chunks are embedded and
+    inserted, and rows matching no chunk are deleted.
+    An extraction that yields no chunks at all (e.g. OCR or a transcript fetch
+    that came back empty) leaves the stored rows as they are.
+    """
+    progress(stage="diff")
+    existing = {}
+    with metrics.span("ingest.diff"):
+        for row in fetch_existing_chunks(document_identity(row_fields)):
+            existing.setdefault(row.get("content_hash"), deque()).append(row)
+
+    moved = []
+    reused = 0
+    seen = 0
+
+    def new_chunks():
+        nonlocal reused, seen
+        for chunk_index, chunk in enumerate(chunks):
+            seen += 1
+            candidates = existing.get(content_hash(chunk.text))
+            if not candidates:
+                yield chunk_index, chunk
+                continue
+            # prefer the row already at this position
+            row = next((r for r in candidates if r["chunk_index"] == chunk_index), candidates[0])
+            candidates.remove(row)
+            reused += 1
+            # a re-upload keeps its unchanged rows, pointed at the new storage path
+            relocated = row.get("file_storage_path") != row_fields["file_storage_path"] \
+                or row.get("file_path") != row_fields["file_path"]
+            if row["chunk_index"] != chunk_index or (row.get("metadata") or {}) != chunk.metadata \
+                    or row.get("backfill_hash") or relocated:
+                moved.append({
+                    **row_fields,
+                    "id": row["id"],
+                    "content": chunk.text,
+                    "content_hash": content_hash(chunk.text),
+                    "chunk_index": chunk_index,
+                    "metadata": chunk.metadata,
+                })
+
+    # new rows go in first and stale rows go last, so search never sees the file missing
+    inserted = embed_and_insert(new_chunks(), row_fields, progress)
+    for batch in iter_batches(moved, 500):
+        # upsert only writes the columns sent, so the stored embeddings stay as they are
+        with metrics.span("ingest.update"):
+            get_supabase().table("documents").upsert(batch, on_conflict="id").execute()
+        # no embedding in the event: the vector index keeps the vector and only updates the row's metadata
+        document_events.publish("upsert", batch)
+    stale = [row["id"] for rows in existing.values() for row in rows]
+    if not seen and stale:
+        print(f"⚠️ {row_fields['file_storage_path']}: no text extracted, keeping its {len(stale)} stored chunks")
+        stale = []
+    with metrics.span("ingest.delete"):
+        delete_documents(stale)
+
+    stats = {"inserted": inserted, "reused": reused, "updated": len(moved), "deleted": len(stale)}
+    for result, count in stats.items():
+        metrics.inc("coaching_ingest_chunks_total", count, result=result)
+    metrics.observe("coaching_ingest_file_chunks", inserted + reused, buckets=metrics.COUNT_BUCKETS)
+    progress(stage="done", **stats)
+    print(f"✅ {row_fields['file_storage_path']}: {stats}")
+    return stats
+
+
+def process_file(file_storage_path, file_name, file_path, file_type, user_id, progress=None):
+    if progress is None:
+        progress = lambda **fields: None
     if not file_storage_path or not file_type or not user_id:
         print({"error": "Missing required params"})
         return None
-    
+
+    row_fields = {
+        "user_id": user_id,
+        "file_name": file_name,
+        "file_path" : file_path,
+        "file_type" : file_type,
+        "file_storage_path":file_storage_path,
+    }
+
     if file_type == "link":
         
         if is_youtube_url(file_path):
             video_id = extract_video_id(file_path)
-            transcript = ytt_api.fetch(video_id)
-            text = " ".join([entry.text for entry in transcript])
-        else:
-            return
-    else:
-        try:
-            response = supabase.storage.from_("coaching-files").download(file_storage_path)
-            if not response:
-                print({"error": "File not found in Supabase"})
-                return
+            progress(stage="transcript")
+            with metrics.span("ingest.transcript"):
+                transcript = fetch_transcript(video_id)
+            segments = ((text, {"start": start, "end": start + duration}) for text, start, duration in transcript)
+            sync_chunks(metrics.timed_iter(iter_token_chunks(segments), "ingest.chunk"), row_fields, progress)
+        return
 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_type) as tmp:
-                tmp.write(response)
+    tmp_path = None
+    try:
+        try:
+            progress(stage="download")
+            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp:
                 tmp_path = tmp.name
+                with metrics.span("ingest.download"):
+                    download_to_file(file_storage_path, tmp)
         except Exception as e:
             print({"error": f"Download failed: {str(e)}"})
             return None
-        try:
-            text = extract_text(tmp_path, file_type)
-        except Exception as e:
-            print({"error": f"Extract failed: {str(e)}"})
-            return
-        finally:
+
+        progress(stage="extract")
+        # extraction (OCR included) and chunking are lazy, so time each share of the pipeline
+        text = metrics.timed_iter(iter_text(tmp_path, file_type), "ingest.extract", file_type=file_type)
+        sync_chunks(metrics.timed_iter(iter_token_chunks(text), "ingest.chunk"), row_fields, progress)
+    finally:
+        if tmp_path:
             os.remove(tmp_path)  # cleanup temp file
-    if text == "":
-        return
-    
-    chunks = chunk_text(text)
-
-    embeddings = embed_text(chunks)
-    data = []
-    for i, embedding in enumerate(embeddings):
-        data.append({
-            "user_id": user_id,
-            "file_name": file_name,
-            "file_path" : file_path,
-            "file_type" : file_type,
-            "file_storage_path":file_storage_path,
-            "content": chunks[i],
-            "chunk_index": i,
-            "embedding": embedding
-        })
-
-    supabase.table("documents").insert(data).execute()
-
-
-def process_file_in_thread(file_storage_path, file_name, file_path, file_type, user_id, file_id, callback=None):
-    def wrapper():
-        try:
-            process_file(file_storage_path, file_name, file_path, file_type, user_id)
-            if callback:
-                callback(file_id,file_type, None)  # success
-        except Exception as e:
-            if callback:
-                callback(None, None, e)  # error
 
-    thread = threading.Thread(target=wrapper, daemon=True)
-    thread.start()
-    return thread
+
+def process_file_job(job, file_storage_path, file_name, file_path, file_type, user_id, file_id):
+    try:
+        process_file(file_storage_path, file_name, file_path, file_type, user_id, progress=job.set_progress)
+    except Exception as e:
+        on_process_complete(file_id, file_type, e)
+        raise
+    on_process_complete(file_id, file_type, None)
 
 
 def on_process_complete(file_id, file_type, error):
@@ -188,9 +352,9 @@ def on_process_complete(file_id, file_type, error):
         print(f"❌ Process failed: {error}")
         try:
             if file_type == "link":
-                response = (supabase.table("videolinks").update({"status": "failed", "updated_at": "NOW()"}).eq("id", file_id).execute())
+                response = (get_supabase().table("videolinks").update({"status": "failed", "updated_at": "NOW()"}).eq("id", file_id).execute())
             else:
-                response = (supabase.table("files").update({"status": "failed", "updated_at": "NOW()"}).eq("id", file_id).execute())
+                response = (get_supabase().table("files").update({"status": "failed", "updated_at": "NOW()"}).eq("id", file_id).execute())
             print("✅ Status updated successfully")
         except Exception as e:
             print({"error": f"Update status failed: {str(e)}"})
@@ -198,13 +362,103 @@ def on_process_complete(file_id, file_type, error):
         print("✅ Process finished successfully")
         try:
             if file_type == "link":
-                response = (supabase.table("videolinks").update({"status": "processed", "updated_at": "NOW()"}).eq("id", file_id).execute())
+                response = (get_supabase().table("videolinks").update({"status": "processed", "updated_at": "NOW()"}).eq("id", file_id).execute())
             else:
-                response = (supabase.table("files").update({"status": "processed", "updated_at": "NOW()"}).eq("id", file_id).execute())
+                response = (get_supabase().table("files").update({"status": "processed", "updated_at": "NOW()"}).eq("id", file_id).execute())
             print("✅ Status updated successfully")
         except Exception as e:
             print({"error": f"Update status failed: {str(e)}"})
 
+LINK_IMPORT_CONCURRENCY = int(os.getenv("LINK_IMPORT_CONCURRENCY", "8"))
+# failures kept in a bulk import's progress
+LINK_IMPORT_MAX_ERRORS = 50
+
+
+def expand_links(videos):
+    """
+    One {"url", "video_link_id", "video_id"} entry per video, url in canonical
+    form: playlists are expanded and repeats dropped
+    """
+    expanded, invalid = {}, []
+    for video in videos:
+        list_id = youtube.playlist_id(video["url"])
+        entries = [{"url": youtube.video_url(v)} for v in youtube.expand_playlist(list_id)] if list_id else [video]
+        for entry in entries:
+            video_id = extract_video_id(entry["url"]) if is_youtube_url(entry["url"]) else None
+            if video_id is None:
+                invalid.append(entry["url"])
+            elif video_id not in expanded or (entry.get("video_link_id") and not expanded[video_id].get("video_link_id")):
+                # a video listed on its own keeps its videolinks row even when a playlist has it too.
+                # Chunks are stored under the canonical URL whatever form was posted (youtu.be, /shorts/, &t=),
+                # so re-importing a video diffs against its stored chunks instead of adding a second copy
+                expanded[video_id] = {**entry, "url": youtube.canonical_url(entry["url"]), "video_id": video_id}
+    return list(expanded.values()), invalid
+
+
+def ensure_video_links(entries):
+    """Give every entry a videolinks row (found by url, or created) so the dashboard shows its status"""
+    missing = [e for e in entries if not e.get("video_link_id")]
+    for batch in iter_batches(missing, 200):
+        urls = [e["url"] for e in batch]
+        found = get_supabase().table("videolinks").select("id, url").in_("url", urls).execute().data
+        by_url = {row["url"]: row["id"] for row in found}
+        new = [{"url": url, "status": "processing"} for url in dict.fromkeys(urls) if url not in by_url]
+        if new:
+            for row in get_supabase().table("videolinks").insert(new).execute().data:
+                by_url[row["url"]] = row["id"]
+        for entry in batch:
+            entry["video_link_id"] = by_url.get(entry["url"])
+
+
+def import_video(entry, user_id):
+    """process_file for one video of a bulk import; returns the error, or None"""
+    try:
+        process_file(entry["url"], "", entry["url"], "link", user_id)
+    except Exception as e:
+        error = e
+    else:
+        error = None
+    if entry.get("video_link_id"):
+        on_process_complete(entry["video_link_id"], "link", error)
+    return error
+
+
+def process_links_job(job, videos, user_id):
+    """
+    Import many YouTube videos (playlists expanded) with LINK_IMPORT_CONCURRENCY
+    at a time. Finished videos are kept in the job progress, so a job resumed
+    after a restart skips them; failed videos do not stop the others.
+    """
+    if "entries" not in job.progress:
+        job.set_progress(stage="expand")
+        entries, invalid = expand_links(videos)
+        ensure_video_links(entries)
+        job.set_progress(stage="import", entries=entries, invalid=invalid, total=len(entries), finished=[],
+                         failures=0, failed={})
+    finished = set(job.progress["finished"])
+    failures = job.progress["failures"]
+    failed = dict(job.progress["failed"])
+    pending = [e for e in job.progress["entries"] if e["video_id"] not in finished]
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=max(1, LINK_IMPORT_CONCURRENCY)) as pool:
+        futures = {pool.submit(import_video, entry, user_id): entry for entry in pending}
+        for future in as_completed(futures):
+            entry = futures[future]
+            error = future.result()
+            finished.add(entry["video_id"])
+            if error is not None:
+                failures += 1
+                if len(failed) < LINK_IMPORT_MAX_ERRORS:
+                    # the first line says what went wrong; youtube_transcript_api adds a page of advice after it
+                    message = (str(error).strip().splitlines() or [""])[0]
+                    failed[entry["video_id"]] = f"{type(error).__name__}: {message}"
+            job.set_progress(finished=sorted(finished), failures=failures, failed=failed, done=len(finished),
+                             videos_per_minute=round(len(finished) / max(time.time() - started, 1e-9) * 60, 1))
+    job.set_progress(stage="done")
+    print(f"✅ Imported {len(finished) - failures} of {job.progress['total']} videos ({failures} failed)")
+
+
 def on_update_embedding_complete(error=None):
     if error:
         print(f"❌ Process failed: {error}")
@@ -213,27 +467,189 @@ def on_update_embedding_complete(error=None):
 
 
 def update_embedding(ducument_id):
-    content = supabase.table("documents")\
-                    .select("content")\
+    content = get_supabase().table("documents")\
+                    .select(", ".join(vector_index.META_COLUMNS))\
                     .eq("id", ducument_id)\
                     .execute()
     embeddings = embed_text([content.data[0]["content"]])
-    (supabase.table("documents").update({"embedding": embeddings[0]}).eq("id", ducument_id).execute())
+    encoded = embedding_codec.encode(embeddings[0])
+    (get_supabase().table("documents").update({
+        **encoded,
+        "content_hash": content_hash(content.data[0]["content"]),
+    }).eq("id", ducument_id).execute())
+    document_events.publish("upsert", [{**content.data[0], **encoded}])
+
+def update_embedding_job(job, document_id):
+    try:
+        update_embedding(document_id)
+    except Exception as e:
+        on_update_embedding_complete(e)
+        raise
+    on_update_embedding_complete()
+
+
+REINDEX_PAGE_SIZE = int(os.getenv("REINDEX_PAGE_SIZE", "2000"))
+REINDEX_WRITE_BATCH = int(os.getenv("REINDEX_WRITE_BATCH", "500"))
+REINDEX_COLUMNS = ("id", "user_id", "file_name", "file_path", "file_type", "file_storage_path",
+                   "content", "chunk_index", "metadata")
+
+
+def _reindex_query(columns, document_ids=None, file_storage_path=None, user_id=None, only_missing=False,
+                   only_embedded=False, count=None):
+    query = get_supabase().table("documents").select(", ".join(columns), count=count)
+    if document_ids is not None:
+        query = query.in_("id", document_ids)
+    if file_storage_path is not None:
+        query = query.eq("file_storage_path", file_storage_path)
+    if user_id is not None:
+        query = query.eq("user_id", user_id)
+    if only_missing:
+        query = query.is_("embedding", "null")
+    if only_embedded:
+        query = query.not_.is_("embedding", "null")
+    return query
+
+
+def iter_reindex_pages(after=None, document_ids=None, page_size=REINDEX_PAGE_SIZE, columns=REINDEX_COLUMNS, **filters):
+    """Pages of documents rows to re-embed, in id order after the `after` checkpoint"""
+    if document_ids is not None:
+        # explicit ids: walk them in sorted slices instead of paging the table
+        pending = iter(sorted(i for i in set(document_ids) if after is None or i > after))
+        while True:
+            ids = list(islice(pending, page_size))
+            if not ids:
+                return
+            rows = _reindex_query(columns, document_ids=ids, **filters).order("id").execute().data
+            if rows:
+                yield rows
+        return
+    while True:
+        query = _reindex_query(columns, **filters).order("id").limit(page_size)
+        if after is not None:
+            query = query.gt("id", after)
+        rows = query.execute().data
+        if not rows:
+            return
+        yield rows
+        after = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
 
-def process_update_embedding_in_thread(document_id, callback=None):
-    def wrapper():
-        try:
-            update_embedding(document_id)
-            if callback:
-                callback()  # success
-        except Exception as e:
-            if callback:
-                callback(e)  # error
 
-    thread = threading.Thread(target=wrapper, daemon=True)
-    thread.start()
-    return thread
+def write_embeddings(rows, embeddings):
+    """Bulk upsert new embeddings (and content hashes) for existing rows, then tell the local indexes"""
+    data = [{
+        **row,
+        "content_hash": content_hash(row["content"]),
+        **embedding_codec.encode(embedding),
+    } for row, embedding in zip(rows, embeddings)]
+    for batch in iter_batches(data, REINDEX_WRITE_BATCH):
+        with metrics.span("reindex.write"):
+            get_supabase().table("documents").upsert(batch, on_conflict="id").execute()
+        document_events.publish("upsert", batch)
+    return len(data)
+
 
+def run_pages(job, stage, pages, compute, document_ids=None, **filters):
+    """
+    Compute and write new embeddings for pages of documents rows. Page N+1 is
+    read and page N-1 written while page N is computed. The last written id is
+    kept in the job progress, so a job resumed after a restart continues from there.
+    """
+    if "total" not in job.progress:
+        total = _reindex_query(("id",), document_ids=document_ids, count="exact", **filters).limit(1).execute().count
+        job.set_progress(stage=stage, total=total, done=0, after_id=None)
+    done = job.progress.get("done", 0)
+    started = time.time()
+
+    pages = pages(job.progress.get("after_id"), document_ids=document_ids, **filters)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        next_page = pool.submit(next, pages, None)
+        writing, last_id = None, None
+        while True:
+            rows = next_page.result()
+            if rows is None:
+                break
+            next_page = pool.submit(next, pages, None)
+            embeddings = compute(rows)
+            if writing is not None:
+                done += writing.result()
+                job.set_progress(done=done, after_id=last_id, rows_per_second=round(done / max(time.time() - started, 1e-9), 1))
+            writing = pool.submit(write_embeddings, rows, embeddings)
+            last_id = rows[-1]["id"]
+        if writing is not None:
+            done += writing.result()
+            job.set_progress(done=done, after_id=last_id)
+    job.set_progress(stage="done", done=done)
+    return done
+
+
+def reindex_job(job, document_ids=None, file_storage_path=None, user_id=None, only_missing=False):
+    """Re-embed a set of documents rows in large batches"""
+    done = run_pages(job, "reindex", iter_reindex_pages, lambda rows: embed_chunks([row["content"] or "" for row in rows]),
+                     document_ids=document_ids, file_storage_path=file_storage_path, user_id=user_id,
+                     only_missing=only_missing)
+    print(f"✅ Re-indexed {done} documents")
+
+
+def stored_embeddings(rows):
+    """Take the stored embedding off each row, shortened to EMBEDDING_DIMENSIONS"""
+    return [embedding_codec.reduce(embedding_codec.decode(row.pop("embedding")), EMBEDDING_DIMENSIONS) for row in rows]
+
+
+def iter_reencode_pages(after=None, **filters):
+    return iter_reindex_pages(after, columns=REINDEX_COLUMNS + ("embedding",), **filters)
+
+
+def reencode_job(job, document_ids=None, file_storage_path=None, user_id=None):
+    """
+    Re-write stored embeddings at EMBEDDING_DIMENSIONS in EMBEDDING_ENCODING,
+    from the vectors already in the embedding column (no embeddings API calls).
+    """
+    done = run_pages(job, "reencode", iter_reencode_pages, stored_embeddings,
+                     document_ids=document_ids, file_storage_path=file_storage_path, user_id=user_id,
+                     only_embedded=True)
+    print(f"✅ Re-encoded {done} documents as {embedding_codec.EMBEDDING_ENCODING}"
+          f" ({EMBEDDING_DIMENSIONS or 'full'} dimensions)")
+
+
+# OCR and extraction run on the cpu lane, transcript/embedding-only work on the io lane
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+job_manager = JobManager(
+    lanes={
+        "cpu": int(os.getenv("JOB_CPU_WORKERS", "2")),
+        "io": int(os.getenv("JOB_IO_WORKERS", "4")),
+    },
+    queue_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+    db_path=JOBS_DB_PATH or None,
+)
+job_manager.register("process_file", process_file_job, lane="cpu")
+job_manager.register("process_link", process_file_job, lane="io")
+job_manager.register("process_links", process_links_job, lane="io")
+job_manager.register("update_embedding", update_embedding_job, lane="io")
+job_manager.register("reindex", reindex_job, lane="io")
+job_manager.register("reencode", reencode_job, lane="io")
+
+
+def collect_job_metrics():
+    for lane, stats in job_manager.stats().items():
+        metrics.set_gauge("coaching_job_queue_depth", stats["queued"], lane=lane)
+        metrics.set_gauge("coaching_job_workers", stats["workers"], lane=lane)
+
+
+metrics.register_collector(collect_job_metrics)
+
+
+def submit_job(kind, payload, key):
+    try:
+        job, created = job_manager.submit(kind, payload, key=key)
+    except JobQueueFull as e:
+        return jsonify({"status": "busy", "error": str(e)}), 429
+    return jsonify({
+        "status": "success",
+        "job_id": job.id,
+        "duplicate": not created
+    }), 202 if created else 200
 
 
 flask_app = Flask("Coaching-AI")
@@ -242,6 +658,29 @@ CORS(flask_app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=Tr
 
 
 
+@flask_app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "ok"})
+
+
+@flask_app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: bot settings are loaded and ingestion workers are running
+    checks = {
+        "settings": settings.loaded.is_set(),
+        "jobs": job_manager.started,
+    }
+    ready = all(checks.values())
+    return jsonify({"status": "ready" if ready else "starting", "checks": checks}), 200 if ready else 503
+
+
+@flask_app.route("/api/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Prometheus text format: this process plus the latest snapshot from each bot process
+    return Response(metrics.render_all(), mimetype="text/plain; version=0.0.4")
+
+
 @flask_app.route("/api/process-file", methods=["POST"])
 def process_file_request():
     data = request.json
@@ -252,29 +691,54 @@ def process_file_request():
     file_storage_path = data.get("file_storage_path")
     user_id = data.get("user_id")
     file_id = data.get("file_id")
-    
-    process_file_in_thread(file_storage_path, file_name, file_path, file_type, user_id, file_id, callback=on_process_complete)
 
-    return jsonify({
-        "status": "success"
-    })
+    payload = {
+        "file_storage_path": file_storage_path,
+        "file_name": file_name,
+        "file_path": file_path,
+        "file_type": file_type,
+        "user_id": user_id,
+        "file_id": file_id,
+    }
+    return submit_job("process_file", payload, key=f"file:{file_id}")
 
 @flask_app.route("/api/process-video-link", methods=["POST"])
 def process_link_request():
     data = request.json
     
-    file_path = data.get("video_url")
+    # stored under the canonical URL, as bulk imports are, so both endpoints diff against the same rows
+    file_path = youtube.canonical_url(data.get("video_url") or "")
     file_type = "link"
     file_name = ""
-    file_storage_path = data.get("video_url")
+    file_storage_path = file_path
     user_id = data.get("user_id")
     file_id = data.get("video_link_id")
-    
-    process_file_in_thread(file_storage_path, file_name, file_path, file_type, user_id, file_id, callback=on_process_complete)
 
-    return jsonify({
-        "status": "success"
-    })
+    payload = {
+        "file_storage_path": file_storage_path,
+        "file_name": file_name,
+        "file_path": file_path,
+        "file_type": file_type,
+        "user_id": user_id,
+        "file_id": file_id,
+    }
+    return submit_job("process_link", payload, key=f"link:{file_id}")
+
+
+@flask_app.route("/api/process-video-links", methods=["POST"])
+def process_links_request():
+    """
+    Import many videos in one job. Body: {"user_id": ..., "video_urls": [...]}, where
+    a URL may be a playlist, or "videos": [{"video_url": ..., "video_link_id": ...}]
+    for videos that already have a videolinks row.
+    """
+    data = request.json or {}
+    videos = [{"url": url} for url in data.get("video_urls") or []]
+    videos += [{"url": v["video_url"], "video_link_id": v.get("video_link_id")} for v in data.get("videos") or []]
+    if not videos or not data.get("user_id"):
+        return jsonify({"status": "error", "error": "Pass user_id and video_urls or videos"}), 400
+    digest = hashlib.sha256(json.dumps(sorted(v["url"] for v in videos)).encode()).hexdigest()[:16]
+    return submit_job("process_links", {"videos": videos, "user_id": data["user_id"]}, key=f"links:{digest}")
 
 
 @flask_app.route("/api/update-embedding", methods=["POST"])
@@ -282,19 +746,65 @@ def process_update_embedding():
     data = request.json
     
     document_id = data.get("document_id")
-    
-    process_update_embedding_in_thread(document_id, callback=on_update_embedding_complete)
 
-    return jsonify({
-        "status": "success"
-    })
+    return submit_job("update_embedding", {"document_id": document_id}, key=f"document:{document_id}")
+
+
+def _scope(data):
+    """(scope fields, dedupe key part) of a bulk request, or None when it names no rows"""
+    scope = {k: data.get(k) for k in ("document_ids", "file_storage_path", "user_id")}
+    if not data.get("all") and not any(scope.values()):
+        return None
+    if scope["document_ids"] is not None:
+        return scope, f"ids:{hashlib.sha256(json.dumps(sorted(scope['document_ids'])).encode()).hexdigest()[:16]}"
+    return scope, f"{scope['file_storage_path'] or ''}:{scope['user_id'] or ''}"
+
+
+@flask_app.route("/api/reindex", methods=["POST"])
+def reindex_request():
+    """
+    Re-embed documents in bulk. Body: {"document_ids": [...]}, {"file_storage_path": ...},
+    {"user_id": ...} or {"all": true}; add "only_missing": true to skip rows that have an embedding.
+    """
+    data = request.json or {}
+    scope = _scope(data)
+    if scope is None:
+        return jsonify({"status": "error", "error": "Pass document_ids, file_storage_path, user_id or all"}), 400
+    payload, key = scope
+    payload["only_missing"] = bool(data.get("only_missing"))
+    return submit_job("reindex", payload, key=f"reindex:{key}:{payload['only_missing']}")
+
+
+@flask_app.route("/api/reencode", methods=["POST"])
+def reencode_request():
+    """
+    Re-write stored embeddings with the current EMBEDDING_DIMENSIONS and
+    EMBEDDING_ENCODING, without re-embedding. Same body as /api/reindex.
+    After changing EMBEDDING_DIMENSIONS, follow migrations/004 and restart the bot.
+    """
+    data = request.json or {}
+    scope = _scope(data)
+    if scope is None:
+        return jsonify({"status": "error", "error": "Pass document_ids, file_storage_path, user_id or all"}), 400
+    payload, key = scope
+    key = f"reencode:{key}:{embedding_codec.EMBEDDING_ENCODING}:{EMBEDDING_DIMENSIONS}"
+    return submit_job("reencode", payload, key=key)
+
+
+@flask_app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(job)
 
 @flask_app.route("/api/update-bot-settings", methods=["POST"])
 
 def process_update_bot_mode():
-    user_metadata = supabase.auth.admin.get_user_by_id(ADMIN_ID).user.user_metadata
-    flask_app.config["ns"].is_bot = user_metadata["is_bot"]
-    flask_app.config["ns"].telegram_username = user_metadata["telegram_id"]
+    # fresh: a fetch already in flight may have read the settings before this update
+    user_metadata = fetch_admin_metadata(fresh=True)
+    # swaps the snapshot here and forwards it to the bot process
+    settings.set_settings(settings.from_metadata(user_metadata))
 
     return jsonify({
         "status": "success"
@@ -0,0 +1,236 @@
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import metrics
+
+
+class JobQueueFull(Exception):
+    """Raised when a lane's queue is saturated and the caller should retry later"""
+
+
+class Job:
+    def __init__(self, kind, payload, lane, key=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.lane = lane
+        self.key = key
+        self.status = "queued"
+        self.progress = {}
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._manager = None
+
+    def set_progress(self, **fields):
+        """Merge fields into the job's progress and persist it"""
+        self.progress.update(fields)
+        self.updated_at = time.time()
+        if self._manager:
+            self._manager._save(self)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "lane": self.lane,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class JobManager:
+    """
+    Bounded background job runner.
+    Each lane ("cpu" for OCR/extraction heavy work, "io" for network bound work)
+    has its own bounded queue and fixed pool of worker threads. Jobs sharing a
+    key are deduplicated while one is still queued or running, and queued jobs
+    are optionally persisted to SQLite so they are resumed after a restart.
+    """
+
+    def __init__(self, lanes, queue_size=100, db_path=None, keep_finished=1000):
+        self.lanes = lanes
+        self.queues = {lane: queue.Queue(maxsize=queue_size) for lane in lanes}
+        self.handlers = {}
+        self.jobs = {}
+        self.active_keys = {}
+        self.keep_finished = keep_finished
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._started = False
+
+    def register(self, kind, handler, lane="io"):
+        """Register handler(job, **payload) for a job kind"""
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        self.handlers[kind] = (handler, lane)
+
+    @property
+    def started(self):
+        return self._started
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        if self.db_path:
+            self._restore()
+        for lane, workers in self.lanes.items():
+            for n in range(workers):
+                thread = threading.Thread(target=self._worker, args=(lane,), name=f"job-{lane}-{n}", daemon=True)
+                thread.start()
+
+    def submit(self, kind, payload, key=None):
+        """
+        Queue a job. Returns (job, created); created is False when an identical
+        job (same key) is already queued or running. Raises JobQueueFull.
+        """
+        handler, lane = self.handlers[kind]
+        with self._lock:
+            if key is not None and key in self.active_keys:
+                return self.jobs[self.active_keys[key]], False
+            job = Job(kind, payload, lane, key=key)
+            job._manager = self
+            try:
+                self.queues[lane].put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"The {lane} job queue is full")
+            self.jobs[job.id] = job
+            if key is not None:
+                self.active_keys[key] = job.id
+        self._save(job)
+        return job, True
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.db_path:
+            return self._load(job_id)
+        return None
+
+    def stats(self):
+        return {
+            lane: {"workers": self.lanes[lane], "queued": q.qsize(), "capacity": q.maxsize}
+            for lane, q in self.queues.items()
+        }
+
+    def _worker(self, lane):
+        while True:
+            job = self.queues[lane].get()
+            handler, _ = self.handlers[job.kind]
+            job.status = "running"
+            job.set_progress()
+            started = time.perf_counter()
+            metrics.add_gauge("coaching_jobs_in_flight", 1, kind=job.kind, lane=lane)
+            try:
+                handler(job, **job.payload)
+                job.status = "done"
+            except Exception as e:
+                print(f"❌ Job {job.id} ({job.kind}) failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                metrics.add_gauge("coaching_jobs_in_flight", -1, kind=job.kind, lane=lane)
+                metrics.observe("coaching_job_seconds", time.perf_counter() - started, kind=job.kind, status=job.status)
+                job.updated_at = time.time()
+                self._save(job)
+                with self._lock:
+                    if job.key is not None and self.active_keys.get(job.key) == job.id:
+                        del self.active_keys[job.key]
+                    self._prune()
+                self.queues[lane].task_done()
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j.status in ("done", "failed")]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda j: j.updated_at)
+        for job in finished[:len(finished) - self.keep_finished]:
+            del self.jobs[job.id]
+
+    # --- persistence ---
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    key TEXT,
+                    lane TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _save(self, job):
+        if not self.db_path:
+            return
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.key, job.lane, json.dumps(job.payload), job.status,
+                 json.dumps(job.progress), job.error, job.created_at, job.updated_at)
+            )
+            conn.commit()
+
+    def _load(self, job_id):
+        with self._db_lock:
+            row = self._connection().execute(
+                "SELECT id, kind, key, lane, status, progress, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        keys = ("id", "kind", "key", "lane", "status", "progress", "error", "created_at", "updated_at")
+        data = dict(zip(keys, row))
+        data["progress"] = json.loads(data["progress"])
+        return data
+
+    def _restore(self):
+        """Re-queue jobs that were queued or running when the process last stopped"""
+        with self._db_lock:
+            rows = self._connection().execute(
+                "SELECT id, kind, key, payload, progress, created_at FROM jobs "
+                "WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        restored = 0
+        for job_id, kind, key, payload, progress, created_at in rows:
+            if kind not in self.handlers:
+                continue
+            handler, lane = self.handlers[kind]
+            job = Job(kind, json.loads(payload), lane, key=key, job_id=job_id)
+            job._manager = self
+            job.progress = json.loads(progress)
+            job.created_at = created_at
+            try:
+                self.queues[lane].put_nowait(job)
+            except queue.Full:
+                break
+            self.jobs[job.id] = job
+            if key is not None:
+                self.active_keys[key] = job.id
+            restored += 1
+        if restored:
+            print(f"✅ Restored {restored} pending jobs")
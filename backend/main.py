@@ -1,24 +1,86 @@
-from ingestion import flask_app
-from telegram_bot import run_bot_in_thread
-from multiprocessing import Manager
-from utils import user_metadata
+import queue
+import signal
+import sys
+from ingestion import flask_app, job_manager
+from telegram_bot import run_bot_in_thread, TELEGRAM_MODE, TELEGRAM_WORKERS, TELEGRAM_TOKEN
+from multiprocessing import Pipe, Queue
+from utils import fetch_admin_metadata
+import document_events
+import metrics
+import settings
+import webhook
+
+# bot processes, and in webhook mode their update queues, for stop_services
+bot_processes = []
+update_queues = []
+
+def start_bot(document_events_queues, metrics_queue, updates=None):
+    # Each bot process keeps a local settings snapshot; this process sends it changes over a pipe
+    flask_settings, bot_settings = Pipe()
+    settings.connect(flask_settings)
+    events = Queue()
+    name = f"bot-{len(document_events_queues)}"
+    document_events_queues.append(events)
+    process = run_bot_in_thread(bot_settings, events, updates, metrics_queue, name=name)
+    bot_processes.append(process)
+    return process
 
 def start_services():
-    # Start Telegram bot
-    manager = Manager()
-    ns = manager.Namespace()
-    ns.is_bot = user_metadata["is_bot"]
-    ns.telegram_username = user_metadata["telegram_id"]
-    
-    flask_app.config['ns'] = ns
-
-    run_bot_in_thread(ns)
+    # Ingestion runs in this process, chat in the bot process(es): forward document changes to each
+    document_events_queues = []
+    document_events.set_publisher(lambda event: [q.put(event) for q in document_events_queues])
+    # Bot processes send their metrics here; /api/metrics serves them with this process's own
+    metrics_queue = Queue(maxsize=100)
+    metrics.collect(metrics_queue)
+    metrics.start_profiler("web")
+
+    if TELEGRAM_MODE == "webhook":
+        update_queues.extend(Queue(maxsize=webhook.TELEGRAM_WORKER_QUEUE_SIZE) for _ in range(max(1, TELEGRAM_WORKERS)))
+        dedup = webhook.UpdateDeduplicator(webhook.TELEGRAM_UPDATES_DB_PATH, webhook.TELEGRAM_UPDATE_DEDUP_SECONDS)
+        # refuses to start without TELEGRAM_WEBHOOK_SECRET, before any worker is started
+        webhook.register(flask_app, webhook.UpdateRouter(update_queues, dedup))
+        for updates in update_queues:
+            start_bot(document_events_queues, metrics_queue, updates)
+        if webhook.TELEGRAM_WEBHOOK_URL:
+            webhook.set_webhook_in_background(TELEGRAM_TOKEN)
+    else:
+        start_bot(document_events_queues, metrics_queue)
+
+    # The first settings snapshot is fetched in the background so startup does not wait on Supabase
+    settings.load_in_background(fetch_admin_metadata)
+
+    # Start ingestion workers (and resume jobs persisted before a restart)
+    job_manager.start()
     return flask_app
 
+def stop_services(timeout=30):
+    """Let the bot processes finish their updates and flush buffered chat history, then wait for them"""
+    if update_queues:
+        for updates in update_queues:
+            # a webhook worker stops after the updates queued before this
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+    else:
+        for process in bot_processes:
+            # run_polling stops gracefully on SIGTERM
+            process.terminate()
+    for process in bot_processes:
+        process.join(timeout)
+        if process.is_alive():
+            print(f"⚠️ {process.name} did not stop in {timeout}s, terminating it")
+            process.terminate()
+
 def main():
     app = start_services()
-    # Start Flask app in development mode
-    app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
+    # SIGTERM (e.g. from a process manager) unwinds like Ctrl+C, so the bots are stopped cleanly
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        # Start Flask app in development mode
+        app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
+    finally:
+        stop_services()
 
 if __name__ == "__main__":
     main()
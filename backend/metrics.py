@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import queue
+import bisect
+import threading
+import multiprocessing
+from collections import Counter
+from contextlib import contextmanager
+
+# Lightweight in-process metrics: counters, gauges and histograms with labels,
+# rendered in the Prometheus text format. Each process keeps its own registry;
+# bot processes send snapshots to the Flask process, which serves all of them
+# on /api/metrics with a "process" label.
+
+METRICS_EXPORT_SECONDS = float(os.getenv("METRICS_EXPORT_SECONDS", "10"))
+# Sampling profiler: stack samples per second (0 = off), written as folded stacks
+METRICS_PROFILE_HZ = float(os.getenv("METRICS_PROFILE_HZ", "0"))
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "profiles")
+METRICS_PROFILE_FLUSH_SECONDS = float(os.getenv("METRICS_PROFILE_FLUSH_SECONDS", "60"))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+STAGE_SECONDS = "coaching_stage_seconds"
+STAGE_ERRORS = "coaching_stage_errors_total"
+
+
+class Registry:
+    """Metric series keyed by (name, sorted label pairs). Safe to use from any thread."""
+
+    def __init__(self):
+        self.metrics = {}  # name -> {"type", "help", "buckets", "series": {labels: value}}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _series(self, name, kind, help, buckets=None):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = {"type": kind, "help": help, "buckets": buckets, "series": {}}
+        elif help and not metric["help"]:
+            metric["help"] = help
+        return metric["series"]
+
+    def inc(self, name, value=1, help="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series(name, "counter", help)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, help="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series(name, "gauge", help)[key] = value
+
+    def add(self, name, delta, help="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series(name, "gauge", help)
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, help="", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series(name, "histogram", help, buckets)
+            hist = series.get(key)
+            if hist is None:
+                # per-bucket counts (the last one is +Inf), sum, count
+                hist = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(buckets, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def snapshot(self):
+        """A plain-data copy of all series (picklable, so it can cross processes)"""
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {e}")
+        with self._lock:
+            return {
+                name: {
+                    **metric,
+                    "series": {
+                        key: [list(value[0]), value[1], value[2]] if metric["type"] == "histogram" else value
+                        for key, value in metric["series"].items()
+                    },
+                }
+                for name, metric in self.metrics.items()
+            }
+
+
+registry = Registry()
+
+
+def _reset_after_fork():
+    # a forked bot process starts with empty series (and without the web process's collectors)
+    registry.metrics.clear()
+    registry.collectors.clear()
+    registry._lock = threading.Lock()
+    _remote.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+inc = registry.inc
+set_gauge = registry.set
+add_gauge = registry.add
+observe = registry.observe
+
+
+def register_collector(collect):
+    """collect() runs before every snapshot, to set gauges read from elsewhere (queue depths, index sizes)"""
+    registry.collectors.append(collect)
+
+
+@contextmanager
+def span(stage, **labels):
+    """Time a block into the stage latency histogram; exceptions also count as stage errors"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc(STAGE_ERRORS, stage=stage, **labels)
+        raise
+    finally:
+        observe(STAGE_SECONDS, time.perf_counter() - start, help="Time spent per stage", stage=stage, **labels)
+
+
+@contextmanager
+def in_flight(name, **labels):
+    """Gauge of how many blocks with these labels are currently running"""
+    add_gauge(name, 1, **labels)
+    try:
+        yield
+    finally:
+        add_gauge(name, -1, **labels)
+
+
+_timed_stack = threading.local()
+
+
+def _timed_frames():
+    frames = getattr(_timed_stack, "frames", None)
+    if frames is None:
+        frames = _timed_stack.frames = []
+    return frames
+
+
+def timed_iter(iterable, stage, **labels):
+    """
+    Yield from iterable, timing only the work done producing items. Nested
+    timed iterators (a chunker pulling from a text extractor) are excluded from
+    the outer one's time, so each stage reports its own share of a pipeline.
+    """
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            stack = _timed_frames()
+            frame = [0.0]  # time spent in nested timed iterators
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                total += elapsed - frame[0]
+                if stack:
+                    stack[-1][0] += elapsed
+            yield item
+    finally:
+        observe(STAGE_SECONDS, total, help="Time spent per stage", stage=stage, **labels)
+
+
+# --- exposition ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshots):
+    """Prometheus text format for [(extra labels, snapshot), ...]"""
+    merged = {}
+    for extra, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            entry = merged.setdefault(name, {**metric, "series": []})
+            for key, value in metric["series"].items():
+                entry["series"].append((tuple(sorted(extra.items())) + key, value))
+
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        if metric["help"]:
+            lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in metric["series"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(tuple(metric["buckets"]) + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(key + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(key)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# --- other processes ---
+
+_remote = {}  # process name -> latest snapshot
+
+
+def start_export(exports, process_name, interval=METRICS_EXPORT_SECONDS):
+    """Send this process's snapshot to the collecting process every `interval` seconds"""
+    def exporter():
+        while True:
+            time.sleep(interval)
+            try:
+                exports.put_nowait((process_name, registry.snapshot()))
+            except queue.Full:
+                pass
+            except Exception as e:
+                print(f"❌ Metrics export failed: {e}")
+
+    threading.Thread(target=exporter, name="metrics-export", daemon=True).start()
+
+
+def collect(exports):
+    """Keep the latest snapshot each process sends on `exports` (a multiprocessing queue)"""
+    def collector():
+        while True:
+            process_name, snapshot = exports.get()
+            _remote[process_name] = snapshot
+
+    threading.Thread(target=collector, name="metrics-collect", daemon=True).start()
+
+
+def render_all(process_name="web"):
+    return render([({"process": process_name}, registry.snapshot())]
+                  + [({"process": name}, snapshot) for name, snapshot in sorted(_remote.items())])
+
+
+# --- sampling profiler ---
+
+def _folded(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def start_profiler(process_name=None, hz=METRICS_PROFILE_HZ, directory=METRICS_PROFILE_DIR,
+                   flush_seconds=METRICS_PROFILE_FLUSH_SECONDS):
+    """
+    Sample every thread's stack `hz` times a second and periodically write the
+    counts as folded stacks (flamegraph.pl / speedscope input) to
+    <directory>/<process>-<pid>.folded. Does nothing when hz is 0.
+    """
+    if hz <= 0:
+        return
+    process_name = process_name or multiprocessing.current_process().name
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{process_name}-{os.getpid()}.folded")
+    samples = Counter()
+
+    def sampler():
+        me = threading.get_ident()
+        names = {}
+        next_flush = time.monotonic() + flush_seconds
+        while True:
+            time.sleep(1.0 / hz)
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                samples[f"{names.get(ident, ident)};{_folded(frame)}"] += 1
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + flush_seconds
+                try:
+                    with open(path + ".tmp", "w", encoding="utf-8") as f:
+                        f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+                    os.replace(path + ".tmp", path)
+                except OSError as e:
+                    print(f"❌ Writing profile failed: {e}")
+
+    threading.Thread(target=sampler, name="metrics-profiler", daemon=True).start()
+    print(f"✅ Sampling profiler at {hz:g} Hz writing {path}")
@@ -0,0 +1,2 @@
+-- Page / timestamp ranges produced by chunker.iter_token_chunks
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS metadata JSONB NOT NULL DEFAULT '{}'::jsonb;
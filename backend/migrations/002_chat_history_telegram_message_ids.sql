@@ -0,0 +1,9 @@
+-- Telegram message ids a chat_history row was received / sent as, so /flag is an index lookup
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS telegram_message_ids BIGINT[] NOT NULL DEFAULT '{}';
+CREATE INDEX IF NOT EXISTS chat_history_telegram_message_ids_idx ON chat_history USING GIN (telegram_message_ids);
+-- "previous question in this chat" and per-chat history reads
+CREATE INDEX IF NOT EXISTS chat_history_chat_id_created_at_idx ON chat_history (chat_id, created_at DESC);
+
+-- One flag per answer, so flagging the same answer twice is a no-op
+ALTER TABLE flagged_answers ADD COLUMN IF NOT EXISTS chat_history_id BIGINT;
+CREATE UNIQUE INDEX IF NOT EXISTS flagged_answers_chat_history_id_idx ON flagged_answers (chat_history_id);
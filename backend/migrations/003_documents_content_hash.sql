@@ -0,0 +1,4 @@
+-- sha256 of documents.content, so re-ingesting a file only embeds chunks that changed
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+-- re-ingestion diffs a file's rows by file_storage_path
+CREATE INDEX IF NOT EXISTS documents_file_storage_path_idx ON documents (file_storage_path);
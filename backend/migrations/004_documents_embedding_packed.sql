@@ -0,0 +1,49 @@
+-- Packed embeddings written with EMBEDDING_ENCODING=float16|int8 (see embedding_codec.py): one format byte,
+-- then little-endian float16 values (1), or a float32 scale and int8 values (2)
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_packed BYTEA;
+
+CREATE OR REPLACE FUNCTION unpack_embedding(packed BYTEA) RETURNS REAL[]
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+  SELECT CASE get_byte(packed, 0)
+    WHEN 1 THEN ARRAY(
+      SELECT ((CASE WHEN e = 0 THEN m * 2.0 ^ (-24) ELSE (1024 + m) * 2.0 ^ (e - 25) END) * (1 - 2 * s))::REAL
+      FROM generate_series(0, (length(packed) - 1) / 2 - 1) AS i,
+           LATERAL (SELECT get_byte(packed, 1 + 2 * i) + get_byte(packed, 2 + 2 * i) * 256 AS h) AS half,
+           LATERAL (SELECT h >> 15 AS s, (h >> 10) & 31 AS e, h & 1023 AS m) AS parts
+      ORDER BY i)
+    WHEN 2 THEN ARRAY(
+      SELECT ((CASE WHEN v > 127 THEN v - 256 ELSE v END) * scale)::REAL
+      FROM (
+        SELECT (1 - 2 * (bits >> 31)) * (8388608 + (bits & 8388607)) * 2.0 ^ (((bits >> 23) & 255) - 150) AS scale
+        FROM (SELECT get_byte(packed, 1)::BIGINT + get_byte(packed, 2)::BIGINT * 256
+                     + get_byte(packed, 3)::BIGINT * 65536 + get_byte(packed, 4)::BIGINT * 16777216 AS bits) AS raw
+      ) AS header,
+      generate_series(5, length(packed) - 1) AS i,
+      LATERAL (SELECT get_byte(packed, i) AS v) AS value
+      ORDER BY i)
+  END
+$$;
+
+-- Keep the pgvector column (and so match_documents) in step with the packed one
+CREATE OR REPLACE FUNCTION documents_unpack_embedding() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.embedding_packed IS NOT NULL
+     AND (TG_OP = 'INSERT' OR NEW.embedding_packed IS DISTINCT FROM OLD.embedding_packed) THEN
+    NEW.embedding := unpack_embedding(NEW.embedding_packed);
+  END IF;
+  RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS documents_unpack_embedding ON documents;
+CREATE TRIGGER documents_unpack_embedding BEFORE INSERT OR UPDATE OF embedding_packed ON documents
+  FOR EACH ROW EXECUTE FUNCTION documents_unpack_embedding();
+
+-- Changing EMBEDDING_DIMENSIONS (e.g. to 1024) also changes the column type. With ingestion paused:
+--   ALTER TABLE documents DISABLE TRIGGER documents_unpack_embedding;
+--   set EMBEDDING_DIMENSIONS=1024 and EMBEDDING_ENCODING=float16 (or int8), POST /api/reencode {"all": true}
+--   ALTER TABLE documents ALTER COLUMN embedding TYPE halfvec(1024) USING unpack_embedding(embedding_packed)::halfvec(1024);
+--   ALTER TABLE documents ENABLE TRIGGER documents_unpack_embedding;
+--   recreate match_documents with a halfvec(1024) query argument, then restart the bot.
+-- halfvec halves the column and allows an HNSW index up to 4000 dimensions (vector: 2000):
+--   CREATE INDEX documents_embedding_hnsw_idx ON documents USING hnsw (embedding halfvec_cosine_ops);
@@ -0,0 +1,78 @@
+# OCR for scanned PDF pages. Kept separate from ingestion so pool workers only
+# import fitz/PIL/pytesseract instead of the whole backend (clients, Flask app, jobs).
+# Those libraries are imported on first use so the web process starts without them.
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Render so the longest page side is about this many pixels (3300px = Letter at 300 DPI)
+OCR_TARGET_PIXELS = int(os.getenv("OCR_TARGET_PIXELS", "3300"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+
+_worker_doc = None
+
+
+def page_dpi(page):
+    """Pick a DPI that gives tesseract enough pixels without over-rendering large pages"""
+    longest_inches = max(page.rect.width, page.rect.height) / 72
+    if longest_inches <= 0:
+        return OCR_MAX_DPI
+    dpi = int(OCR_TARGET_PIXELS / longest_inches)
+    return max(OCR_MIN_DPI, min(OCR_MAX_DPI, dpi))
+
+
+def ocr_page(page):
+    import fitz
+    from PIL import Image
+    import pytesseract
+    # Render straight to 8-bit grayscale and hand the raw samples to PIL (no PNG round-trip)
+    pix = page.get_pixmap(dpi=page_dpi(page), colorspace=fitz.csGRAY, alpha=False)
+    img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return pytesseract.image_to_string(img, lang=OCR_LANG)
+
+
+def open_pdf(source):
+    """Open a PDF from a file path or raw bytes"""
+    import fitz
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _init_worker(source):
+    global _worker_doc
+    _worker_doc = open_pdf(source)
+
+
+def _ocr_worker_page(page_number):
+    return page_number, ocr_page(_worker_doc[page_number])
+
+
+def ocr_pages(source, page_numbers, workers=OCR_WORKERS):
+    """
+    OCR the given 0-based page numbers of a PDF (file path or bytes).
+    Yields (page_number, text) in page order.
+    Pages are spread across a process pool; each worker opens the document once.
+    """
+    page_numbers = sorted(page_numbers)
+    if not page_numbers:
+        return
+    workers = max(1, min(workers, len(page_numbers)))
+    if workers == 1:
+        doc = open_pdf(source)
+        for page_number in page_numbers:
+            yield page_number, ocr_page(doc[page_number])
+        return
+
+    # fork, not spawn: spawn re-imports the entry script (wsgi.py starts the services at import).
+    # Forked workers only touch fitz/PIL/tesseract, so the parent's other threads don't matter.
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(source,)) as pool:
+        yield from pool.map(_ocr_worker_page, page_numbers)
@@ -0,0 +1,140 @@
+import os
+from tokenizer import count_tokens, truncate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_REFERENCES_MAX_TOKENS = int(os.getenv("PROMPT_REFERENCES_MAX_TOKENS", "3500"))
+PROMPT_HISTORY_MESSAGE_MAX_TOKENS = int(os.getenv("PROMPT_HISTORY_MESSAGE_MAX_TOKENS", "300"))
+PROMPT_HISTORY_FULL_TURNS = int(os.getenv("PROMPT_HISTORY_FULL_TURNS", "4"))
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY", "0.9"))
+
+# Per-message framing overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _source(doc):
+    return doc.get("file_storage_path") or doc.get("file_name") or doc.get("file_path")
+
+
+def _join_overlapping(first, second, max_overlap=400):
+    """Concatenate two texts, dropping the words at the start of second that repeat the end of first"""
+    a, b = first.split(), second.split()
+    for k in range(min(len(a), len(b), max_overlap), 4, -1):
+        if a[-k:] == b[:k]:
+            return " ".join(a + b[k:])
+    return first + "\n" + second
+
+
+def merge_adjacent(docs):
+    """
+    Merge retrieved chunks that are chunk_index neighbours from the same file into
+    one reference (removing their overlap). Merged references keep the position of
+    their best-ranked member.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        source = _source(doc)
+        if source is None or doc.get("chunk_index") is None:
+            groups[("doc", rank)] = [(rank, doc)]
+        else:
+            groups.setdefault(("file", source), []).append((rank, doc))
+
+    merged = []
+    for members in groups.values():
+        members.sort(key=lambda m: m[1].get("chunk_index") or 0)
+        run = [members[0]]
+        for member in members[1:]:
+            if member[1]["chunk_index"] == run[-1][1]["chunk_index"] + 1:
+                run.append(member)
+            else:
+                merged.append(_merge_run(run))
+                run = [member]
+        merged.append(_merge_run(run))
+    merged.sort(key=lambda m: m[0])
+    return [doc for _, doc in merged]
+
+
+def _merge_run(run):
+    if len(run) == 1:
+        return run[0]
+    best_rank = min(rank for rank, _ in run)
+    doc = dict(run[0][1])
+    for _, other in run[1:]:
+        doc["content"] = _join_overlapping(doc["content"], other["content"])
+    doc["merged_ids"] = [d["id"] for _, d in run]
+    metadata = dict(doc.get("metadata") or {})
+    last_metadata = run[-1][1].get("metadata") or {}
+    if "page_end" in last_metadata:
+        metadata["page_end"] = last_metadata["page_end"]
+    if "end" in last_metadata:
+        metadata["end"] = last_metadata["end"]
+    doc["metadata"] = metadata
+    return best_rank, doc
+
+
+def _shingles(text, size=3):
+    words = text.lower().split()
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(docs, threshold=NEAR_DUPLICATE_SIMILARITY):
+    """Drop references whose word shingles are near-identical to (or contained in) a better-ranked one"""
+    kept, kept_shingles = [], []
+    for doc in docs:
+        shingles = _shingles(doc["content"])
+        duplicate = False
+        for other in kept_shingles:
+            overlap = len(shingles & other)
+            if overlap / max(1, len(shingles | other)) >= threshold or overlap / max(1, len(shingles)) >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def fit_references(blocks, budget):
+    """Keep reference blocks in rank order until the token budget is used up"""
+    kept, used = [], 0
+    for block in blocks:
+        tokens = count_tokens(block) + 2
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining > 100 and not kept:
+                kept.append(truncate_tokens(block, remaining))
+                used = budget
+            break
+        kept.append(block)
+        used += tokens
+    return kept, used
+
+
+def fit_history(messages, budget):
+    """
+    Keep the newest history messages that fit in the budget. Only the last
+    PROMPT_HISTORY_FULL_TURNS messages are kept whole; older ones are cut to
+    PROMPT_HISTORY_MESSAGE_MAX_TOKENS.
+    """
+    kept, used = [], 0
+    for age, message in enumerate(reversed(messages)):
+        if age >= PROMPT_HISTORY_FULL_TURNS:
+            message = {**message, "content": truncate_tokens(message["content"], PROMPT_HISTORY_MESSAGE_MAX_TOKENS)}
+        tokens = message_tokens(message)
+        if used + tokens > budget:
+            # cut the message that crosses the budget instead of dropping it outright
+            remaining = budget - used - MESSAGE_OVERHEAD_TOKENS
+            if remaining >= 50:
+                message = {**message, "content": truncate_tokens(message["content"], remaining)}
+                kept.append(message)
+                used += message_tokens(message)
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return kept, used
@@ -0,0 +1,71 @@
+import os
+import time
+import asyncio
+from telegram.error import RetryAfter
+
+# Telegram allows about 30 messages per second overall and about 1 per second in one chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold sends for `seconds` (after Telegram answered with RetryAfter): the next token is ready then"""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+
+class TelegramRateLimiter:
+    """A global bucket plus one bucket per chat; every send waits on both"""
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= 10000:
+                # forget idle chats; a fresh bucket starts full, which is what an idle one would be anyway
+                for key in [k for k, b in self.chats.items() if b.tokens >= b.capacity][:5000]:
+                    del self.chats[key]
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def call(self, method, chat_id, **kwargs):
+        """await method(chat_id=chat_id, **kwargs) within the rate limits, retrying on RetryAfter"""
+        bucket = self._chat_bucket(chat_id)
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                # the next acquire() waits the pause out
+                bucket.pause(e.retry_after)
@@ -0,0 +1,229 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import httpx
+import metrics
+
+# Shared HTTP client layer for Supabase and OpenAI: keep-alive pools, timeouts,
+# jittered retries and a circuit breaker per upstream.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_SECONDS = float(os.getenv("HTTP_BACKOFF_SECONDS", "0.25"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "8"))
+# consecutive failures that open an upstream's circuit, and how long it stays open
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# 429 is the upstream asking us to slow down, not failing: it is retried but does not trip the breaker
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FAILURE_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of sending a request while the upstream's circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed requests, failing fast for
+    `reset_seconds`. Then one trial request is let through (half-open):
+    success closes the circuit, failure opens it again. A trial that ends
+    without either (cancelled, or another exception) is replaced by a new
+    one after `reset_seconds`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, name, failures=CIRCUIT_FAILURES, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge("coaching_circuit_state", state, upstream=self.name)
+
+    def before(self):
+        """Raise CircuitOpenError unless a request may be sent now"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            # opened_at doubles as the start of the half-open trial
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.opened_at = time.monotonic()
+                self._set_state(self.HALF_OPEN)
+                return
+        metrics.inc("coaching_circuit_rejected_total", upstream=self.name)
+        raise CircuitOpenError(f"{self.name} circuit is open after {self.failures} consecutive failures")
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+                print(f"✅ {self.name} circuit closed")
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+                metrics.inc("coaching_circuit_opened_total", upstream=self.name)
+                print(f"⚠️ {self.name} circuit open for {self.reset_seconds:.0f}s after {self.failures} failures")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """The per-process circuit breaker of an upstream, shared by its sync and async clients"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def _reset_after_fork():
+    global _breakers_lock
+    _breakers.clear()
+    _breakers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def retry_delay(attempt, response=None):
+    """Retry-After when the upstream sent one, else exponential backoff with full jitter"""
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_SECONDS * 2 ** attempt))
+
+
+class _RetryPolicy:
+    """
+    What to retry: connection failures always (the request never reached the
+    upstream); timeouts, dropped connections and RETRY_STATUSES only when
+    `replay_safe(request)` says sending the request twice is harmless.
+    """
+
+    def __init__(self, name, retries, replay_safe):
+        self.name = name
+        self.retries = retries
+        self.replay_safe = replay_safe or (lambda request: request.method in IDEMPOTENT_METHODS)
+        self.breaker = breaker(name)
+
+    def on_error(self, request, error, attempt):
+        """Seconds to wait before retrying after a transport error, or None to raise it"""
+        self.breaker.failure()
+        connect_failed = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+        if attempt >= self.retries or not (connect_failed or self.replay_safe(request)):
+            return None
+        metrics.inc("coaching_upstream_retries_total", upstream=self.name, reason=type(error).__name__)
+        return retry_delay(attempt)
+
+    def on_response(self, request, response, attempt):
+        """Seconds to wait before retrying this response, or None to return it"""
+        if response.status_code in FAILURE_STATUSES:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+            return None
+        if response.status_code != 429 and not self.replay_safe(request):
+            return None
+        metrics.inc("coaching_upstream_retries_total", upstream=self.name, reason=str(response.status_code))
+        return retry_delay(attempt, response)
+
+
+class RetryTransport(httpx.BaseTransport):
+    def __init__(self, transport, policy):
+        self.transport = transport
+        self.policy = policy
+
+    def handle_request(self, request):
+        attempt = 0
+        while True:
+            self.policy.breaker.before()
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                delay = self.policy.on_error(request, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.policy.on_response(request, response, attempt)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport, policy):
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request):
+        attempt = 0
+        while True:
+            self.policy.breaker.before()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                delay = self.policy.on_error(request, e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.policy.on_response(request, response, attempt)
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _limits():
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_SECONDS)
+
+
+def _timeout(read_seconds):
+    return httpx.Timeout(read_seconds, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+def client(name, read_timeout, proxy=None, http2=False, retries=HTTP_RETRIES, replay_safe=None):
+    """A pooled httpx.Client for one upstream, retrying and tripping the upstream's breaker as above"""
+    transport = httpx.HTTPTransport(limits=_limits(), proxy=proxy, http2=http2)
+    return httpx.Client(transport=RetryTransport(transport, _RetryPolicy(name, retries, replay_safe)),
+                        timeout=_timeout(read_timeout), follow_redirects=True)
+
+
+def async_client(name, read_timeout, proxy=None, http2=False, retries=HTTP_RETRIES, replay_safe=None):
+    """The httpx.AsyncClient counterpart of client()"""
+    transport = httpx.AsyncHTTPTransport(limits=_limits(), proxy=proxy, http2=http2)
+    return httpx.AsyncClient(transport=AsyncRetryTransport(transport, _RetryPolicy(name, retries, replay_safe)),
+                             timeout=_timeout(read_timeout), follow_redirects=True)
@@ -0,0 +1,60 @@
+import os
+from bm25 import tokenize
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")  # vector | bm25 | hybrid
+RETRIEVAL_RERANK = os.getenv("RETRIEVAL_RERANK", "off") == "on"
+# candidates fetched from each retriever per requested result before fusing
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "4"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+MODES = ("vector", "bm25", "hybrid")
+
+
+def rrf_fuse(result_lists, k, c=RRF_K):
+    """
+    Reciprocal rank fusion: each list adds 1 / (c + rank) to a document's score.
+    Returns the top k documents with an "rrf" score, best first.
+    """
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (c + rank)
+            # keep the first copy, merging scores the other retriever attached
+            docs[doc["id"]] = {**doc, **docs.get(doc["id"], {})}
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**docs[doc_id], "rrf": scores[doc_id]} for doc_id in ranked]
+
+
+def rerank(query, docs, weight=0.5):
+    """
+    Cheap local rerank of fused candidates: boost documents that contain more
+    of the query's distinct terms, and most of all ones containing the whole
+    query phrase. Keeps the fused order as the main signal.
+    """
+    terms = set(tokenize(query))
+    if not terms or not docs:
+        return docs
+    phrase = " ".join(query.lower().split())
+    top = max(doc.get("rrf", 0.0) for doc in docs) or 1.0
+    scored = []
+    for position, doc in enumerate(docs):
+        content = doc.get("content") or ""
+        coverage = len(terms & set(tokenize(content))) / len(terms)
+        exact = 1.0 if len(phrase) > 3 and phrase in " ".join(content.lower().split()) else 0.0
+        base = doc.get("rrf", 1.0 / (1 + position)) / top
+        scored.append((base + weight * coverage + weight * exact, -position, doc))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [{**doc, "rerank": score} for score, _, doc in scored]
+
+
+def combine(query, vector_docs, keyword_docs, k, mode=RETRIEVAL_MODE, use_rerank=RETRIEVAL_RERANK):
+    """Final top k for a mode, from vector and keyword candidates (either may be None when unavailable)"""
+    if mode == "bm25" and keyword_docs is not None:
+        results = keyword_docs[:k * RETRIEVAL_CANDIDATES]
+    elif mode == "hybrid" and keyword_docs is not None and vector_docs is not None:
+        results = rrf_fuse([vector_docs, keyword_docs], k * RETRIEVAL_CANDIDATES)
+    else:
+        results = vector_docs or []
+    if use_rerank:
+        results = rerank(query, results)
+    return results[:k]
@@ -0,0 +1,118 @@
+import time
+import threading
+from typing import NamedTuple
+
+# Bot settings held locally in every process as one immutable snapshot.
+# Readers just call current(); a change replaces the whole snapshot (a single
+# reference swap) and is sent to the other processes over multiprocessing Pipes.
+# The web process is the hub: it has a pipe to every bot process and forwards
+# a change received from one of them to the others.
+
+
+class BotSettings(NamedTuple):
+    is_bot: bool = True
+    telegram_username: str = ""  # "@name" of the coach
+
+
+_current = BotSettings()
+# set once real settings arrived (loaded from Supabase here or received from the other process)
+loaded = threading.Event()
+_subscribers = []
+_connections = []
+_send_lock = threading.Lock()
+
+
+def current():
+    return _current
+
+
+def from_metadata(user_metadata):
+    """Snapshot from the admin user's Supabase user_metadata"""
+    return BotSettings(
+        is_bot=bool(user_metadata.get("is_bot", True)),
+        telegram_username=user_metadata.get("telegram_id") or "",
+    )
+
+
+def subscribe(callback):
+    """callback(old, new) is called after every change seen by this process"""
+    _subscribers.append(callback)
+
+
+def _apply(snapshot):
+    global _current
+    old, _current = _current, snapshot
+    if old != snapshot:
+        for callback in _subscribers:
+            try:
+                callback(old, snapshot)
+            except Exception as e:
+                print(f"❌ Settings change handler failed: {e}")
+
+
+def _send(snapshot, skip=None):
+    with _send_lock:
+        for connection in _connections:
+            if connection is skip:
+                continue
+            try:
+                connection.send(tuple(snapshot))
+            except (BrokenPipeError, OSError) as e:
+                print(f"❌ Sending settings to another process failed: {e}")
+
+
+def set_settings(snapshot):
+    """Replace the settings here and in the connected processes"""
+    _apply(snapshot)
+    loaded.set()
+    _send(snapshot)
+
+
+def update(**changes):
+    set_settings(_current._replace(**changes))
+    return _current
+
+
+def connect(connection, initial=None):
+    """
+    Use one end of a multiprocessing Pipe to exchange settings with another
+    process: changes made here are sent on it, changes received are applied
+    (and passed on to any other connected process). Pass `initial` only when
+    it holds real settings: it marks them loaded.
+    """
+    if initial is not None:
+        _apply(BotSettings(*initial))
+        loaded.set()
+    with _send_lock:
+        _connections.append(connection)
+
+    def listener():
+        while True:
+            try:
+                snapshot = BotSettings(*connection.recv())
+            except (EOFError, OSError):
+                return
+            _apply(snapshot)
+            loaded.set()
+            _send(snapshot, skip=connection)
+
+    threading.Thread(target=listener, name="settings", daemon=True).start()
+
+
+def load_in_background(fetch_metadata, retry_seconds=5):
+    """Fetch the settings off the startup path, retrying until Supabase answers"""
+    def loader():
+        while True:
+            try:
+                set_settings(from_metadata(fetch_metadata()))
+                return
+            except Exception as e:
+                print(f"❌ Loading bot settings failed, retrying in {retry_seconds}s: {e}")
+                time.sleep(retry_seconds)
+
+    threading.Thread(target=loader, name="settings-loader", daemon=True).start()
+
+
+def is_admin(user):
+    """Whether a Telegram user is the coach"""
+    return user.username is not None and user.username == _current.telegram_username.lstrip("@")
@@ -0,0 +1,95 @@
+import os
+import asyncio
+import threading
+import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for `key` is in flight,
+    other callers with the same key wait for it and share its result (or
+    exception) instead of making their own upstream request.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        # fresh=True calls waiting for the in-flight one to finish before they start
+        self._next = {}
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._next = {}
+
+    def do(self, key, fn, fresh=False):
+        """
+        fn() once per key at a time. With fresh=True the result must come from a
+        call started after this one arrived (e.g. reading settings just written),
+        so an in-flight call is not joined: its waiters share the next call instead.
+        """
+        with self._lock:
+            running = self._calls.get(key)
+            shared = None
+            if fresh and running is not None:
+                shared = self._next.get(key)
+                if shared is None:
+                    call = self._next[key] = _Call()
+            elif running is not None:
+                shared = running
+            else:
+                call = self._calls[key] = _Call()
+        if shared is not None:
+            return self._wait(shared)
+        if running is not None:
+            running.done.wait()
+            with self._lock:
+                self._next.pop(key, None)
+                self._calls.setdefault(key, call)
+        metrics.inc("coaching_singleflight_total", call=self.name, result="leader")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def _wait(self, call):
+        metrics.inc("coaching_singleflight_total", call=self.name, result="shared")
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop"""
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, coro_factory):
+        task = self._tasks.get(key)
+        if task is None:
+            metrics.inc("coaching_singleflight_total", call=self.name, result="leader")
+            task = self._tasks[key] = asyncio.ensure_future(coro_factory())
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+        else:
+            metrics.inc("coaching_singleflight_total", call=self.name, result="shared")
+        # one caller being cancelled must not cancel the call the others wait on
+        return await asyncio.shield(task)
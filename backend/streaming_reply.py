@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+from telegram.error import BadRequest, RetryAfter
+
+TELEGRAM_MAX_MESSAGE = 4096
+# Telegram tolerates roughly one edit per second per message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "40"))
+
+
+def split_point(text, limit=TELEGRAM_MAX_MESSAGE):
+    """Where to cut text so the first part fits in one message, preferring paragraph, line, then word breaks"""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut != -1:
+            return cut + len(separator)
+    return limit
+
+
+class StreamingReply:
+    """
+    Shows a streamed answer in Telegram: the first message is sent as soon
+    as text arrives, then edited in place at most every `interval` seconds.
+    Text past Telegram's 4096-character limit continues in a new message.
+    """
+
+    def __init__(self, bot, chat_id, reply_to_message_id=None, interval=STREAM_EDIT_INTERVAL, min_chars=STREAM_MIN_CHARS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.interval = interval
+        self.min_chars = min_chars
+        self.messages = []
+        self.text = ""       # text of the message currently being edited
+        self.shown = ""      # what that message currently displays
+        self.last_edit = 0.0
+
+    async def _call(self, method, **kwargs):
+        while True:
+            try:
+                return await method(**kwargs)
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return None
+                raise
+
+    async def _show(self):
+        if self.text == self.shown or not self.text.strip():
+            return
+        if not self.messages or self.messages[-1] is None:
+            message = await self._call(
+                self.bot.send_message,
+                chat_id=self.chat_id,
+                text=self.text,
+                reply_to_message_id=self.reply_to_message_id if not self.messages else None,
+            )
+            if self.messages:
+                self.messages[-1] = message
+            else:
+                self.messages.append(message)
+        else:
+            await self._call(
+                self.bot.edit_message_text,
+                chat_id=self.chat_id,
+                message_id=self.messages[-1].message_id,
+                text=self.text,
+            )
+        self.shown = self.text
+        self.last_edit = time.monotonic()
+
+    async def append(self, delta):
+        self.text += delta
+        # roll over into a new message once this one is full
+        while len(self.text) > TELEGRAM_MAX_MESSAGE:
+            cut = split_point(self.text)
+            rest = self.text[cut:]
+            self.text = self.text[:cut].rstrip()
+            await self._show()
+            self.messages.append(None)
+            self.text, self.shown = rest.lstrip(), ""
+        first = not self.messages
+        due = time.monotonic() - self.last_edit >= self.interval and len(self.text) - len(self.shown) >= self.min_chars
+        if first or due:
+            await self._show()
+
+    async def finish(self):
+        await self._show()
+        return [m for m in self.messages if m is not None]
@@ -1,24 +1,52 @@
 import os
+import sys
+import signal
+import contextlib
 from dotenv import load_dotenv
-import threading
 import asyncio
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ChatAction
-from multiprocessing import Process
-from chat_agent import chat_with_bot
-from utils import supabase, ADMIN_ID
+from multiprocessing import Process, current_process
+from chat_agent import chat_with_bot, stream_chat_with_bot, record_turn, memory
+from streaming_reply import StreamingReply
+from utils import get_supabase, get_async_supabase, ADMIN_ID
+from rate_limit import TelegramRateLimiter
+import transcripts
+import vector_index
+import bm25
+import retrieval
+import flags
+import settings
+import webhook
+import document_events
+import metrics
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# How many updates the bot handles at once
+BOT_MAX_CONCURRENCY = int(os.getenv("BOT_MAX_CONCURRENCY", "32"))
+# Stream answers into the chat as they are generated instead of sending them when complete
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "on") == "on"
+# "polling": one bot process polls Telegram; "webhook": Telegram posts to the Flask app,
+# which spreads updates over TELEGRAM_WORKERS bot processes
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+TELEGRAM_WORKERS = int(os.getenv("TELEGRAM_WORKERS", "2"))
+# Bot API endpoint, for a self-hosted Bot API server (or the benchmark stand-in)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")
+# How long a message waits after a restart for the coach's settings before it is turned away
+SETTINGS_WAIT_SECONDS = float(os.getenv("SETTINGS_WAIT_SECONDS", "10"))
+
+telegram_limiter = TelegramRateLimiter()
 
 async def typing_action(chat_id: int, context: ContextTypes.DEFAULT_TYPE, stop_event: asyncio.Event):
     """Background task: repeatedly send typing action until stopped."""
     try:
         while not stop_event.is_set():
-            print(">>> Sending typing action...")
             await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
             await asyncio.sleep(3)  # repeat every few seconds
+    except asyncio.CancelledError:
+        pass
     except Exception as e:
         print("Typing task stopped with error:", e)
 
@@ -28,44 +56,55 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
 
     print(f"Received from {user.first_name} (@{user.username}): {text}")
-    share_ns = context.bot_data["share_ns"]
-    is_bot = share_ns.is_bot
-    telegram_username = share_ns.telegram_username
-    
-    if is_bot == False:
-        await update.message.reply_text(f"AI bot is not working now. Please contact with coach({telegram_username}).")
+    # until the first snapshot arrives the defaults would answer even if the coach has taken over
+    if not settings.loaded.is_set() and not await asyncio.to_thread(settings.loaded.wait, SETTINGS_WAIT_SECONDS):
+        await update.message.reply_text("The bot is starting up. Please send your message again in a moment.")
         return
-    # This will hold the result
-    result = {}
-
-    result['answer'] = ""
-    def bot_thread():
-        result['answer'] = chat_with_bot(chat_id, user, text)
+    bot_settings = settings.current()
 
-    thread = threading.Thread(target=bot_thread)
-    thread.start()
-
-    # While the thread is alive, send typing action
-    try:
-        while thread.is_alive():
-            await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            await asyncio.sleep(2)  # resend every 2 seconds
-    except Exception as e:
-        print("Typing action error:", e)
+    if bot_settings.is_bot == False:
+        await update.message.reply_text(f"AI bot is not working now. Please contact with coach({bot_settings.telegram_username}).")
+        return
+    # whole reply: retrieval, completion and sending, as the user experiences it
+    with metrics.span("telegram.reply", streaming="on" if STREAM_REPLIES else "off"), metrics.in_flight("coaching_replies_in_flight"):
+        # Keep the typing indicator up until the first words (or the whole answer) arrive
+        stop_typing = asyncio.Event()
+        typing_task = asyncio.create_task(typing_action(chat_id, context, stop_typing))
+        result = {}
+        answer = None
+        messages = []
+        try:
+            if STREAM_REPLIES:
+                reply = StreamingReply(context.bot, chat_id, reply_to_message_id=update.message.message_id)
+                async for delta in stream_chat_with_bot(chat_id, user, text, result):
+                    stop_typing.set()
+                    await reply.append(delta)
+                messages = await reply.finish()
+            else:
+                answer = await chat_with_bot(chat_id, user, text, result)
+        finally:
+            stop_typing.set()
+            typing_task.cancel()
 
-    thread.join()
-    # Send the answer
-    if result['answer'] != "":
-        await update.message.reply_text(result['answer'])
+        try:
+            # Send the answer
+            if answer:
+                messages = [await update.message.reply_text(answer)]
+        finally:
+            # saved after sending so the reply's message ids are known to /flag
+            record_turn(
+                chat_id, user, text, result,
+                question_message_id=update.message.message_id,
+                reply_message_ids=[m.message_id for m in messages],
+            )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    share_ns = context.bot_data["share_ns"]
-    telegram_username = share_ns.telegram_username
-    if update.message.from_user.username != telegram_username[1:]:
+    if not settings.is_admin(update.message.from_user):
         await update.message.reply_text("Hello! I am coach-firat AI bot. Send /help for commands.")
     else:
-        supabase.auth.admin.update_user_by_id(
+        await asyncio.to_thread(
+            get_supabase().auth.admin.update_user_by_id,
             ADMIN_ID,
             {
                 "user_metadata": {
@@ -76,66 +115,83 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Hello! I am coach-firat AI bot for admin. Send /help for commands.")
 
 async def flag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /flag as a reply to a bot answer (or to a transcript message), or
+    /flag <id> <id> ... with the #ids shown in /transcript, to flag many at once.
+    """
     try:
-        share_ns = context.bot_data["share_ns"]
-        telegram_username = share_ns.telegram_username
         chat_id = update.effective_chat.id
-        if update.message.from_user.username != telegram_username[1:]:
+        if not settings.is_admin(update.message.from_user):
             return
-        histories = supabase.table("chat_history")\
-                    .select("id, username,role, message, document_ids")\
-                    .order("created_at")\
-                    .limit(60)\
-                    .execute()
-        index = None
-        for i, d in enumerate(histories.data):
-            if d["message"] == update.message.reply_to_message.text.split(": ", 1)[1]:
-                index = i
-        
-        print(index)
-        if index == None or index - 1 < 0 or histories.data[index]["role"] != "bot":
+        # answers sent moments ago may still be waiting in the write-behind buffer. A replied-to
+        # answer is in this chat, whose updates (webhook mode too) all go to this process's buffer
+        await asyncio.to_thread(memory.flush)
+
+        answers = []
+        row_ids = flags.parse_row_ids(context.args or [])
+        replied = update.message.reply_to_message
+        if row_ids:
+            answers = await flags.answers_by_id(row_ids)
+        elif replied is not None:
+            answers = await flags.answers_by_message(chat_id, [replied.message_id])
+            if not answers and flags.tagged_row_ids(replied.text):
+                answers = await flags.answers_by_id(flags.tagged_row_ids(replied.text))
+            if not answers and replied.text and ": " in replied.text:
+                answers = await flags.answers_by_text(replied.text.split(": ", 1)[1])
+
+        if not answers:
+            await update.message.reply_text("Reply to a bot answer with /flag, or send /flag <id> ... with ids from /transcript.")
             return
-        print(index)
-        item = histories.data[index]
-        supabase.table("flagged_answers").insert({"question":histories.data[index - 1]["message"], "answer":item["message"], "document_ids":item["document_ids"]}).execute()
-        print("successfully flaged!")
-        await context.bot.send_message(chat_id=chat_id, text="successfully flaged!")
-        
+        count = await flags.flag_answers(answers)
+        print(f"successfully flaged {count} answers!")
+        await context.bot.send_message(chat_id=chat_id, text="successfully flaged!" if count == 1 else f"successfully flaged {count} answers!")
+
     except Exception as e:
-        print("Typing action error:", e)
+        print("Flag error:", e)
 
 
 async def transcript(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    share_ns = context.bot_data["share_ns"]
-    telegram_username = share_ns.telegram_username
-    if update.message.from_user.username != telegram_username[1:]:
+    if not settings.is_admin(update.message.from_user):
         return
     chat_id = update.effective_chat.id
     try:
-        histories = supabase.table("chat_history")\
-                    .select("id, username, role, message")\
-                    .order("created_at")\
-                    .limit(50)\
-                    .execute()
-        # Replay each message in order
-        for msg in histories.data:
-            username = msg["username"]
-            role = msg["role"]
-            prefix = f"👤{username}: " if role == "user" else "🤖 Bot: "
-            await context.bot.send_message(chat_id=chat_id, text=prefix + msg["message"])
-    except:
+        query = transcripts.parse_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    try:
+        db = await get_async_supabase()
+        rows = transcripts.iter_rows(db, query)
+        with_chat = query.chat_ids is None or len(query.chat_ids) > 1
+        if query.file_format:
+            document, count = await transcripts.render_file(rows, query.file_format, with_chat)
+            if count:
+                await telegram_limiter.call(
+                    context.bot.send_document, chat_id,
+                    document=document,
+                    filename=f"transcript.{query.file_format}",
+                    caption=f"{count} messages",
+                )
+        else:
+            # Many history rows per Telegram message, paced to stay under the flood limits
+            count = 0
+            async for text in transcripts.pack_messages(transcripts.format_lines(rows, with_chat)):
+                await telegram_limiter.call(context.bot.send_message, chat_id, text=text)
+                count += 1
+        if not count:
+            await update.message.reply_text("No messages found.")
+    except Exception as e:
+        print("Transcript error:", e)
         await context.bot.send_message(chat_id=chat_id, text="Now you can't see history")
 
 async def takeover(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    share_ns = context.bot_data["share_ns"]
-    telegram_username = share_ns.telegram_username
-    if update.message.from_user.username != telegram_username[1:]:
+    if not settings.is_admin(update.message.from_user):
         await update.message.reply_text("Hello! I am coach-firat AI bot.")
         return
     
-    share_ns = context.bot_data["share_ns"]
-    n_is_bot = False if share_ns.is_bot else True
-    supabase.auth.admin.update_user_by_id(
+    n_is_bot = False if settings.current().is_bot else True
+    await asyncio.to_thread(
+            get_supabase().auth.admin.update_user_by_id,
             ADMIN_ID,
             {
                 "user_metadata": {
@@ -143,7 +199,7 @@ async def takeover(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 }
             }
         )
-    share_ns.is_bot = n_is_bot
+    settings.update(is_bot=n_is_bot)
 
     if n_is_bot:
         await update.message.reply_text("Bot is working now.")
@@ -154,9 +210,7 @@ async def takeover(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Handler for /help command
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    share_ns = context.bot_data["share_ns"]
-    telegram_username = share_ns.telegram_username
-    if update.message.from_user.username != telegram_username[1:]:
+    if not settings.is_admin(update.message.from_user):
         await update.message.reply_text("""
                                     Available commands:\n
                                     /start - start bot\n
@@ -167,30 +221,156 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                     Available commands:\n
                                     /start - start bot\n
                                     /help - this help \n
-                                    /transcript – Pulls latest conversation logs. \n
-                                    /flag – Marks a specific response for later review. \n
+                                    /transcript – Pulls conversation logs (chat=, user=, from=, to=, file=txt|json). \n
+                                    /flag – Marks a specific response for later review (reply to it, or /flag <id> ...). \n
                                     /takeover – Stops AI replies and hands conversation to human.
                                     
                                     """)
 
-def run_telegram_bot(share_ns):
-    telegram_app = Application.builder().token(TELEGRAM_TOKEN).build()
-    telegram_app.bot_data["share_ns"] = share_ns
+def setup_bot_process(settings_connection, initial_settings, document_events_queue=None, metrics_queue=None):
+    settings.connect(settings_connection, initial_settings)
+    if metrics_queue is not None:
+        metrics.start_export(metrics_queue, current_process().name)
+    metrics.start_profiler()
+    if document_events_queue is not None:
+        document_events.start_listener(document_events_queue)
+    if vector_index.enabled():
+        vector_index.start_sync(get_supabase())
+    if retrieval.RETRIEVAL_MODE != "vector":
+        bm25.start_sync(get_supabase())
+
+
+class ChatLocks:
+    """Per-chat asyncio locks, dropped once no update of the chat is waiting"""
+
+    def __init__(self):
+        self.locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        # asyncio.Lock wakes waiters first-come first-served, so a chat's updates run in arrival order
+        entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
+
+
+def update_chat_key(update):
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Up to max_concurrent_updates updates at a time, but one at a time per chat (polling mode)"""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks = ChatLocks()
+
+    async def do_process_update(self, update, coroutine):
+        # polling starts updates in arrival order and the semaphore is FIFO, so each chat's lock is taken in order
+        async with self.chat_locks.hold(update_chat_key(update)):
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def build_application(with_updater=True):
+    # webhook workers order updates per chat before they reach PTB (serve_updates)
+    processor = ChatOrderedUpdateProcessor(BOT_MAX_CONCURRENCY) if with_updater else BOT_MAX_CONCURRENCY
+    builder = Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(processor)
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    if not with_updater:
+        # webhook workers get their updates from the web process, not from Telegram
+        builder = builder.updater(None)
+    telegram_app = builder.build()
     telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     telegram_app.add_handler(CommandHandler("start", start))
     telegram_app.add_handler(CommandHandler("help", help_command))
     telegram_app.add_handler(CommandHandler("flag", flag))
     telegram_app.add_handler(CommandHandler("transcript", transcript))
     telegram_app.add_handler(CommandHandler("takeover", takeover))
+    return telegram_app
 
 
+def run_telegram_bot(settings_connection, initial_settings, document_events_queue=None, metrics_queue=None):
+    setup_bot_process(settings_connection, initial_settings, document_events_queue, metrics_queue)
+    telegram_app = build_application()
+
     print("Telegram Bot is started!")
-    telegram_app.run_polling()
+    try:
+        telegram_app.run_polling()
+    finally:
+        # Process children skip atexit, so flush buffered chat history explicitly
+        memory.close()
 
-def run_bot_in_thread(ns):
-    
-    p = Process(target=run_telegram_bot, args=(ns,))
+
+async def _process_in_chat_order(telegram_app, update, key, chat_locks):
+    try:
+        async with chat_locks.hold(key):
+            await telegram_app.update_processor.process_update(update, telegram_app.process_update(update))
+    except Exception as e:
+        print(f"❌ Handling update {update.update_id} failed: {e}")
+
+
+async def serve_updates(telegram_app, updates):
+    """Handle raw updates from a multiprocessing queue until a None arrives"""
+    loop = asyncio.get_running_loop()
+    chat_locks = ChatLocks()
+    tasks = set()
+    async with telegram_app:
+        await telegram_app.start()
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            update = Update.de_json(data, telegram_app.bot)
+            task = asyncio.create_task(_process_in_chat_order(telegram_app, update, webhook.chat_key(data), chat_locks))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        await telegram_app.stop()
+
+
+def run_webhook_worker(settings_connection, initial_settings, document_events_queue, metrics_queue, updates):
+    setup_bot_process(settings_connection, initial_settings, document_events_queue, metrics_queue)
+    telegram_app = build_application(with_updater=False)
+
+    # the web process stops workers by queueing a None (Ctrl+C reaches the whole process group);
+    # SIGTERM on its own unwinds, so buffered chat history is still written below
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Telegram webhook worker {os.getpid()} is started!")
+    try:
+        asyncio.run(serve_updates(telegram_app, updates))
+    finally:
+        memory.close()
+
+
+def run_bot_in_thread(settings_connection, document_events_queue=None, updates=None, metrics_queue=None, name="bot"):
+    """Start the bot in a child process: polling, or a webhook worker fed from `updates`"""
+    initial = tuple(settings.current()) if settings.loaded.is_set() else None
+    args = (settings_connection, initial, document_events_queue, metrics_queue)
+    if updates is None:
+        p = Process(target=run_telegram_bot, args=args, name=name)
+    else:
+        p = Process(target=run_webhook_worker, args=args + (updates,), name=name)
     p.start()
+    return p
 
 if __name__ == "__main__":
     run_bot_in_thread()
@@ -0,0 +1,60 @@
+"""
+Re-ingesting a document diffs against its stored chunks, also when the
+dashboard re-uploads it under a new storage path. Runs against the offline
+stand-ins in benchmarks.fakes:
+
+    cd backend
+    python -m pytest tests
+"""
+import pytest
+from benchmarks import fakes
+from benchmarks.bench_chunker import synthetic_text
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+@pytest.fixture(scope="module")
+def backend():
+    fake = fakes.start(dim=64, embedding_latency=0.0)
+    # backend modules read their settings at import, so they come after the fakes
+    import ingestion
+    yield fake.supabase, ingestion
+    fake.stop()
+
+
+def ingest(backend, storage_path, text, file_name="handbook.txt"):
+    supabase, ingestion = backend
+    supabase.put_file("coaching-files", storage_path, text.encode("utf-8"))
+    stats = {}
+    ingestion.process_file(storage_path, file_name, storage_path, "txt", USER_ID,
+                           progress=lambda **progress: stats.update(progress))
+    rows = [r for r in supabase.tables.get("documents", []) if r["file_name"] == file_name]
+    return {k: stats.get(k, 0) for k in ("inserted", "reused", "updated", "deleted")}, rows
+
+
+def test_reupload_under_new_path_reuses_rows(backend):
+    text = synthetic_text(4000, seed=1)
+    first, rows = ingest(backend, "1-a.txt", text)
+    assert first["inserted"] > 1 and first["reused"] == 0
+
+    again, rows_again = ingest(backend, "2-b.txt", text)
+    assert again == {"inserted": 0, "reused": first["inserted"], "updated": first["inserted"], "deleted": 0}
+    assert sorted(r["id"] for r in rows_again) == sorted(r["id"] for r in rows)
+    assert {r["file_storage_path"] for r in rows_again} == {"2-b.txt"}
+
+
+def test_edited_reupload_replaces_changed_chunks(backend):
+    text = synthetic_text(4000, seed=2)
+    first, _ = ingest(backend, "1-c.txt", text, file_name="notes.txt")
+    edited = text + "\n\n" + synthetic_text(1500, seed=3)
+    again, rows = ingest(backend, "2-d.txt", edited, file_name="notes.txt")
+    assert again["inserted"] >= 1 and again["reused"] >= 1
+    assert len(rows) == again["inserted"] + again["reused"]
+    assert {r["file_storage_path"] for r in rows} == {"2-d.txt"}
+
+
+def test_empty_extraction_keeps_stored_rows(backend):
+    first, rows = ingest(backend, "1-e.txt", synthetic_text(2000, seed=4), file_name="scan.txt")
+    again, rows_again = ingest(backend, "2-f.txt", "", file_name="scan.txt")
+    assert again["deleted"] == 0
+    assert len(rows_again) == len(rows) == first["inserted"]
@@ -0,0 +1,21 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """cl100k_base, the encoding used by text-embedding-3-* models; loaded on first use"""
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens"""
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
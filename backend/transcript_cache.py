@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+
+
+class TranscriptCache:
+    """
+    Persistent YouTube transcript cache stored in SQLite, keyed by video id.
+    A transcript is a list of (text, start, duration) segments; re-importing
+    a video reads it from here instead of fetching it again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # SQLite connections must not cross a fork, so reconnect per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    video_id TEXT PRIMARY KEY,
+                    language TEXT,
+                    segments BLOB NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, video_id):
+        """(segments, language) or None"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT segments, language FROM transcripts WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [tuple(segment) for segment in json.loads(zlib.decompress(row[0]))], row[1]
+
+    def put(self, video_id, segments, language=None):
+        blob = zlib.compress(json.dumps([list(segment) for segment in segments], ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, language, segments, fetched_at) VALUES (?, ?, ?, ?)",
+                (video_id, language, blob, time.time())
+            )
+            conn.commit()
+
+    def delete(self, video_id):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM transcripts WHERE video_id = ?", (video_id,))
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,148 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from streaming_reply import split_point, TELEGRAM_MAX_MESSAGE
+
+TRANSCRIPT_COLUMNS = "id, chat_id, username, fullname, role, message, created_at"
+TRANSCRIPT_PAGE_SIZE = 1000
+# what /transcript shows when no chat, user or date range is given
+DEFAULT_PERIOD = timedelta(days=1)
+
+USAGE = """/transcript [chat=<chat id>] [user=<@username or user id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD] [file=txt|json]
+Without chat/user/from, the last 24 hours of all chats are shown."""
+
+
+class TranscriptQuery:
+    def __init__(self, chat_ids=None, user=None, since=None, until=None, file_format=None):
+        self.chat_ids = chat_ids
+        self.user = user
+        self.since = since
+        self.until = until
+        self.file_format = file_format
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def parse_args(args):
+    """Build a TranscriptQuery from /transcript key=value arguments; raises ValueError with a usage hint"""
+    query = TranscriptQuery()
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep or not value:
+            raise ValueError(USAGE)
+        key = key.lower()
+        if key == "chat":
+            query.chat_ids = [int(v) for v in value.split(",")]
+        elif key == "user":
+            query.user = value.lstrip("@")
+        elif key == "from":
+            query.since = _parse_date(value)
+        elif key == "to":
+            # inclusive: up to the end of that day
+            query.until = _parse_date(value) + timedelta(days=1)
+        elif key == "file":
+            if value not in ("txt", "json"):
+                raise ValueError(USAGE)
+            query.file_format = value
+        else:
+            raise ValueError(USAGE)
+    if query.chat_ids is None and query.user is None and query.since is None:
+        query.since = datetime.now(timezone.utc) - DEFAULT_PERIOD
+    return query
+
+
+async def resolve_user_chats(db, user):
+    """Chats a user wrote in, by username or numeric Telegram user id"""
+    column = "user_id" if user.isdigit() else "username"
+    rows = await db.table("chat_history")\
+                .select("chat_id")\
+                .eq(column, int(user) if user.isdigit() else user)\
+                .eq("role", "user")\
+                .order("created_at", desc=True)\
+                .limit(1000)\
+                .execute()
+    return list(dict.fromkeys(row["chat_id"] for row in rows.data))
+
+
+async def iter_rows(db, query, page_size=TRANSCRIPT_PAGE_SIZE):
+    """Yield the matching chat_history rows oldest first, paging with a (created_at, id) keyset"""
+    chat_ids = query.chat_ids
+    if query.user is not None:
+        user_chats = await resolve_user_chats(db, query.user)
+        chat_ids = user_chats if chat_ids is None else [c for c in chat_ids if c in user_chats]
+        if not chat_ids:
+            return
+    after = None
+    while True:
+        request = db.table("chat_history")\
+                    .select(TRANSCRIPT_COLUMNS)\
+                    .order("created_at")\
+                    .order("id")\
+                    .limit(page_size)
+        if chat_ids is not None:
+            request = request.in_("chat_id", chat_ids)
+        if query.since is not None:
+            request = request.gte("created_at", query.since.isoformat())
+        if query.until is not None:
+            request = request.lt("created_at", query.until.isoformat())
+        if after is not None:
+            created_at, row_id = after
+            request = request.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})')
+        rows = (await request.execute()).data
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["created_at"], rows[-1]["id"]
+
+
+def format_line(row, with_chat=False):
+    # starts with "#<id> " so /flag can find the row from a reply to the transcript
+    when = (row.get("created_at") or "")[:16].replace("T", " ")
+    speaker = f"👤{row['username'] or row.get('fullname') or ''}" if row["role"] == "user" else "🤖 Bot"
+    chat = f" [{row['chat_id']}]" if with_chat else ""
+    return f"#{row['id']} {when}{chat} {speaker}: {row['message']}"
+
+
+async def pack_messages(lines, limit=TELEGRAM_MAX_MESSAGE):
+    """Join lines into as few Telegram-sized messages as possible; lines longer than a message are split"""
+    current = ""
+    async for line in lines:
+        while len(line) > limit:
+            if current:
+                yield current
+                current = ""
+            cut = split_point(line, limit)
+            yield line[:cut].rstrip()
+            line = line[cut:].lstrip()
+        if current and len(current) + 2 + len(line) > limit:
+            yield current
+            current = ""
+        current = f"{current}\n\n{line}" if current else line
+    if current:
+        yield current
+
+
+async def format_lines(rows, with_chat=False):
+    async for row in rows:
+        yield format_line(row, with_chat)
+
+
+async def render_file(rows, file_format, with_chat=False):
+    """The transcript as an in-memory txt or JSON file; returns (file object, row count)"""
+    buffer = io.BytesIO()
+    count = 0
+    if file_format == "json":
+        buffer.write(b"[")
+        async for row in rows:
+            buffer.write((b",\n" if count else b"\n") + json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            count += 1
+        buffer.write(b"\n]\n")
+    else:
+        async for row in rows:
+            buffer.write(format_line(row, with_chat).encode("utf-8") + b"\n\n")
+            count += 1
+    buffer.seek(0)
+    return buffer, count
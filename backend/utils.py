@@ -1,10 +1,10 @@
 import os
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from openai import OpenAI
-import openai
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api.proxies import GenericProxyConfig
+import asyncio
+from embedding_cache import EmbeddingCache
+from singleflight import SingleFlight, AsyncSingleFlight
+import metrics
 
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -12,41 +12,210 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ADMIN_ID = os.getenv("ADMIN_ID")
 mode = os.getenv("MODE")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+# 0 = the model's full size (3072 for text-embedding-3-large); must match the documents.embedding column
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# Read timeouts in seconds; connect/pool timeouts, retries and the circuit breaker are set in resilience.py
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-user_metadata = supabase.auth.admin.get_user_by_id(ADMIN_ID).user.user_metadata
-
-if mode == "develop":
-    proxy_url = os.getenv("PROXY_URL")
-    os.environ["HTTP_PROXY"] = proxy_url
-    os.environ["HTTPS_PROXY"] = proxy_url
-    openai.proxy = {
-        "http": proxy_url,
-        "https": proxy_url,
-    }
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-os.environ["HTTP_PROXY"] = ""
-os.environ["HTTPS_PROXY"] = ""
-if mode == "develop":
-    ytt_api = YouTubeTranscriptApi(
-        proxy_config=GenericProxyConfig(
-            http_url=proxy_url,
-            https_url=proxy_url,
-        )
+# Clients are created on first use, once per process (a forked child builds its
+# own instead of sharing the parent's connection pools), so importing this
+# module does no network I/O and does not load the client libraries.
+_clients = {}
+_clients_lock = threading.RLock()
+
+
+def _reset_clients():
+    global _clients_lock, _async_supabase, _async_supabase_lock
+    _clients.clear()
+    _clients_lock = threading.RLock()
+    _async_supabase = None
+    _async_supabase_lock = asyncio.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_clients)
+
+
+def _per_process(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def proxy_url():
+    """Outgoing proxy for OpenAI and YouTube in develop mode"""
+    return os.getenv("PROXY_URL") if mode == "develop" else None
+
+
+def _supabase_replay_safe(request):
+    # match_documents and the other RPCs only read, so they may be sent again like a GET
+    return request.method in ("GET", "HEAD", "OPTIONS") or request.url.path.startswith("/rest/v1/rpc/")
+
+
+def get_supabase_http():
+    """The pooled, retrying httpx.Client behind get_supabase(), also used for Storage downloads"""
+    def create():
+        import resilience
+        return resilience.client("supabase", SUPABASE_TIMEOUT, http2=True, replay_safe=_supabase_replay_safe)
+    return _per_process("supabase_http", create)
+
+
+def get_supabase():
+    def create():
+        from supabase import create_client
+        from supabase.lib.client_options import SyncClientOptions
+        return create_client(SUPABASE_URL, SUPABASE_KEY, options=SyncClientOptions(httpx_client=get_supabase_http()))
+    return _per_process("supabase", create)
+
+
+def get_openai():
+    def create():
+        import resilience
+        from openai import OpenAI
+        # retries happen in the transport, under the shared backoff policy and circuit breaker
+        http_client = resilience.client("openai", OPENAI_TIMEOUT, proxy=proxy_url(), replay_safe=lambda request: True)
+        return OpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0, timeout=http_client.timeout)
+    return _per_process("openai", create)
+
+
+def get_async_openai():
+    def create():
+        import resilience
+        from openai import AsyncOpenAI
+        http_client = resilience.async_client("openai", OPENAI_TIMEOUT, proxy=proxy_url(), replay_safe=lambda request: True)
+        return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0, timeout=http_client.timeout)
+    return _per_process("async_openai", create)
+
+
+def get_ytt_api():
+    def create():
+        from youtube_transcript_api import YouTubeTranscriptApi
+        from youtube_transcript_api.proxies import GenericProxyConfig
+        proxy = proxy_url()
+        if proxy:
+            return YouTubeTranscriptApi(proxy_config=GenericProxyConfig(http_url=proxy, https_url=proxy))
+        return YouTubeTranscriptApi()
+    return _per_process("ytt_api", create)
+
+
+_admin_flight = SingleFlight("admin_metadata")
+
+
+def fetch_admin_metadata(fresh=False):
+    """
+    The coach's Supabase user_metadata (bot settings). Network call, not cached,
+    but concurrent callers share one fetch; fresh=True waits for a fetch started
+    after the call, for reading settings that were just changed.
+    """
+    return _admin_flight.do(
+        ADMIN_ID, lambda: get_supabase().auth.admin.get_user_by_id(ADMIN_ID).user.user_metadata, fresh=fresh
     )
+
+
+# Set EMBEDDING_CACHE_PATH="" to disable the local embedding cache
+if EMBEDDING_CACHE_PATH:
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
 else:
-    ytt_api = YouTubeTranscriptApi()
+    embedding_cache = None
 
 
-def embed_text(text):
-    """Get OpenAI embedding for a chunk of text"""
-    resp = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-large"  # or "large" if you want higher quality
+_async_supabase = None
+_async_supabase_lock = asyncio.Lock()
+
+
+async def get_async_supabase():
+    """Async Supabase client for the bot's event loop, created on first use"""
+    global _async_supabase
+    async with _async_supabase_lock:
+        if _async_supabase is None:
+            import resilience
+            from supabase import acreate_client
+            from supabase.lib.client_options import AsyncClientOptions
+            http_client = resilience.async_client("supabase", SUPABASE_TIMEOUT, http2=True, replay_safe=_supabase_replay_safe)
+            _async_supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY,
+                                                   options=AsyncClientOptions(httpx_client=http_client))
+    return _async_supabase
+
+
+def _embedding_options():
+    return {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+
+
+def _cache_model():
+    # vectors of different sizes must not share cache entries
+    return f"{EMBEDDING_MODEL}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+
+
+def _lookup_cached(texts):
+    """Return (cached embeddings aligned with texts, unique texts that still need embedding)"""
+    if embedding_cache is None:
+        cached = [None] * len(texts)
+    else:
+        cached = embedding_cache.get_many(_cache_model(), texts)
+    # Only send texts we have never embedded, once each
+    missing = list(dict.fromkeys(t for t, e in zip(texts, cached) if e is None))
+    metrics.inc("coaching_embedding_cache_total", len(texts) - len(missing), result="hit")
+    metrics.inc("coaching_embedding_cache_total", len(missing), result="miss")
+    return cached, missing
+
+
+_embed_flight = SingleFlight("embedding")
+_aembed_flight = AsyncSingleFlight("embedding")
+
+
+def _request_embeddings(missing):
+    resp = get_openai().embeddings.create(
+        input=missing,
+        model=EMBEDDING_MODEL,
+        **_embedding_options()
     )
-    
-    data = resp.data
-    embeddings = [item.embedding for item in data]
-    return embeddings
\ No newline at end of file
+    return _store_fresh(missing, resp)
+
+
+async def _arequest_embeddings(missing):
+    resp = await get_async_openai().embeddings.create(
+        input=missing,
+        model=EMBEDDING_MODEL,
+        **_embedding_options()
+    )
+    return await asyncio.to_thread(_store_fresh, missing, resp)
+
+
+def _store_fresh(missing, resp):
+    fresh = dict(zip(missing, [item.embedding for item in resp.data]))
+    if embedding_cache is not None:
+        embedding_cache.put_many(_cache_model(), missing, [fresh[t] for t in missing])
+    return fresh
+
+
+def _merge(texts, cached, fresh):
+    return [e if e is not None else fresh[t] for t, e in zip(texts, cached)]
+
+
+def embed_text(text):
+    """Get OpenAI embeddings for a chunk of text (or a list of chunks), served from the local cache when possible"""
+    texts = [text] if isinstance(text, str) else list(text)
+    cached, missing = _lookup_cached(texts)
+    if not missing:
+        return cached
+    # identical requests in flight (e.g. several users asking the same question) share one API call
+    fresh = _embed_flight.do((_cache_model(), tuple(missing)), lambda: _request_embeddings(missing))
+    return _merge(texts, cached, fresh)
+
+
+async def aembed_text(text):
+    """Async version of embed_text"""
+    texts = [text] if isinstance(text, str) else list(text)
+    # the cache is SQLite: read it off the event loop
+    cached, missing = await asyncio.to_thread(_lookup_cached, texts)
+    if not missing:
+        return cached
+    fresh = await _aembed_flight.do((_cache_model(), tuple(missing)), lambda: _arequest_embeddings(missing))
+    return _merge(texts, cached, fresh)
@@ -0,0 +1,316 @@
+import os
+import time
+import threading
+import numpy as np
+import document_events
+import embedding_codec
+
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "off")  # "local" to search in-process, "off" to always use match_documents
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")  # float32 | float16 | int8
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))  # IVF clusters, 0 = brute force
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+VECTOR_INDEX_REFRESH_SECONDS = int(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "300"))
+
+META_COLUMNS = ("id", "content", "file_name", "file_path", "file_type", "file_storage_path", "chunk_index", "metadata")
+# metadata plus the embedding in the configured EMBEDDING_ENCODING
+ROW_COLUMNS = META_COLUMNS + (embedding_codec.column(),)
+
+
+class VectorIndex:
+    """
+    In-memory cosine-similarity index over documents embeddings.
+    Vectors are L2-normalised and stored as float32, float16 or int8
+    (per-row scale). Search is brute force, or IVF over k-means clusters
+    once nlist > 0 and there is enough data to train.
+    """
+
+    def __init__(self, dtype="float32", nlist=0, nprobe=8):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported vector index dtype: {dtype}")
+        self.dtype = dtype
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dim = None
+        self.size = 0
+        self.ids = []
+        self.meta = []
+        self.positions = {}
+        self.matrix = None
+        self.scales = None
+        self.centroids = None
+        self.assignments = None
+        self.trained_size = 0
+        self.lock = threading.RLock()
+
+    # --- storage ---
+
+    def _encode(self, vectors):
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), np.ones(len(vectors), dtype=np.float32)
+
+    def _reserve(self, count):
+        capacity = 0 if self.matrix is None else len(self.matrix)
+        if self.size + count <= capacity:
+            return
+        new_capacity = max(1024, capacity * 2, self.size + count)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.int8 if self.dtype == "int8" else self.dtype)
+        scales = np.ones(new_capacity, dtype=np.float32)
+        assignments = np.zeros(new_capacity, dtype=np.int32)
+        if self.matrix is not None:
+            matrix[:self.size] = self.matrix[:self.size]
+            scales[:self.size] = self.scales[:self.size]
+            assignments[:self.size] = self.assignments[:self.size]
+        self.matrix, self.scales, self.assignments = matrix, scales, assignments
+
+    def _meta(self, row):
+        meta = {c: row.get(c) for c in META_COLUMNS}
+        meta["link"] = row.get("file_path") if row.get("file_type") == "link" else None
+        return meta
+
+    def upsert(self, rows):
+        """
+        Add or replace rows: dicts with an "embedding" or "embedding_packed" plus
+        the META_COLUMNS fields. Rows without one only update the metadata of rows
+        already indexed.
+        """
+        decoded = [(row, embedding_codec.decode_row(row)) for row in rows]
+        with self.lock:
+            for row, vector in decoded:
+                if vector is None and row["id"] in self.positions:
+                    self.meta[self.positions[row["id"]]] = self._meta(row)
+        decoded = [(row, vector) for row, vector in decoded if vector is not None]
+        if not decoded:
+            return
+        rows = [row for row, _ in decoded]
+        vectors = np.stack([vector for _, vector in decoded])
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+            encoded, scales = self._encode(vectors)
+            self._reserve(len(rows))
+            for row, vector, scale in zip(rows, encoded, scales):
+                position = self.positions.get(row["id"])
+                if position is None:
+                    position = self.size
+                    self.size += 1
+                    self.ids.append(row["id"])
+                    self.meta.append(None)
+                    self.positions[row["id"]] = position
+                self.matrix[position] = vector
+                self.scales[position] = scale
+                self.meta[position] = self._meta(row)
+                if self.centroids is not None:
+                    self.assignments[position] = self._nearest_centroids(vector.astype(np.float32) * scale, 1)[0]
+            if self.nlist and self.size >= max(self.nlist * 39, 2 * self.trained_size):
+                self.train()
+
+    def remove(self, ids):
+        with self.lock:
+            for doc_id in ids:
+                position = self.positions.pop(doc_id, None)
+                if position is None:
+                    continue
+                last = self.size - 1
+                if position != last:
+                    # move the last row into the hole
+                    self.matrix[position] = self.matrix[last]
+                    self.scales[position] = self.scales[last]
+                    self.assignments[position] = self.assignments[last]
+                    self.ids[position] = self.ids[last]
+                    self.meta[position] = self.meta[last]
+                    self.positions[self.ids[position]] = position
+                self.ids.pop()
+                self.meta.pop()
+                self.size -= 1
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, doc_id):
+        return doc_id in self.positions
+
+    # --- IVF ---
+
+    def _nearest_centroids(self, vector, count):
+        scores = self.centroids @ vector
+        if count >= len(scores):
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, count)[:count]
+        return top[np.argsort(-scores[top])]
+
+    def train(self, iterations=10, sample_size=50_000, seed=0):
+        """Run spherical k-means over (a sample of) the vectors and assign every row to a cluster"""
+        with self.lock:
+            if not self.nlist or self.size < self.nlist:
+                return
+            rng = np.random.default_rng(seed)
+            data = self._dense(np.arange(self.size))
+            sample = data[rng.choice(self.size, min(sample_size, self.size), replace=False)]
+            centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(self.nlist):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            self.centroids = centroids
+            for start in range(0, self.size, 65_536):
+                block = data[start:start + 65_536]
+                self.assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            self.trained_size = self.size
+
+    # --- search ---
+
+    def _dense(self, positions):
+        return self.matrix[positions].astype(np.float32) * self.scales[positions, None]
+
+    def _scores(self, candidates, query):
+        """Score all rows (candidates=None) or the given row positions against a normalised query"""
+        matrix = self.matrix[:self.size] if candidates is None else self.matrix[candidates]
+        if self.dtype == "float32":
+            return matrix @ query
+        # numpy has no BLAS path for float16/int8, so upcast in blocks to bound memory
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), 65_536):
+            scores[start:start + 65_536] = matrix[start:start + 65_536].astype(np.float32) @ query
+        if self.dtype == "int8":
+            scores *= self.scales[:self.size] if candidates is None else self.scales[candidates]
+        return scores
+
+    def search(self, query, k=5):
+        """Return the k most similar rows as dicts with a "similarity" score, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        with self.lock:
+            if self.size == 0:
+                return []
+            if self.centroids is not None:
+                probes = self._nearest_centroids(query, self.nprobe)
+                candidates = np.flatnonzero(np.isin(self.assignments[:self.size], probes))
+            else:
+                candidates = None
+
+            scores = self._scores(candidates, query)
+
+            k = min(k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for i in top:
+                position = i if candidates is None else candidates[i]
+                results.append({**self.meta[position], "similarity": float(scores[i])})
+            return results
+
+
+index = VectorIndex(dtype=VECTOR_INDEX_DTYPE, nlist=VECTOR_INDEX_NLIST, nprobe=VECTOR_INDEX_NPROBE)
+ready = threading.Event()
+
+
+def enabled():
+    return VECTOR_INDEX == "local"
+
+
+def fetch_rows(supabase, page_size=500, after=None, columns=ROW_COLUMNS):
+    """Yield documents rows with keyset pagination on id"""
+    while True:
+        query = supabase.table("documents").select(", ".join(columns)).order("id").limit(page_size)
+        if after is not None:
+            query = query.gt("id", after)
+        rows = query.execute().data
+        if not rows:
+            return
+        yield from rows
+        after = rows[-1]["id"]
+        if len(rows) < page_size:
+            return
+
+
+def with_unpacked(supabase, rows):
+    """
+    Fill in `embedding` for rows without a packed one. With a packed
+    EMBEDDING_ENCODING, rows written before the switch only have the pgvector
+    column until /api/reencode has run; it is fetched for those rows alone, as
+    the trigger also fills it on every packed row.
+    """
+    if embedding_codec.column() == "embedding":
+        return rows
+    unpacked = [row["id"] for row in rows if row.get("embedding_packed") is None]
+    embeddings = {}
+    for start in range(0, len(unpacked), 200):
+        ids = unpacked[start:start + 200]
+        for row in supabase.table("documents").select("id, embedding").in_("id", ids).execute().data:
+            embeddings[row["id"]] = row["embedding"]
+    for row in rows:
+        if row["id"] in embeddings:
+            row["embedding"] = embeddings[row["id"]]
+    return rows
+
+
+def load(supabase):
+    start = time.time()
+    batch = []
+    for row in fetch_rows(supabase):
+        batch.append(row)
+        if len(batch) == 1000:
+            index.upsert(with_unpacked(supabase, batch))
+            batch = []
+    index.upsert(with_unpacked(supabase, batch))
+    ready.set()
+    print(f"✅ Vector index loaded {len(index)} documents in {time.time() - start:.1f}s")
+
+
+def refresh(supabase):
+    """Reconcile with the documents table: drop deleted rows and load rows we never saw"""
+    remote_ids = [row["id"] for row in fetch_rows(supabase, page_size=5000, columns=("id",))]
+    remote = set(remote_ids)
+    with index.lock:
+        stale = [doc_id for doc_id in index.ids if doc_id not in remote]
+    index.remove(stale)
+    missing = [doc_id for doc_id in remote_ids if doc_id not in index]
+    for start in range(0, len(missing), 200):
+        ids = missing[start:start + 200]
+        rows = supabase.table("documents").select(", ".join(ROW_COLUMNS)).in_("id", ids).execute().data
+        index.upsert(with_unpacked(supabase, rows))
+    if stale or missing:
+        print(f"✅ Vector index refreshed: -{len(stale)} +{len(missing)}")
+
+
+def apply_event(kind, payload):
+    if kind == "upsert":
+        index.upsert(payload)
+    elif kind == "delete":
+        index.remove(payload)
+
+
+def start_sync(supabase):
+    """Load the index in the background, then keep it current from document events and periodic refreshes"""
+    def loader():
+        try:
+            load(supabase)
+        except Exception as e:
+            print(f"❌ Vector index load failed, using match_documents: {e}")
+            return
+        while True:
+            time.sleep(max(1, VECTOR_INDEX_REFRESH_SECONDS))
+            try:
+                refresh(supabase)
+            except Exception as e:
+                print(f"❌ Vector index refresh failed: {e}")
+
+    document_events.subscribe(apply_event)
+    threading.Thread(target=loader, name="vector-index-loader", daemon=True).start()
+
+
+def search(query_embedding, k=5):
+    """Top-k from the local index, or None when it is disabled or still loading"""
+    if not enabled() or not ready.is_set():
+        return None
+    return index.search(query_embedding, k)
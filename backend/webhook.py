@@ -0,0 +1,154 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+import hmac
+import zlib
+import httpx
+from flask import request, jsonify
+
+# Webhook mode: Telegram POSTs updates to the Flask app, which drops retries it
+# has already seen (by update_id) and hands each update to one of several bot
+# worker processes. All updates of a chat go to the same worker, which handles
+# them one at a time, so per-chat order is kept while different chats run in parallel.
+
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")  # public https URL of /telegram/webhook
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+TELEGRAM_UPDATES_DB_PATH = os.getenv("TELEGRAM_UPDATES_DB_PATH", "telegram_updates.sqlite3")
+# How long update_ids are remembered; Telegram gives up redelivering well within a day
+TELEGRAM_UPDATE_DEDUP_SECONDS = int(os.getenv("TELEGRAM_UPDATE_DEDUP_SECONDS", "86400"))
+TELEGRAM_WORKER_QUEUE_SIZE = int(os.getenv("TELEGRAM_WORKER_QUEUE_SIZE", "1000"))
+
+ALLOWED_UPDATES = ["message", "edited_message"]
+
+
+class UpdateDeduplicator:
+    """
+    Remembers seen update_ids in SQLite so a redelivered update is handled
+    once, also when several copies of the app on this host share the file.
+    """
+
+    def __init__(self, path, keep_seconds=86400):
+        self.path = path
+        self.keep_seconds = keep_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._last_prune = 0.0
+
+    def _connection(self):
+        # SQLite connections must not cross a fork, so reconnect per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS updates (update_id INTEGER PRIMARY KEY, received_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS updates_received_at ON updates(received_at)")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def first_time(self, update_id):
+        """Record update_id; False when it was already recorded"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute("INSERT OR IGNORE INTO updates (update_id, received_at) VALUES (?, ?)", (update_id, now))
+            if now - self._last_prune > 600:
+                conn.execute("DELETE FROM updates WHERE received_at < ?", (now - self.keep_seconds,))
+                self._last_prune = now
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def forget(self, update_id):
+        if update_id is None:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM updates WHERE update_id = ?", (update_id,))
+            conn.commit()
+
+
+def chat_key(data):
+    """The chat an update belongs to (or its sender, or the update itself when it has neither)"""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if field in data:
+            return data[field]["chat"]["id"]
+    callback = data.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        return message["chat"]["id"] if message else callback["from"]["id"]
+    for value in data.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+    return data.get("update_id", 0)
+
+
+def worker_for(key, workers):
+    return zlib.crc32(str(key).encode()) % workers
+
+
+class UpdateRouter:
+    """Route webhook updates to per-worker multiprocessing queues by chat"""
+
+    def __init__(self, queues, dedup):
+        self.queues = queues
+        self.dedup = dedup
+        self.received = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    def route(self, data):
+        """Returns "queued", "duplicate" or "full" (worker queue full: let Telegram retry)"""
+        update_id = data.get("update_id")
+        if update_id is not None and not self.dedup.first_time(update_id):
+            self.duplicates += 1
+            return "duplicate"
+        target = self.queues[worker_for(chat_key(data), len(self.queues))]
+        try:
+            target.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            return "full"
+        self.received += 1
+        return "queued"
+
+
+def register(flask_app, router, secret=TELEGRAM_WEBHOOK_SECRET):
+    # without the secret anyone could post updates, e.g. commands "from" the coach's username
+    if not secret:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET must be set in webhook mode")
+
+    @flask_app.route("/telegram/webhook", methods=["POST"])
+    def telegram_webhook():
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), secret.encode()):
+            return jsonify({"error": "forbidden"}), 403
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "invalid update"}), 400
+        status = router.route(data)
+        if status == "full":
+            # a non-2xx makes Telegram redeliver later; forget the id so the retry is accepted
+            router.dedup.forget(data.get("update_id"))
+            return jsonify({"status": status}), 503
+        return jsonify({"status": status})
+
+
+def set_webhook_in_background(token, url=TELEGRAM_WEBHOOK_URL, secret=TELEGRAM_WEBHOOK_SECRET, retry_seconds=10):
+    """Point Telegram at our webhook URL (off the startup path, retrying until it succeeds)"""
+    def setter():
+        payload = {"url": url, "allowed_updates": ALLOWED_UPDATES, "secret_token": secret}
+        while True:
+            try:
+                response = httpx.post(f"https://api.telegram.org/bot{token}/setWebhook", json=payload, timeout=30)
+                if response.json().get("ok"):
+                    print(f"✅ Telegram webhook set to {url}")
+                    return
+                print(f"❌ Setting Telegram webhook failed: {response.text}")
+            except Exception as e:
+                print(f"❌ Setting Telegram webhook failed: {e}")
+            time.sleep(retry_seconds)
+
+    threading.Thread(target=setter, name="telegram-set-webhook", daemon=True).start()
@@ -0,0 +1,144 @@
+import os
+import re
+import time
+import random
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qs
+from utils import get_ytt_api, proxy_url
+from transcript_cache import TranscriptCache
+import metrics
+
+# Set TRANSCRIPT_CACHE_PATH="" to disable the local transcript cache
+TRANSCRIPT_CACHE_PATH = os.getenv("TRANSCRIPT_CACHE_PATH", "transcript_cache.sqlite3")
+YOUTUBE_FETCH_RETRIES = int(os.getenv("YOUTUBE_FETCH_RETRIES", "5"))
+# Lists playlists through the YouTube Data API; without a key only the first ~100 videos of the playlist page are found
+YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY", "")
+
+if TRANSCRIPT_CACHE_PATH:
+    transcript_cache = TranscriptCache(TRANSCRIPT_CACHE_PATH)
+else:
+    transcript_cache = None
+
+
+def is_youtube_url(url):
+    # Regex to match common YouTube URL patterns
+    youtube_regex = (
+        r'(https?://)?(www\.)?'
+        r'(youtube|youtu|youtube-nocookie)\.(com|be)/'
+        r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+    )
+    youtube_regex_match = re.match(youtube_regex, url)
+    return youtube_regex_match is not None
+
+
+def extract_video_id(url):
+    # Regex to extract YouTube video ID (11 characters)
+    regex = r'(?:v=|\/embed\/|\/\d+\/|\/shorts\/|\/watch\?v=|youtu\.be\/|\/embed\/|\/v\/|\/)([a-zA-Z0-9_-]{11})'
+
+    # Find all matches
+    match = re.search(regex, url)
+
+    if match:
+        video_id = match.group(1)
+        # Ensure it's exactly 11 characters
+        if len(video_id) == 11:
+            return video_id
+    return None
+
+
+def playlist_id(url):
+    """The list id of a playlist URL (youtube.com/playlist?list=...), or None for anything else"""
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    if not parts.netloc.endswith("youtube.com") or parts.path.rstrip("/") != "/playlist":
+        return None
+    return parse_qs(parts.query).get("list", [None])[0]
+
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def canonical_url(url):
+    """The watch?v= form of a YouTube video URL (youtu.be, /shorts/, &t=... all map to it); other URLs as given"""
+    video_id = extract_video_id(url) if is_youtube_url(url) else None
+    return video_url(video_id) if video_id else url
+
+
+def watch_link(url, start=None):
+    """The video link, starting at `start` seconds when given"""
+    video_id = extract_video_id(url) if is_youtube_url(url) else None
+    if video_id is None or not start:
+        return url
+    return f"{video_url(video_id)}&t={int(start)}s"
+
+
+def _playlist_from_api(list_id):
+    import httpx
+    video_ids, page_token = [], None
+    with httpx.Client(proxy=proxy_url(), timeout=30) as client:
+        while True:
+            params = {"part": "contentDetails", "maxResults": 50, "playlistId": list_id, "key": YOUTUBE_API_KEY}
+            if page_token:
+                params["pageToken"] = page_token
+            response = client.get("https://www.googleapis.com/youtube/v3/playlistItems", params=params)
+            response.raise_for_status()
+            data = response.json()
+            video_ids.extend(item["contentDetails"]["videoId"] for item in data.get("items", []))
+            page_token = data.get("nextPageToken")
+            if not page_token:
+                return video_ids
+
+
+def _playlist_from_page(list_id):
+    import httpx
+    with httpx.Client(proxy=proxy_url(), timeout=30, headers={"Accept-Language": "en"}) as client:
+        response = client.get("https://www.youtube.com/playlist", params={"list": list_id})
+        response.raise_for_status()
+    # the page embeds its first ~100 entries as playlistVideoRenderer objects (other videoIds on it are recommendations)
+    ids = re.findall(r'"playlistVideoRenderer":\{"videoId":"([\w-]{11})"', response.text)
+    if len(ids) >= 100:
+        print(f"⚠️ Playlist {list_id}: only the first {len(ids)} videos are listed without YOUTUBE_API_KEY")
+    return ids
+
+
+def expand_playlist(list_id):
+    """Video ids of a playlist, in playlist order without repeats"""
+    ids = _playlist_from_api(list_id) if YOUTUBE_API_KEY else _playlist_from_page(list_id)
+    return list(dict.fromkeys(ids))
+
+
+@lru_cache(maxsize=None)
+def retryable_errors():
+    # youtube_transcript_api (and requests, which it uses) are imported on first use
+    import requests
+    from youtube_transcript_api import RequestBlocked, YouTubeRequestFailed
+    return (RequestBlocked, YouTubeRequestFailed, requests.ConnectionError, requests.Timeout)
+
+
+def fetch_transcript(video_id, retries=YOUTUBE_FETCH_RETRIES):
+    """
+    The video's transcript as (text, start, duration) segments, from the local
+    cache when it was fetched before. Retries with backoff when YouTube blocks
+    or rate-limits the request; other errors (no transcript, private video) raise.
+    """
+    if transcript_cache is not None:
+        cached = transcript_cache.get(video_id)
+        metrics.inc("coaching_transcript_cache_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached[0]
+    for attempt in range(retries + 1):
+        try:
+            transcript = get_ytt_api().fetch(video_id)
+            break
+        except retryable_errors() as e:
+            metrics.inc("coaching_transcript_retries_total", error=type(e).__name__)
+            if attempt == retries:
+                raise
+            # exponential backoff with full jitter, capped at 60s
+            delay = random.uniform(0, min(60, 2 ** attempt))
+            print(f"⚠️ Transcript of {video_id} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    segments = [(snippet.text, snippet.start, snippet.duration) for snippet in transcript]
+    if transcript_cache is not None:
+        transcript_cache.put(video_id, segments, getattr(transcript, "language_code", None))
+    return segments